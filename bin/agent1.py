@@ -1,23 +1,287 @@
 #!/usr/bin/python2.6
+'''
+agent1 keep the public suffix pattern of a consumer node in sync with the latest version published by public_suffix_generator
+Following is specification of the sync:
 
+    The manifest '<aws_s3_prefix>/public_suffix.manifest.json' is read with a conditional GET (If-None-Match of the last ETag),
+    so an unchanged manifest costs one 304 response and no download.
+    If the latest version of the manifest is not the installed one, the pattern is downloaded beside the installed pattern,
+    its md5 (of the uncompressed content) and size are verified against the manifest, then it is renamed over the installed pattern.
+    If the manifest has the deltas from the installed version to the latest one, the deltas are downloaded and applied to the installed
+    pattern instead, and the patched rules are verified against the md5 of the rules in the manifest (see pattern_delta).
+    A broken delta chain, a chain which is larger than the pattern, or a patch which is not verified falls back to the full download.
+    After a new pattern is installed, every process in the notify pid files is sent the notify signal (SIGHUP by default),
+    e.g. public_suffix_server reloads its table on SIGHUP.
+    The installed pattern is '<ptn_dir>/public_suffix.txt<extension>', the extension of the codec of the version in the manifest,
+    e.g. public_suffix.txt.xz of a version published with lzma, and the pattern of the previous codec is removed when the codec changes.
+    The installed version, its codec and the ETag of the manifest are kept in '<ptn_dir>/public_suffix.sync.json', so a restarted agent
+    does not download the pattern again.
 
-def return_a():
-    return 'a'
+usage:  python agent1.py -c agent1.conf [--once]
 
-def return_b():
-    return 'b'
+'''
+import conf_util
+import aws_s3_util
+import pattern_codec
+import pattern_delta
+import pattern_manifest
+import sys
+import os
+import logging
+import time
+import json
+import signal
+from optparse import OptionParser
 
-def return_c():
-    return 'c'
+# name of the installed pattern without the extension of the codec
+PUBLIC_SUFFIX_PTN = 'public_suffix.txt'
+SYNC_STATE = 'public_suffix.sync.json'
 
-def return_d():
-    return 'd'
+class PatternSyncError(Exception): pass
+class PatternSyncEnvError(PatternSyncError): pass
+class PatternSyncVerifyError(PatternSyncError): pass
+
+class pattern_sync_agent(object):
+    def __init__(self, config_file):
+        self.config_file = config_file
+        self.config = self.load_config()
+        self.validate_config()
+        self.prepare_env()
+        self.logger = self.get_logger()
+        self.state = self.read_sync_state()
+        self.running = False
+        self.s3_client = aws_s3_util.S3Handler(proxy = self.config['proxy'], proxy_port = self.config['proxy_port'], connect_timeout = self.config['aws_s3_connect_timeout'],
+                                               read_timeout = self.config['aws_s3_read_timeout'], region_name = self.config['aws_s3_region'])
+
+    def load_config(self):
+        return conf_util.load_config(self.config_file, ['proxy', 'proxy_port', 'log_level', 'logger_name', 'aws_s3_bucket', 'aws_s3_prefix', 'aws_s3_region',
+                                                         'aws_s3_connect_timeout', 'aws_s3_read_timeout', 'ptn_dir', 'sync_interval', 'notify_pid_files', 'notify_signal'])
+
+    def validate_config(self):
+        conf_util.config_validate_str('log_level', self.config['log_level'])
+        conf_util.config_validate_str('logger_name', self.config['logger_name'])
+        conf_util.config_validate_str('aws_s3_bucket', self.config['aws_s3_bucket'])
+        conf_util.config_validate_str('aws_s3_prefix', self.config['aws_s3_prefix'])
+        conf_util.config_validate_str('aws_s3_region', self.config['aws_s3_region'])
+        conf_util.config_validate_int('aws_s3_connect_timeout', self.config['aws_s3_connect_timeout'], 5, 300)
+        conf_util.config_validate_int('aws_s3_read_timeout', self.config['aws_s3_read_timeout'], 5, 300)
+        conf_util.config_validate_str('ptn_dir', self.config['ptn_dir'])
+        conf_util.config_validate_int('sync_interval', self.config['sync_interval'], 10, 86400)
+        if type(self.config['notify_pid_files']) != list:
+            raise conf_util.ConfigKeyError('"notify_pid_files" is not a list')
+        conf_util.config_validate_str('notify_signal', self.config['notify_signal'])
+        if not self.config['notify_signal'].startswith('SIG') or not hasattr(signal, self.config['notify_signal']):
+            raise conf_util.ConfigKeyError('"notify_signal" %s is not a signal name' % self.config['notify_signal'])
+
+    def __get_logger(self, logger_name, log_level):
+        log_format = '%(name)s[%(asctime)s]-[%(process)s]-[%(levelname)s]: %(message)s'
+        log_handler = logging.StreamHandler(sys.stdout)
+        # formatter
+        log_formatter = logging.Formatter(log_format)
+        log_handler.setFormatter(log_formatter)
+        # level
+        level_dict = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO,
+                      'WARN': logging.WARN, 'WARNING': logging.WARNING,
+                      'ERROR': logging.ERROR, 'CRITICAL': logging.CRITICAL}
+        try:
+            log_level = level_dict[log_level.upper()]
+        except KeyError:
+            log_level = logging.INFO
+        # logger
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(log_level)
+        logger.addHandler(log_handler)
+        return logger
+
+    def get_logger(self):
+        return self.__get_logger(self.config['logger_name'], self.config['log_level'])
+
+    def prepare_env(self):
+        self.ptn_dir = os.path.abspath(self.config['ptn_dir'])
+        if not os.path.isdir(self.ptn_dir):
+            raise PatternSyncEnvError('Pattern directory %s not exists' %self.ptn_dir)
+        self.sync_state_path = os.path.join(self.ptn_dir, SYNC_STATE)
+        self.manifest_key = pattern_manifest.get_manifest_key(self.config['aws_s3_prefix'])
+
+    def get_pattern_path(self, codec):
+        return os.path.join(self.ptn_dir, PUBLIC_SUFFIX_PTN + pattern_codec.get_extension(codec))
+
+    def get_installed_path(self):
+        return self.get_pattern_path(self.state['codec'])
+
+    def read_sync_state(self):
+        # {'version': installed version, 'codec': codec of the installed pattern, 'etag': ETag of the manifest which has been handled}
+        # a state written before codecs existed has no codec, its pattern is gzip
+        state = {'version': None, 'codec': pattern_codec.DEFAULT_CODEC, 'etag': None}
+        if not os.path.exists(self.sync_state_path):
+            return state
+        try:
+            f = open(self.sync_state_path, 'r')
+            try:
+                saved_state = json.load(f)
+            finally:
+                f.close()
+        except ValueError, e:
+            self.logger.warning('ignore invalid sync state %s: %s' %(self.sync_state_path, e))
+            return state
+        saved_state['codec'] = saved_state.get('codec') or pattern_codec.DEFAULT_CODEC
+        if saved_state['codec'] not in pattern_codec.CODECS or not os.path.exists(self.get_pattern_path(saved_state['codec'])):
+            return state
+        state.update(saved_state)
+        return state
+
+    def write_sync_state(self):
+        tmp_path = '%s.tmp' %self.sync_state_path
+        f = open(tmp_path, 'w')
+        try:
+            json.dump(self.state, f, sort_keys = True)
+        finally:
+            f.close()
+        os.rename(tmp_path, self.sync_state_path)
+
+    def get_manifest(self):
+        # return the manifest, None if it has not been modified since the last sync
+        try:
+            (content, etag) = self.s3_client.get_s3_file_content_if_modified(self.config['aws_s3_bucket'], self.manifest_key, self.state['etag'])
+        except aws_s3_util.AWS_S3NotModifiedError:
+            return None
+        return (pattern_manifest.loads(content), etag)
+
+    def verify_pattern(self, path, entry):
+        if entry['size'] is not None and os.path.getsize(path) != entry['size']:
+            raise PatternSyncVerifyError('size of public suffix pattern %s is %d, expected %d' %(entry['key'], os.path.getsize(path), entry['size']))
+        if entry['md5'] is not None:
+            md5 = pattern_manifest.get_pattern_md5(path)
+            if md5 != entry['md5']:
+                raise PatternSyncVerifyError('md5 of public suffix pattern %s is %s, expected %s' %(entry['key'], md5, entry['md5']))
+
+    def install_pattern(self, entry, path):
+        # download beside the installed pattern, so the rename is atomic
+        download_path = os.path.join(self.ptn_dir, os.path.basename(entry['key']))
+        self.s3_client.cp_s3_file_to_local(self.config['aws_s3_bucket'], download_path, entry['key'])
+        try:
+            self.verify_pattern(download_path, entry)
+            os.rename(download_path, path)
+        except Exception:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+            raise
+
+    def get_entry_codec(self, entry):
+        # a version published before codecs existed has no codec and is gzip
+        codec = entry.get('codec') or pattern_codec.DEFAULT_CODEC
+        if not pattern_codec.is_available(codec):
+            raise PatternSyncError('codec %s of public suffix pattern %s is not available' %(codec, entry['key']))
+        return codec
+
+    def get_delta_content(self, key):
+        return self.s3_client.get_s3_file_content(self.config['aws_s3_bucket'], key)
+
+    def patch_pattern(self, manifest, entry, path):
+        # apply the deltas after the installed version to the installed pattern, return False if the full pattern has to be downloaded
+        if self.state['version'] is None or not os.path.exists(self.get_installed_path()):
+            return False
+        patch_path = os.path.join(self.ptn_dir, '%s.patch' %os.path.basename(entry['key']))
+        try:
+            pattern_delta.patch_pattern(self.get_installed_path(), patch_path, manifest, self.state['version'], self.get_delta_content,
+                                        entry['version'], self.get_entry_codec(entry))
+        except Exception, e:
+            self.logger.info('download the full public suffix pattern of version %s: %s' %(entry['version'], e))
+            return False
+        os.rename(patch_path, path)
+        return True
+
+    def notify(self):
+        signum = getattr(signal, self.config['notify_signal'])
+        for pid_file in self.config['notify_pid_files']:
+            try:
+                f = open(pid_file, 'r')
+                try:
+                    pid = int(f.read().strip())
+                finally:
+                    f.close()
+                os.kill(pid, signum)
+                self.logger.info('notify process %d of %s' %(pid, pid_file))
+            except (IOError, OSError, ValueError), e:
+                self.logger.warning('fail to notify process of %s: %s' %(pid_file, e))
+
+    def sync(self):
+        # return True if a new pattern is installed
+        manifest_result = self.get_manifest()
+        if manifest_result is None:
+            self.logger.debug('public suffix manifest is not modified')
+            return False
+        (manifest, etag) = manifest_result
+        entry = pattern_manifest.get_latest(manifest)
+        if entry is None:
+            raise PatternSyncError('no public suffix pattern in manifest %s' %self.manifest_key)
+        installed = entry['version'] != self.state['version']
+        if installed:
+            start_time = time.time()
+            codec = self.get_entry_codec(entry)
+            path = self.get_pattern_path(codec)
+            if self.patch_pattern(manifest, entry, path):
+                method = 'deltas from version %s' %self.state['version']
+            else:
+                self.install_pattern(entry, path)
+                method = 'full download'
+            self.logger.info('install public suffix pattern version %s as %s by %s in %.3f seconds' %(entry['version'], path, method, time.time() - start_time))
+            if path != self.get_installed_path() and os.path.exists(self.get_installed_path()):
+                # the pattern of the previous codec
+                os.remove(self.get_installed_path())
+            self.state['version'] = entry['version']
+            self.state['codec'] = codec
+        # the ETag is only kept after the version is installed, so a failed install is retried by the next sync
+        self.state['etag'] = etag
+        self.write_sync_state()
+        if installed:
+            self.notify()
+        return installed
+
+    def run(self):
+        try:
+            self.sync()
+        except Exception, e:
+            self.logger.error('fail to sync public suffix pattern: %s' %e)
+            return -1
+        return 0
+
+    def stop(self, signum, frame):
+        self.logger.info('receive signal %d, stop syncing' %signum)
+        self.running = False
+
+    def loop(self):
+        interval = self.config['sync_interval']
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.logger.info('sync public suffix pattern every %d seconds' %interval)
+        while self.running:
+            start_time = time.time()
+            self.run()
+            # sleep in short steps, so a stop signal is handled promptly
+            next_time = start_time + interval
+            while self.running and time.time() < next_time:
+                time.sleep(min(1, next_time - time.time()))
+        return 0
+
+def parse_args():
+    parser = OptionParser(option_class=conf_util.ConfigOption)
+    parser.add_option('-c', '--config', help = 'path of config file', dest = 'config', action = 'store', type = 'string')
+    parser.add_option('--once', help = 'sync once and exit instead of syncing every sync_interval seconds', dest = 'once', action = 'store_true', default = False)
+    (opts, args) = parser.parse_args()
+    return opts
 
 def main(argv):
-    return_a()
-    return_b()
-    return_c()
-    return_d()
+    opts = parse_args()
+    if not opts.config:
+        print >> sys.stderr, 'Usage: %s -c [ConfigFileName] [--once]' %(argv[0])
+        print >> sys.stderr, 'Example: %s -c ./conf/agent1.conf' %(argv[0])
+        return -1
+    agent = pattern_sync_agent(opts.config)
+    if opts.once:
+        return agent.run()
+    return agent.loop()
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
@@ -1,14 +1,17 @@
-from botocore.client import Config
-from botocore.session import Session
-import boto3
 import sys
 import os
+import time
+import threading
+import Queue
 
 class AWSError(Exception): pass
 class AWS_S3Error(AWSError): pass
 class AWS_S3COPYError(AWS_S3Error): pass
 class AWS_S3DELETEError(AWS_S3Error): pass
 class AWS_S3ListError(AWS_S3Error): pass
+class AWS_S3HEADError(AWS_S3Error): pass
+class AWS_S3NotFoundError(AWS_S3Error): pass
+class AWS_S3NotModifiedError(AWS_S3Error): pass
 
 GENKEY_AES64  = 0
 GENKEY_AES128 = 1
@@ -18,6 +21,125 @@ AES64_BLOCK_SIZE  = 8
 AES128_BLOCK_SIZE = 16
 AES256_BLOCK_SIZE = 32
 
+MB = 1024 * 1024
+# S3 requires every part except the last one of a multipart upload to be at least 5MB
+MULTIPART_MIN_CHUNKSIZE = 5 * MB
+DEFAULT_MULTIPART_THRESHOLD = 16 * MB
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * MB
+DEFAULT_MAX_CONCURRENCY = 4
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_REGION = 'us-west-2'
+# max number of keys of one multi-object delete request
+MAX_DELETE_KEYS = 1000
+
+def run_in_threads(func, args_list, max_concurrency):
+    # call func(*args) for every args in args_list with at most max_concurrency threads
+    # return the results in the order of args_list, raise the first exception of the calls
+    results = [None] * len(args_list)
+    errors = []
+    tasks = Queue.Queue()
+    for (index, args) in enumerate(args_list):
+        tasks.put((index, args))
+    def worker():
+        while not errors:
+            try:
+                (index, args) = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(*args)
+            except Exception as e_msg:
+                errors.append(e_msg)
+    threads = []
+    for i in range(max(1, min(max_concurrency, len(args_list)))):
+        thread = threading.Thread(target = worker)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+def is_not_found_error(e_msg):
+    # botocore ClientError keeps the parsed error response
+    error = getattr(e_msg, 'response', {}).get('Error', {})
+    return error.get('Code') in ('NoSuchKey', '404', 'NotFound')
+
+def is_not_modified_error(e_msg):
+    # a conditional GET of an unchanged object fails with 304
+    response = getattr(e_msg, 'response', {})
+    if response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+        return True
+    return response.get('Error', {}).get('Code') in ('304', 'NotModified')
+
+def get_retry_attempts(resp):
+    # botocore keeps the number of retries of a request in the response metadata
+    if type(resp) != dict:
+        return 0
+    return resp.get('ResponseMetadata', {}).get('RetryAttempts', 0) or 0
+
+class S3RequestStats(object):
+    # requests, errors, retries and latency of S3 requests per operation, shared by the threads of a handler
+    # the latency is measured until the response headers, the body of get_object is read after it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, operation, seconds, retries, error):
+        self.lock.acquire()
+        try:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = {'requests': 0, 'errors': 0, 'retries': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            stats['requests'] += 1
+            if error:
+                stats['errors'] += 1
+            stats['retries'] += retries
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        finally:
+            self.lock.release()
+
+    def get(self):
+        # return a copy of {operation: stats}
+        self.lock.acquire()
+        try:
+            return dict([(operation, dict(stats)) for (operation, stats) in self.operations.iteritems()])
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.operations = {}
+        finally:
+            self.lock.release()
+
+def merge_request_stats(total, operations):
+    # add {operation: stats} of S3RequestStats.get() to total, e.g. to report all handlers of a process together
+    for (operation, stats) in operations.iteritems():
+        if operation not in total:
+            total[operation] = dict(stats)
+            continue
+        for key in ('requests', 'errors', 'retries', 'seconds'):
+            total[operation][key] += stats[key]
+        total[operation]['max_seconds'] = max(total[operation]['max_seconds'], stats['max_seconds'])
+    return total
+
+def split_parts(size, chunksize):
+    # return [(part_number, offset, length)] which covers size bytes
+    parts = []
+    offset = 0
+    part_number = 1
+    while offset < size:
+        length = min(chunksize, size - offset)
+        parts.append((part_number, offset, length))
+        offset += length
+        part_number += 1
+    return parts
+
 def genkey(aes_type):
     if aes_type == GENKEY_AES64 :
         block_size = AES64_BLOCK_SIZE
@@ -29,13 +151,68 @@ def genkey(aes_type):
     return customer_key
 
 class S3Handler(object):
-    def __init__(self, proxy=None, proxy_port = None, connect_timeout= 30 , read_timeout= 60):
+    def __init__(self, proxy=None, proxy_port = None, connect_timeout= 30 , read_timeout= 60,
+                 multipart_threshold = DEFAULT_MULTIPART_THRESHOLD, multipart_chunksize = DEFAULT_MULTIPART_CHUNKSIZE,
+                 max_concurrency = DEFAULT_MAX_CONCURRENCY, region_name = DEFAULT_REGION, conn = None):
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = max(multipart_chunksize, MULTIPART_MIN_CHUNKSIZE)
+        self.max_concurrency = max_concurrency
+        self.stats = S3RequestStats()
+        self.client_args = (proxy, proxy_port, connect_timeout, read_timeout, region_name)
+        self.client_lock = threading.Lock()
+        # an S3 client compatible connection, e.g. a local stand-in for benchmarks, otherwise the boto3 client created on first use
+        self._conn = conn
+
+    def new_client(self):
+        # boto3 is imported here, so a process which never sends an S3 request does not pay for it
+        from botocore.client import Config
+        import boto3
+        (proxy, proxy_port, connect_timeout, read_timeout, region_name) = self.client_args
         if proxy and proxy_port:
             os.environ['HTTP_PROXY'] = 'http://%s:%d' %(proxy, proxy_port)
             os.environ['HTTPS_PROXY'] = 'http://%s:%d' %(proxy, proxy_port)
-        config = Config(connect_timeout= connect_timeout , read_timeout= read_timeout, region_name = 'us-west-2')
-        session = Session()
-        self.conn = boto3.client('s3' , config = config )
+        config = Config(connect_timeout= connect_timeout , read_timeout= read_timeout, region_name = region_name)
+        return boto3.client('s3' , config = config )
+
+    def get_conn(self):
+        # boto3 clients are not created thread safely, the first requests of multipart transfers may run in parallel
+        if self._conn is None:
+            self.client_lock.acquire()
+            try:
+                if self._conn is None:
+                    self._conn = self.new_client()
+            finally:
+                self.client_lock.release()
+        return self._conn
+
+    def set_conn(self, conn):
+        self._conn = conn
+
+    conn = property(get_conn, set_conn)
+
+    def request(self, operation, **kwargs):
+        # call an operation of the S3 client and record its latency and retries
+        start_time = time.time()
+        try:
+            resp = getattr(self.conn, operation)(**kwargs)
+        except Exception as e_msg:
+            # a missing key or an unchanged object is an answer, not a failure of S3
+            error = not (is_not_found_error(e_msg) or is_not_modified_error(e_msg))
+            self.stats.record(operation, time.time() - start_time, get_retry_attempts(getattr(e_msg, 'response', None)), error)
+            raise
+        self.stats.record(operation, time.time() - start_time, get_retry_attempts(resp), False)
+        return resp
+
+    def check_resp_status(self, resp, status, check_structure = None):
+        if check_structure is None:
+            check_structure = {}
+        check_structure['ResponseMetadata'] = {}
+        check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
+        (has_lost, lost_struct) = self.check_resp_has_lost_structure(resp, check_structure)
+        if has_lost:
+            raise Exception('S3 response lost fields. Response body: %s. Lost fields: %s' %(resp, lost_struct))
+        if resp['ResponseMetadata']['HTTPStatusCode'] != status:
+            raise Exception('S3 Response Error status. Response Body: %s' %resp)
 
     def check_resp_has_lost_structure(self, resp, check_structure):
         lost_structure = {}
@@ -54,6 +231,7 @@ class S3Handler(object):
     def cp_local_file_to_s3(self, bucket_name, src_path, dst_key , customer_sse_key=None , encrypt_algm='AES256', kwargs={}):
         if not bucket_name or not src_path or not dst_key:
             raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
         kwargs['Bucket'] = bucket_name
         kwargs['Key'] = dst_key
         if encrypt_algm and customer_sse_key :
@@ -62,48 +240,163 @@ class S3Handler(object):
         else :
             kwargs['ServerSideEncryption'] = 'AES256' # default SSE algorithm
         try:
+            size = os.path.getsize(src_path)
+            if size >= self.multipart_threshold:
+                self.multipart_upload(src_path, size, kwargs)
+                return
             with open(src_path , 'rb') as data:
+                # botocore streams the file object, the content is not read into memory at once
                 kwargs['Body'] = data
-                resp = self.conn.put_object(**kwargs)
-                check_structure = {}
-                check_structure['ResponseMetadata'] = {}
-                check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
-                (has_lost, lost_struct) = self.check_resp_has_lost_structure(resp, check_structure)
-                if has_lost:
-                    raise Exception('S3 response lost fields. Response body: %s. Lost fields: %s' %(resp, lost_struct))
-                if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
-                    raise Exception('S3 Response Error status. Response Body: %s' %resp)
+                resp = self.request('put_object', **kwargs)
+                self.check_resp_status(resp, 200)
         except Exception as e_msg:
             raise AWS_S3COPYError(e_msg)
 
+    def multipart_upload(self, src_path, size, kwargs):
+        resp = self.request('create_multipart_upload', **kwargs)
+        check_structure = {}
+        check_structure['UploadId'] = ''
+        self.check_resp_status(resp, 200, check_structure)
+        upload_id = resp['UploadId']
+        part_kwargs = {'Bucket': kwargs['Bucket'], 'Key': kwargs['Key'], 'UploadId': upload_id}
+        for key in ('SSECustomerAlgorithm', 'SSECustomerKey'):
+            if key in kwargs:
+                part_kwargs[key] = kwargs[key]
+        def upload_part(part_number, offset, length):
+            # each part is read on its own, so memory is bounded by max_concurrency * multipart_chunksize
+            with open(src_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            resp = self.request('upload_part', PartNumber = part_number, Body = data, **part_kwargs)
+            check_structure = {}
+            check_structure['ETag'] = ''
+            self.check_resp_status(resp, 200, check_structure)
+            return {'PartNumber': part_number, 'ETag': resp['ETag']}
+        try:
+            parts = run_in_threads(upload_part, split_parts(size, self.multipart_chunksize), self.max_concurrency)
+            resp = self.request('complete_multipart_upload', Bucket = kwargs['Bucket'], Key = kwargs['Key'], UploadId = upload_id,
+                                                       MultipartUpload = {'Parts': parts})
+            self.check_resp_status(resp, 200)
+        except Exception:
+            # do not leave the uploaded parts in the bucket
+            try:
+                self.request('abort_multipart_upload', Bucket = kwargs['Bucket'], Key = kwargs['Key'], UploadId = upload_id)
+            except Exception:
+                pass
+            raise
+
     def cp_s3_file_to_local(self, bucket_name, src_path, dst_key , customer_sse_key=None , encrypt_algm='AES256', kwargs={}):
         if not bucket_name or not src_path or not dst_key:
             raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
         kwargs['Bucket'] = bucket_name
         kwargs['Key'] = dst_key
         if encrypt_algm and customer_sse_key :
             kwargs['SSECustomerAlgorithm'] = encrypt_algm 
             kwargs['SSECustomerKey'] = customer_sse_key
+        # write to a temporary file, so src_path is never a partial object
+        tmp_path = '%s.tmp' %src_path
         try:
-            resp = self.conn.get_object(**kwargs)
+            resp = self.request('head_object', **kwargs)
+            check_structure = {}
+            check_structure['ContentLength'] = ''
+            self.check_resp_status(resp, 200, check_structure)
+            size = resp['ContentLength']
+            if size >= self.multipart_threshold:
+                self.ranged_download(tmp_path, size, kwargs)
+            else:
+                resp = self.request('get_object', **kwargs)
+                check_structure = {}
+                check_structure['Body'] = ''
+                self.check_resp_status(resp, 200, check_structure)
+                with open(tmp_path, 'wb') as f:
+                    self.copy_stream(resp['Body'], f)
+            os.rename(tmp_path, src_path)
+        except Exception as e_msg:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise AWS_S3COPYError(e_msg)
+
+    def copy_stream(self, body, f):
+        while True:
+            chunk = body.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+
+    def ranged_download(self, dst_path, size, kwargs):
+        with open(dst_path, 'wb') as f:
+            f.truncate(size)
+        def download_part(part_number, offset, length):
+            resp = self.request('get_object', Range = 'bytes=%d-%d' %(offset, offset + length - 1), **kwargs)
             check_structure = {}
             check_structure['Body'] = ''
-            check_structure['ResponseMetadata'] = {}
-            check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
-            (has_lost, lost_struct) = self.check_resp_has_lost_structure(resp, check_structure)
-            if has_lost:
-                raise Exception('S3 response lost fields. Response body: %s. Lost fields: %s' %(resp, lost_struct))
-            if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
-                raise Exception('S3 Response Error status. Response Body: %s' %resp)
-            content = resp['Body'].read() 
-            with open(src_path, 'wb') as f:
-                f.write("%s" %content)
+            self.check_resp_status(resp, 206, check_structure)
+            with open(dst_path, 'r+b') as f:
+                f.seek(offset)
+                self.copy_stream(resp['Body'], f)
+        run_in_threads(download_part, split_parts(size, self.multipart_chunksize), self.max_concurrency)
+
+    def get_s3_file_content(self, bucket_name, dst_key, kwargs = {}):
+        # read a small object into memory, raise AWS_S3NotFoundError if the key does not exist
+        if not bucket_name or not dst_key:
+            raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
+        kwargs['Bucket'] = bucket_name
+        kwargs['Key'] = dst_key
+        try:
+            resp = self.request('get_object', **kwargs)
+            check_structure = {}
+            check_structure['Body'] = ''
+            self.check_resp_status(resp, 200, check_structure)
+            return resp['Body'].read()
+        except Exception as e_msg:
+            if is_not_found_error(e_msg):
+                raise AWS_S3NotFoundError(e_msg)
+            raise AWS_S3COPYError(e_msg)
+
+    def get_s3_file_content_if_modified(self, bucket_name, dst_key, etag = None, kwargs = {}):
+        # conditional GET of a small object, return (content, etag)
+        # raise AWS_S3NotModifiedError if the ETag of the object is still etag, AWS_S3NotFoundError if the key does not exist
+        if not bucket_name or not dst_key:
+            raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
+        kwargs['Bucket'] = bucket_name
+        kwargs['Key'] = dst_key
+        if etag:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            resp = self.request('get_object', **kwargs)
+            check_structure = {}
+            check_structure['Body'] = ''
+            self.check_resp_status(resp, 200, check_structure)
+            return (resp['Body'].read(), resp.get('ETag'))
+        except Exception as e_msg:
+            if is_not_modified_error(e_msg):
+                raise AWS_S3NotModifiedError(e_msg)
+            if is_not_found_error(e_msg):
+                raise AWS_S3NotFoundError(e_msg)
+            raise AWS_S3COPYError(e_msg)
+
+    def put_s3_file_content(self, bucket_name, dst_key, content, kwargs = {}):
+        if not bucket_name or not dst_key:
+            raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
+        kwargs['Bucket'] = bucket_name
+        kwargs['Key'] = dst_key
+        kwargs['Body'] = content
+        if 'SSECustomerKey' not in kwargs:
+            kwargs['ServerSideEncryption'] = 'AES256' # default SSE algorithm
+        try:
+            resp = self.request('put_object', **kwargs)
+            self.check_resp_status(resp, 200)
         except Exception as e_msg:
             raise AWS_S3COPYError(e_msg)
 
     def cp_s3_file_to_s3(self, bucket_name, src_path, dst_key , customer_sse_key=None , encrypt_algm='AES256', kwargs={}):
         if not bucket_name or not src_path or not dst_key:
             raise AWS_S3COPYError('config error') 
+        kwargs = dict(kwargs)
         kwargs['Bucket'] = bucket_name
         kwargs['Key'] = dst_key
         kwargs['CopySource'] = src_path
@@ -111,7 +404,7 @@ class S3Handler(object):
             kwargs['SSECustomerAlgorithm'] = encrypt_algm 
             kwargs['SSECustomerKey'] = customer_sse_key
         try:
-            resp = self.conn.copy_object(**kwargs)
+            resp = self.request('copy_object', **kwargs)
             check_structure = {}
             check_structure['Body'] = ''
             check_structure['ResponseMetadata'] = {}
@@ -127,10 +420,11 @@ class S3Handler(object):
     def del_s3_file(self, bucket_name, dst_key, kwargs = {}):
         if not bucket_name or not dst_key:
             raise AWS_S3DELETEError('config error') 
+        kwargs = dict(kwargs)
         kwargs['Bucket'] = bucket_name
         kwargs['Key'] = dst_key
         try:
-            resp = self.conn.delete_object(**kwargs)
+            resp = self.request('delete_object', **kwargs)
             check_structure = {}
             check_structure['ResponseMetadata'] = {}
             check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
@@ -142,16 +436,59 @@ class S3Handler(object):
         except Exception as e_msg:
             raise AWS_S3DELETEError(e_msg)
 
+    def del_s3_files(self, bucket_name, dst_keys):
+        # delete keys with multi-object delete requests of up to MAX_DELETE_KEYS keys, return the number of deleted keys
+        if not bucket_name:
+            raise AWS_S3DELETEError('config error') 
+        deleted = 0
+        errors = []
+        try:
+            for start in range(0, len(dst_keys), MAX_DELETE_KEYS):
+                objects = [{'Key': key} for key in dst_keys[start:start + MAX_DELETE_KEYS]]
+                resp = self.request('delete_objects', Bucket = bucket_name, Delete = {'Objects': objects, 'Quiet': True})
+                self.check_resp_status(resp, 200)
+                errors.extend(resp.get('Errors', []))
+                deleted += len(objects) - len(resp.get('Errors', []))
+        except Exception as e_msg:
+            raise AWS_S3DELETEError(e_msg)
+        if errors:
+            raise AWS_S3DELETEError('fail to delete %d keys: %s' %(len(errors), ', '.join(['%s(%s)' %(error.get('Key'), error.get('Code')) for error in errors[:10]])))
+        return deleted
+
+    def head_s3_file(self, bucket_name, dst_key, customer_sse_key=None , encrypt_algm='AES256', kwargs = {}):
+        if not bucket_name or not dst_key:
+            raise AWS_S3HEADError('config error') 
+        kwargs = dict(kwargs)
+        kwargs['Bucket'] = bucket_name
+        kwargs['Key'] = dst_key
+        if encrypt_algm and customer_sse_key :
+            kwargs['SSECustomerAlgorithm'] = encrypt_algm 
+            kwargs['SSECustomerKey'] = customer_sse_key
+        try:
+            resp = self.request('head_object', **kwargs)
+            check_structure = {}
+            check_structure['ResponseMetadata'] = {}
+            check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
+            (has_lost, lost_struct) = self.check_resp_has_lost_structure(resp, check_structure)
+            if has_lost:
+                raise Exception('S3 response lost fields. Response body: %s. Lost fields: %s' %(resp, lost_struct))
+            if resp['ResponseMetadata']['HTTPStatusCode'] != 200:
+                raise Exception('S3 Response Error status. Response Body: %s' %resp)
+        except Exception as e_msg:
+            raise AWS_S3HEADError(e_msg)
+        return resp
+
     def list_bucket_content(self, bucket_name, prefix = None, kwargs = {}):
         file_list = []
         if not bucket_name:
             raise AWS_S3ListError('config error') 
+        kwargs = dict(kwargs)
         kwargs['Bucket'] = bucket_name
         if prefix:
             kwargs['Prefix'] = prefix
         try:
             while True:
-                resp = self.conn.list_objects(**kwargs)
+                resp = self.request('list_objects', **kwargs)
                 check_structure = {}
                 check_structure['ResponseMetadata'] = {}
                 check_structure['ResponseMetadata']['HTTPStatusCode'] = ''
@@ -160,9 +497,10 @@ class S3Handler(object):
                     contents = resp['Contents']
                     for content in contents:
                         file_list.append(content['Key'])
-                    if 'IsTruncated' in resp and resp['IsTruncated']:
+                    if 'IsTruncated' in resp and resp['IsTruncated'] and contents:
                         # return is truncated and requests objects after 'NextMarker'
-                        kwargs['Marker'] = resp['NextMarker']
+                        # 'NextMarker' is only returned with a 'Delimiter', otherwise the next page starts after the last key
+                        kwargs['Marker'] = resp.get('NextMarker') or contents[-1]['Key']
                         continue
                     else: 
                         break
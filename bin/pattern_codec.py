@@ -0,0 +1,152 @@
+#!/usr/bin/python2.6
+'''
+pattern_codec compress the public suffix pattern with a selectable codec and level, and read a pattern of any codec
+Following is specification of the codecs:
+
+    gzip    default, level 1 (fastest) to 9 (smallest, default)
+    bz2     level 1 to 9 (default)
+    lzma    xz format, level 0 to 9 (default 6), needs the lzma module (Python 3.3+) or backports.lzma
+    none    uncompressed
+    The file name of a pattern ends with the extension of its codec: '.gz', '.bz2', '.xz' or none.
+    A reader detects the codec from the magic bytes at the start of the content, not from the name,
+    so a pattern is read the same way whatever it is named. An uncompressed pattern starts with a rule or a comment,
+    which never starts with the magic bytes of a codec.
+    The lzma module is only imported when an lzma pattern is written or read.
+    A gzip pattern has mtime 0 in its header (Python 2.7+), so the same content is always compressed to the same bytes.
+
+usage:  python pattern_codec.py ptn/public_suffix.txt.gz
+
+'''
+import bz2
+import gzip
+import StringIO
+import sys
+
+CODECS = ['gzip', 'bz2', 'lzma', 'none']
+DEFAULT_CODEC = 'gzip'
+EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'lzma': '.xz', 'none': ''}
+# (min, max, default) level of each codec
+LEVELS = {'gzip': (1, 9, 9), 'bz2': (1, 9, 9), 'lzma': (0, 9, 6), 'none': (0, 0, 0)}
+MAGICS = [('gzip', '\x1f\x8b'), ('bz2', 'BZh'), ('lzma', '\xfd7zXZ\x00')]
+MAGIC_SIZE = 6
+
+class PatternCodecError(Exception): pass
+
+def import_lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise PatternCodecError('codec lzma needs the lzma module or backports.lzma')
+    return lzma
+
+def is_available(codec):
+    if codec not in CODECS:
+        return False
+    if codec == 'lzma':
+        try:
+            import_lzma()
+        except PatternCodecError:
+            return False
+    return True
+
+def get_extension(codec):
+    try:
+        return EXTENSIONS[codec]
+    except KeyError:
+        raise PatternCodecError('unknown codec %s' % codec)
+
+def get_level(codec, level = None):
+    # return the level to use, the default level of the codec if level is None
+    if codec not in LEVELS:
+        raise PatternCodecError('unknown codec %s' % codec)
+    (min_level, max_level, default_level) = LEVELS[codec]
+    if level is None:
+        return default_level
+    if type(level) != int or not min_level <= level <= max_level:
+        raise PatternCodecError('level of codec %s should be %d to %d' %(codec, min_level, max_level))
+    return level
+
+def detect(header):
+    # codec of content which starts with header, at least MAGIC_SIZE bytes unless the content is shorter
+    for (codec, magic) in MAGICS:
+        if header.startswith(magic):
+            return codec
+    return 'none'
+
+def detect_file(path):
+    f = open(path, 'rb')
+    try:
+        return detect(f.read(MAGIC_SIZE))
+    finally:
+        f.close()
+
+def new_gzip_file(level, filename = None, fileobj = None):
+    try:
+        return gzip.GzipFile(filename, 'wb', level, fileobj, mtime = 0)
+    except TypeError:
+        # Python 2.6 has no mtime, the header keeps the time of the write
+        return gzip.GzipFile(filename, 'wb', level, fileobj)
+
+def open_write(path, codec = DEFAULT_CODEC, level = None):
+    level = get_level(codec, level)
+    if codec == 'gzip':
+        return new_gzip_file(level, filename = path)
+    if codec == 'bz2':
+        return bz2.BZ2File(path, 'wb', compresslevel = level)
+    if codec == 'lzma':
+        return import_lzma().LZMAFile(path, 'wb', preset = level)
+    return open(path, 'wb')
+
+def open_read(path):
+    # a file object of the uncompressed content, its lines can be iterated
+    codec = detect_file(path)
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+    if codec == 'lzma':
+        return import_lzma().LZMAFile(path, 'rb')
+    return open(path, 'rb')
+
+def compress(content, codec = DEFAULT_CODEC, level = None):
+    level = get_level(codec, level)
+    if codec == 'gzip':
+        buf = StringIO.StringIO()
+        f = new_gzip_file(level, fileobj = buf)
+        f.write(content)
+        f.close()
+        return buf.getvalue()
+    if codec == 'bz2':
+        return bz2.compress(content, level)
+    if codec == 'lzma':
+        return import_lzma().compress(content, preset = level)
+    return content
+
+def decompress(content):
+    codec = detect(content[:MAGIC_SIZE])
+    if codec == 'gzip':
+        f = gzip.GzipFile(fileobj = StringIO.StringIO(content), mode = 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+    if codec == 'bz2':
+        return bz2.decompress(content)
+    if codec == 'lzma':
+        return import_lzma().decompress(content)
+    return content
+
+def main(argv):
+    # print the codec of each pattern
+    if len(argv) < 2:
+        print >> sys.stderr, 'Usage: %s PatternFileName ...' %(argv[0])
+        return -1
+    for path in argv[1:]:
+        print '%s\t%s' %(path, detect_file(path))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,184 @@
+#!/usr/bin/python2.6
+'''
+pattern_delta compute the rule-level difference between two public suffix pattern versions, published next to the full pattern
+Following is specification of the delta:
+
+    The delta of version V is stored in '<aws_s3_prefix>/public_suffix.delta.<from>.<V>.json', where <from> is the version published before V.
+    'added' lists the rules of V which are not in <from>, 'removed' lists the rules of <from> which are not in V,
+    'changed' lists the rules of both versions whose flag or threshold is changed.
+    Rules are sorted, so the delta of the same two rule sets is always the same object.
+    The manifest entry of V keeps the delta as 'delta': {'from': <from>, 'key': ..., 'size': ..., 'md5': ...},
+    'md5' is the md5 of the rule set of V (see get_rules_md5), which does not depend on the comments and the order of the pattern.
+    A consumer of version A reaches version B by applying the deltas of the versions after A up to B in order,
+    which is only possible if every version after A has a delta and the 'from' of each delta is the previous version.
+    patch_pattern writes the pattern of B from the pattern of A this way, and verifies its rules against 'md5' of the last delta,
+    a consumer downloads the full pattern of B if the chain is broken, is larger than the pattern, or the rules are not verified.
+
+Delta:
+{"format": 1, "from": "201512090100", "to": "201512090200", "added": [["foo.com", 0, -1]], "removed": ["bar.com"], "changed": [["co.uk", 1, 5]]}
+
+'''
+import hashlib
+import json
+import os
+import re
+
+import pattern_codec
+import pattern_manifest
+import public_suffix_lookup
+
+DELTA_FORMAT = 1
+DELTA_KEY_RE = re.compile(r'^public_suffix\.delta\.(\d+)\.(\d+)\.json$')
+
+class PatternDeltaError(Exception): pass
+
+class RuleSet(dict):
+    # {rule: (flag, threshold)} of a pattern, which a delta is applied to like a public_suffix_lookup.PublicSuffixTable
+    def add_rule(self, rule, flag, threshold):
+        self[rule] = (flag, threshold)
+
+    def remove_rule(self, rule):
+        return self.pop(rule, None) is not None
+
+def get_delta_key(prefix, from_version, to_version):
+    return os.path.join(prefix, 'public_suffix.delta.%s.%s.json' %(from_version, to_version))
+
+def parse_delta_versions(key):
+    # return (from, to) versions of a published delta key, None if the key is not a delta
+    match = DELTA_KEY_RE.match(os.path.basename(key))
+    if match is None:
+        return None
+    return match.groups()
+
+def get_rule_records(rules):
+    # {rule: (flag, threshold)} of an iterable of (rule, flag, threshold), later rules overwrite earlier ones like the lookup table
+    records = {}
+    for (rule, flag, threshold) in rules:
+        records[rule] = (flag, threshold)
+    return records
+
+def get_rules_md5(records):
+    # md5 of the rules of {rule: (flag, threshold)} in rule order
+    md5 = hashlib.md5()
+    for rule in sorted(records.keys()):
+        md5.update('%s\t%d\t%d\n' %(rule, records[rule][0], records[rule][1]))
+    return md5.hexdigest()
+
+def compute_delta(old_rules, new_rules, from_version, to_version):
+    old_records = get_rule_records(old_rules)
+    new_records = get_rule_records(new_rules)
+    added = []
+    changed = []
+    for (rule, record) in new_records.iteritems():
+        old_record = old_records.get(rule)
+        if old_record is None:
+            added.append([rule, record[0], record[1]])
+        elif old_record != record:
+            changed.append([rule, record[0], record[1]])
+    removed = [rule for rule in old_records if rule not in new_records]
+    added.sort()
+    changed.sort()
+    removed.sort()
+    return {'format': DELTA_FORMAT, 'from': from_version, 'to': to_version, 'added': added, 'removed': removed, 'changed': changed}
+
+def is_empty(delta):
+    return not delta['added'] and not delta['removed'] and not delta['changed']
+
+def loads(content):
+    try:
+        delta = json.loads(content)
+    except ValueError, e:
+        raise PatternDeltaError('invalid delta: %s' % e)
+    if type(delta) != dict or delta.get('format') != DELTA_FORMAT:
+        raise PatternDeltaError('invalid delta: %s' % content[:256])
+    for field in ('from', 'to', 'added', 'removed', 'changed'):
+        if field not in delta:
+            raise PatternDeltaError('invalid delta, lost field %s' % field)
+    return delta
+
+def dumps(delta):
+    return json.dumps(delta, sort_keys = True, separators = (',', ':'))
+
+def get_delta_chain(manifest, from_version, to_version = None):
+    # return the manifest entries whose deltas lead from from_version to to_version (default is the latest) in apply order
+    # return None if the chain is broken, e.g. a version in between has no delta or has been deleted
+    if to_version is None:
+        to_version = manifest['latest']
+    chain = []
+    version = to_version
+    while version != from_version:
+        entry = pattern_manifest.get_version(manifest, version)
+        if entry is None or not entry.get('delta'):
+            return None
+        chain.append(entry)
+        version = entry['delta']['from']
+    chain.reverse()
+    return chain
+
+def apply_delta(table, delta, version = None):
+    # apply a delta to a public_suffix_lookup.PublicSuffixTable in place, version is the current version of the table if it is known
+    if version is not None and delta['from'] != version:
+        raise PatternDeltaError('delta from %s can not be applied to version %s' %(delta['from'], version))
+    for rule in delta['removed']:
+        if not table.remove_rule(rule):
+            raise PatternDeltaError('removed rule %s is not in the table' % rule)
+    for (rule, flag, threshold) in delta['added'] + delta['changed']:
+        table.add_rule(rule, flag, threshold)
+    return delta['to']
+
+def apply_delta_chain(table, deltas, version = None):
+    for delta in deltas:
+        version = apply_delta(table, delta, version)
+    return version
+
+def read_pattern_rules(path):
+    f = pattern_codec.open_read(path)
+    try:
+        rules = RuleSet()
+        for (rule, flag, threshold) in public_suffix_lookup.iter_pattern_rules(f):
+            rules.add_rule(rule, flag, threshold)
+        return rules
+    finally:
+        f.close()
+
+def write_pattern_rules(path, rules, codec = pattern_codec.DEFAULT_CODEC):
+    # the pattern is written beside path and renamed, so path is always a complete pattern
+    tmp_path = '%s.tmp' % path
+    try:
+        f = pattern_codec.open_write(tmp_path, codec, pattern_codec.get_level(codec))
+        try:
+            for rule in sorted(rules.keys()):
+                f.write('%s\t%d\t%d\n' %(rule, rules[rule][0], rules[rule][1]))
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def patch_pattern(base_path, path, manifest, from_version, get_content, to_version = None, codec = pattern_codec.DEFAULT_CODEC):
+    # write the pattern of to_version (default is the latest) to path by applying the deltas after from_version to the pattern at base_path,
+    # get_content(key) returns the content of a delta, return the manifest entry of to_version
+    # raise PatternDeltaError if the chain is broken, is not smaller than the pattern, or the patched rules are not the rules of to_version
+    chain = get_delta_chain(manifest, from_version, to_version)
+    if not chain:
+        raise PatternDeltaError('no delta chain from version %s to %s' %(from_version, to_version or manifest['latest']))
+    entry = chain[-1]
+    if not entry['delta'].get('md5'):
+        raise PatternDeltaError('delta of version %s has no md5' % entry['version'])
+    delta_size = sum([item['delta']['size'] or 0 for item in chain])
+    if entry['size'] is not None and delta_size >= entry['size']:
+        raise PatternDeltaError('%d deltas of %d bytes are not smaller than the pattern of %d bytes' %(len(chain), delta_size, entry['size']))
+    rules = read_pattern_rules(base_path)
+    version = from_version
+    for item in chain:
+        delta = loads(get_content(item['delta']['key']))
+        if delta['to'] != item['version']:
+            raise PatternDeltaError('delta %s is to version %s, expected %s' %(item['delta']['key'], delta['to'], item['version']))
+        version = apply_delta(rules, delta, version)
+    md5 = get_rules_md5(rules)
+    if md5 != entry['delta']['md5']:
+        raise PatternDeltaError('md5 of the rules of patched version %s is %s, expected %s' %(entry['version'], md5, entry['delta']['md5']))
+    write_pattern_rules(path, rules, codec)
+    return entry
@@ -0,0 +1,145 @@
+#!/usr/bin/python2.6
+'''
+pattern_manifest keep the list of published public suffix pattern versions, which is stored as a small JSON object next to the patterns
+Following is specification of the manifest:
+
+    The manifest is stored in '<aws_s3_prefix>/public_suffix.manifest.json'.
+    'latest' is the version of the current pattern, None if no pattern is published.
+    'versions' lists all published versions, sorted from the oldest to the newest.
+    Each version has 'version', 'key', 'md5' (of the uncompressed pattern), 'size' (of the published object) and 'timestamp' (UTC epoch seconds).
+    'md5', 'size' and 'timestamp' are None for versions which were published before the manifest existed.
+    'delta' is the rule-level delta from the previous version (see pattern_delta), None if it is not published.
+    'codec' is the codec of the pattern and its overlays (see pattern_codec), the key ends with the extension of the codec,
+    a version published before codecs existed has no 'codec' and is gzip.
+    'overlays' are the overlay patterns of the tenants published with the version, {tenant: {'key': ..., 'md5': ..., 'size': ...}},
+    a version published before overlays existed has no 'overlays'. An overlay is stored in '<aws_s3_prefix>/public_suffix.overlay.<tenant>.txt.<version><extension>'.
+
+Manifest:
+{"latest": "201512090100", "versions": [{"version": "201512090100", "key": "wrs_common_data/public_suffix/public_suffix.txt.201512090100.gz", "md5": "...", "size": 61234, "timestamp": 1449622800}]}
+
+'''
+import hashlib
+import json
+import os
+import re
+
+import pattern_codec
+
+MANIFEST_NAME = 'public_suffix.manifest.json'
+PATTERN_KEY_RE = re.compile(r'^public_suffix\.txt\.(\d+)(\.gz|\.bz2|\.xz)?$')
+PATTERN_KEY_FORMAT = 'public_suffix.txt.%s%s'
+OVERLAY_KEY_RE = re.compile(r'^public_suffix\.overlay\.[A-Za-z0-9_-]+\.txt\.(\d+)(\.gz|\.bz2|\.xz)?$')
+OVERLAY_KEY_FORMAT = 'public_suffix.overlay.%s.txt.%s%s'
+TENANT_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+READ_CHUNK_SIZE = 64 * 1024
+
+class PatternManifestError(Exception): pass
+
+def get_manifest_key(prefix):
+    return os.path.join(prefix, MANIFEST_NAME)
+
+def parse_pattern_version(key):
+    # return the version of a published pattern key, None if the key is not a pattern
+    match = PATTERN_KEY_RE.match(os.path.basename(key))
+    if match is None:
+        return None
+    return match.group(1)
+
+def parse_overlay_version(key):
+    # return the version of a published overlay key, None if the key is not an overlay
+    match = OVERLAY_KEY_RE.match(os.path.basename(key))
+    if match is None:
+        return None
+    return match.group(1)
+
+def is_valid_tenant(tenant):
+    return TENANT_RE.match(tenant) is not None
+
+def get_pattern_key(prefix, version, codec = pattern_codec.DEFAULT_CODEC):
+    return os.path.join(prefix, PATTERN_KEY_FORMAT %(version, pattern_codec.get_extension(codec)))
+
+def get_overlay_key(prefix, tenant, version, codec = pattern_codec.DEFAULT_CODEC):
+    if not is_valid_tenant(tenant):
+        raise PatternManifestError('invalid tenant %s' % tenant)
+    return os.path.join(prefix, OVERLAY_KEY_FORMAT %(tenant, version, pattern_codec.get_extension(codec)))
+
+def new_manifest():
+    return {'latest': None, 'versions': []}
+
+def loads(content):
+    try:
+        manifest = json.loads(content)
+    except ValueError, e:
+        raise PatternManifestError('invalid manifest: %s' % e)
+    if type(manifest) != dict or 'versions' not in manifest or 'latest' not in manifest:
+        raise PatternManifestError('invalid manifest: %s' % content[:256])
+    return manifest
+
+def dumps(manifest):
+    return json.dumps(manifest, sort_keys = True)
+
+def get_version(manifest, version):
+    for entry in manifest['versions']:
+        if entry['version'] == version:
+            return entry
+    return None
+
+def get_latest(manifest):
+    if manifest['latest'] is None:
+        return None
+    return get_version(manifest, manifest['latest'])
+
+def add_version(manifest, version, key, md5 = None, size = None, timestamp = None, delta = None, overlays = None, codec = None):
+    entry = get_version(manifest, version)
+    if entry is None:
+        entry = {'version': version}
+        manifest['versions'].append(entry)
+        manifest['versions'].sort(key = lambda item: item['version'])
+    entry['key'] = key
+    entry['md5'] = md5
+    entry['size'] = size
+    entry['timestamp'] = timestamp
+    entry['delta'] = delta
+    if codec:
+        entry['codec'] = codec
+    else:
+        entry.pop('codec', None)
+    if overlays:
+        entry['overlays'] = overlays
+    else:
+        entry.pop('overlays', None)
+    if manifest['latest'] is None or version >= manifest['latest']:
+        manifest['latest'] = version
+    return entry
+
+def remove_versions(manifest, versions):
+    versions = set(versions)
+    manifest['versions'] = [entry for entry in manifest['versions'] if entry['version'] not in versions]
+    if manifest['latest'] in versions:
+        if manifest['versions']:
+            manifest['latest'] = manifest['versions'][-1]['version']
+        else:
+            manifest['latest'] = None
+
+def build_manifest_from_keys(keys):
+    # manifest of the patterns published before the manifest existed
+    manifest = new_manifest()
+    for key in keys:
+        version = parse_pattern_version(key)
+        if version is not None:
+            add_version(manifest, version, key)
+    return manifest
+
+def get_pattern_md5(path):
+    # md5 of the uncompressed content of a pattern of any codec, comparable with 'md5' of a version
+    md5 = hashlib.md5()
+    f = pattern_codec.open_read(path)
+    try:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+    finally:
+        f.close()
+    return md5.hexdigest()
@@ -0,0 +1,187 @@
+#!/usr/bin/python2.6
+'''
+pattern_merge merge the rules of the public suffix pattern into a minimal rule set in canonical order
+Following is specification of the merge:
+
+    Rules are (rule, flag, threshold) records, a rule which is listed again overwrites the record of the earlier one like the lookup table.
+    A rule is removed if it never changes the result of a lookup (see public_suffix_lookup), for one of these reasons:
+    duplicate           the rule is listed again with the same record, or an overlay lists a rule of its base with the same record
+    orphan_exception    the exception rule '!a.b' gives the result of the rules without it: there is no wildcard rule '*.b'
+                        and no rule at or below 'a.b', and 'b' is matched by a rule with the same flag and threshold,
+                        e.g. '!www.example.test' of 'example.test', but not '!city.kobe.jp' of 'jp', which makes 'kobe.jp' the suffix
+    shadowed            the walk of a host name stops at an exception rule before it reaches the rule,
+                        e.g. 'a.www.ck', '*.www.ck' and 'www.ck' are shadowed by '!www.ck'
+    redundant           the normal rule 'a.b' is covered by the wildcard rule '*.b' with the same flag and threshold
+    An exception is kept whenever a rule is below it, the walk stops at the exception, so it shadows the rule.
+    The rules are looked up in hash indexes of the exception and the wildcard rules, so a merge is linear in the number of rules.
+    The canonical order sorts the rules by their labels from the last one, then normal, wildcard and exception rules,
+    e.g. 'ck', '*.ck', '!www.ck', 'co.uk', so the same rule set is always written as the same pattern.
+
+Removed rule:
+((rule, flag, threshold), reason, rule which causes the removal or None)
+
+'''
+import itertools
+import public_suffix_lookup
+
+DUPLICATE = 'duplicate'
+ORPHAN_EXCEPTION = 'orphan_exception'
+SHADOWED = 'shadowed'
+REDUNDANT = 'redundant'
+REMOVE_REASONS = [DUPLICATE, ORPHAN_EXCEPTION, SHADOWED, REDUNDANT]
+
+def get_sort_key(kind, name):
+    # labels from the last one joined by '\x01', which sorts a name before the names below it like a list of labels,
+    # then '\x00' and the kind, so the rules of a name are sorted by kind, in one string rather than a tuple per rule
+    labels = name.split('.')
+    labels.reverse()
+    return '%s\x00%c' % ('\x01'.join(labels), kind)
+
+def get_rule_sort_key(rule):
+    (kind, name) = public_suffix_lookup.parse_rule(rule)
+    return get_sort_key(kind, name)
+
+def sort_rules(records):
+    return sorted(records, key = lambda record: get_rule_sort_key(record[0]))
+
+def get_parent(name):
+    # 'a.b.c' -> 'b.c', None for a top-level name
+    index = name.find('.')
+    if index < 0:
+        return None
+    return name[index + 1:]
+
+class RuleIndex(object):
+    # records of a rule set, indexed by the names of its exception and wildcard rules, e.g. the shared pattern of overlays
+    def __init__(self, records = ()):
+        self.records = {}
+        self.exceptions = set()
+        self.wildcards = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        (rule, flag, threshold) = record
+        (kind, name) = public_suffix_lookup.parse_rule(rule)
+        self.records[rule] = record
+        if kind == public_suffix_lookup.RULE_EXCEPTION:
+            self.exceptions.add(name)
+        elif kind == public_suffix_lookup.RULE_WILDCARD:
+            self.wildcards[name] = (flag, threshold)
+
+def get_match_record(name, records, wildcards):
+    # (flag, threshold) of the rule which matches the whole name, None if the name is only matched by a shorter rule
+    record = records(name)
+    if record is not None:
+        return (record[1], record[2])
+    parent = get_parent(name)
+    if parent is not None:
+        return wildcards.get(parent)
+    # a top-level name is matched by the rule '*' or the default rule
+    record = records('*')
+    if record is not None:
+        return (record[1], record[2])
+    return (public_suffix_lookup.DEFAULT_FLAG, public_suffix_lookup.DEFAULT_THRESHOLD)
+
+def merge_rules(records, base = None):
+    # return (kept records in canonical order, removed rules), base is the RuleIndex of the rules records are layered on
+    removed = []
+    merged = {}
+    base_records = {}
+    if base is not None:
+        base_records = base.records
+    for record in records:
+        rule = record[0]
+        previous = merged.get(rule)
+        if previous is not None:
+            removed.append((previous, DUPLICATE, None))
+        elif base_records.get(rule) == record:
+            removed.append((record, DUPLICATE, None))
+            continue
+        merged[rule] = record
+    # index the exceptions and wildcards of records and base together, the rules are parsed again by the last pass
+    # rather than kept parsed, which would be another tuple per rule
+    parse_rule = public_suffix_lookup.parse_rule
+    exceptions = set()
+    wildcards = {}
+    if base is not None:
+        exceptions.update(base.exceptions)
+        wildcards.update(base.wildcards)
+    exception_records = []
+    for record in merged.itervalues():
+        if record[0].startswith(('*', '!')):
+            (kind, name) = parse_rule(record[0])
+            if kind == public_suffix_lookup.RULE_WILDCARD:
+                wildcards[name] = (record[1], record[2])
+            elif kind == public_suffix_lookup.RULE_EXCEPTION:
+                exception_records.append((name, record))
+    def get_record(rule):
+        record = merged.get(rule)
+        if record is None:
+            record = base_records.get(rule)
+        return record
+    # exceptions which have the result of the rules above them, unless a rule is at or below them
+    orphans = set()
+    for (name, record) in exception_records:
+        parent = get_parent(name)
+        if parent is not None and parent not in wildcards and get_match_record(parent, get_record, wildcards) == (record[1], record[2]):
+            orphans.add(name)
+        else:
+            exceptions.add(name)
+    if orphans:
+        names = itertools.imap(parse_rule, merged.iterkeys())
+        if base is not None:
+            names = itertools.chain(names, itertools.imap(parse_rule, base_records.iterkeys()))
+        for (kind, name) in names:
+            if kind == public_suffix_lookup.RULE_EXCEPTION:
+                name = get_parent(name)
+            while name is not None:
+                if name in orphans:
+                    orphans.discard(name)
+                    exceptions.add(name)
+                name = get_parent(name)
+            if not orphans:
+                break
+    # top-level labels of the exceptions, a rule under another top-level label is never shadowed
+    exception_tlds = set([name[name.rfind('.') + 1:] for name in exceptions])
+    kept = []
+    for record in merged.itervalues():
+        name = record[0]
+        if name.startswith(('*', '!')):
+            (kind, name) = parse_rule(name)
+        else:
+            kind = public_suffix_lookup.RULE_NORMAL
+        if kind == public_suffix_lookup.RULE_EXCEPTION:
+            if name in orphans:
+                removed.append((record, ORPHAN_EXCEPTION, None))
+                continue
+            # an exception does not shadow itself, but a normal or wildcard rule at its node
+            suffix = get_parent(name)
+        else:
+            suffix = name
+        cause = None
+        if suffix is not None and suffix[suffix.rfind('.') + 1:] in exception_tlds:
+            while suffix is not None:
+                if suffix in exceptions:
+                    cause = '!' + suffix
+                    break
+                suffix = get_parent(suffix)
+        if cause is not None:
+            removed.append((record, SHADOWED, cause))
+            continue
+        if kind == public_suffix_lookup.RULE_NORMAL:
+            parent = get_parent(name)
+            if parent is not None and wildcards.get(parent) == (record[1], record[2]):
+                removed.append((record, REDUNDANT, '*.' + parent))
+                continue
+        kept.append((get_sort_key(kind, name), record))
+    merged = None
+    kept.sort()
+    return ([record for (key, record) in kept], sorted(removed, key = lambda item: get_rule_sort_key(item[0][0])))
+
+def count_removed(removed):
+    # {reason: number of removed rules} of all reasons
+    counts = dict([(reason, 0) for reason in REMOVE_REASONS])
+    for (record, reason, cause) in removed:
+        counts[reason] += 1
+    return counts
@@ -0,0 +1,299 @@
+#!/usr/bin/python2.6
+'''
+pattern_storage is the storage interface of the published public suffix patterns, with an S3 and a local directory implementation
+Following is specification of the storage:
+
+    A storage keeps objects by bucket and key, and supports list, get, get_file, put, put_file, delete and head.
+    list returns the keys of a bucket which start with the prefix, sorted like S3 lists them.
+    get and get_file raise StorageNotFoundError if the key does not exist, other failures raise StorageError.
+    put and put_file replace the object at once, a reader sees either the old or the new object, never a partial one.
+    put keeps the metadata ({name: value} of strings) and the content type, which are returned by head with the size and the ETag.
+    delete removes a list of keys and returns the number of removed keys, a missing key is not an error like S3.
+    Every request is recorded in stats (aws_s3_util.S3RequestStats) by operation.
+
+    S3Storage is S3 through aws_s3_util.S3Handler, its boto3 client is created on the first request.
+    LocalStorage keeps the objects of bucket B in directory <root>/B, a key is the path of the object in it.
+    The metadata of an object is kept in <root>/.meta/B/<key>.json and new objects are written in <root>/.tmp,
+    so both are never listed. Unlike S3, a key can not be a prefix of another key followed by '/', e.g. 'a' and 'a/b'.
+
+'''
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import aws_s3_util
+
+STORAGE_BACKENDS = ['s3', 'local']
+LOCAL_META_DIR = '.meta'
+LOCAL_TMP_DIR = '.tmp'
+COPY_CHUNK_SIZE = 64 * 1024
+
+class StorageError(Exception): pass
+class StorageNotFoundError(StorageError): pass
+
+class S3Storage(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.stats = handler.stats
+
+    def list(self, bucket, prefix = None):
+        try:
+            return sorted(self.handler.list_bucket_content(bucket, prefix = prefix))
+        except aws_s3_util.AWS_S3Error, e:
+            raise StorageError(e)
+
+    def get(self, bucket, key):
+        try:
+            return self.handler.get_s3_file_content(bucket, key)
+        except aws_s3_util.AWS_S3NotFoundError, e:
+            raise StorageNotFoundError(e)
+        except aws_s3_util.AWS_S3Error, e:
+            raise StorageError(e)
+
+    def get_file(self, bucket, key, path):
+        try:
+            self.handler.cp_s3_file_to_local(bucket, path, key)
+        except aws_s3_util.AWS_S3Error, e:
+            if e.args and aws_s3_util.is_not_found_error(e.args[0]):
+                raise StorageNotFoundError(e)
+            raise StorageError(e)
+
+    def get_put_kwargs(self, metadata, content_type):
+        kwargs = {}
+        if metadata:
+            kwargs['Metadata'] = metadata
+        if content_type:
+            kwargs['ContentType'] = content_type
+        return kwargs
+
+    def put(self, bucket, key, content, metadata = None, content_type = None):
+        try:
+            self.handler.put_s3_file_content(bucket, key, content, kwargs = self.get_put_kwargs(metadata, content_type))
+        except aws_s3_util.AWS_S3Error, e:
+            raise StorageError(e)
+
+    def put_file(self, bucket, key, path, metadata = None, content_type = None):
+        try:
+            self.handler.cp_local_file_to_s3(bucket, path, key, customer_sse_key = None, kwargs = self.get_put_kwargs(metadata, content_type))
+        except aws_s3_util.AWS_S3Error, e:
+            raise StorageError(e)
+
+    def delete(self, bucket, keys):
+        try:
+            return self.handler.del_s3_files(bucket, keys)
+        except aws_s3_util.AWS_S3Error, e:
+            raise StorageError(e)
+
+    def head(self, bucket, key):
+        try:
+            resp = self.handler.head_s3_file(bucket, key)
+        except aws_s3_util.AWS_S3Error, e:
+            if e.args and aws_s3_util.is_not_found_error(e.args[0]):
+                raise StorageNotFoundError(e)
+            raise StorageError(e)
+        return {'size': resp.get('ContentLength'), 'etag': resp.get('ETag'), 'metadata': resp.get('Metadata', {}), 'content_type': resp.get('ContentType')}
+
+class LocalStorage(object):
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        if not os.path.isdir(self.root):
+            raise StorageError('storage directory %s not exists' % self.root)
+        self.tmp_dir = os.path.join(self.root, LOCAL_TMP_DIR)
+        if not os.path.isdir(self.tmp_dir):
+            os.makedirs(self.tmp_dir)
+        self.stats = aws_s3_util.S3RequestStats()
+
+    def get_bucket_dir(self, bucket):
+        if not bucket or bucket.startswith('.') or '/' in bucket:
+            raise StorageError('invalid bucket %s' % bucket)
+        return os.path.join(self.root, bucket)
+
+    def get_paths(self, bucket, key):
+        # return (object path, metadata path) of a key
+        labels = key.split('/')
+        if not key or key.startswith('/') or '..' in labels or '.' in labels or '' in labels:
+            raise StorageError('invalid key %s' % key)
+        return (os.path.join(self.get_bucket_dir(bucket), *labels), os.path.join(self.root, LOCAL_META_DIR, bucket, *labels) + '.json')
+
+    def record(self, operation, start_time, error = False):
+        self.stats.record(operation, time.time() - start_time, 0, error)
+
+    def list(self, bucket, prefix = None):
+        start_time = time.time()
+        bucket_dir = self.get_bucket_dir(bucket)
+        keys = []
+        for (dir_path, dir_names, file_names) in os.walk(bucket_dir):
+            key_dir = os.path.relpath(dir_path, bucket_dir).replace(os.sep, '/')
+            for file_name in file_names:
+                if key_dir == '.':
+                    key = file_name
+                else:
+                    key = '%s/%s' %(key_dir, file_name)
+                if not prefix or key.startswith(prefix):
+                    keys.append(key)
+        keys.sort()
+        self.record('list', start_time)
+        return keys
+
+    def read_meta(self, meta_path):
+        try:
+            f = open(meta_path, 'r')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def get(self, bucket, key):
+        start_time = time.time()
+        (path, meta_path) = self.get_paths(bucket, key)
+        try:
+            f = open(path, 'rb')
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                self.record('get', start_time)
+                raise StorageNotFoundError('%s/%s not found' %(bucket, key))
+            self.record('get', start_time, True)
+            raise StorageError(e)
+        self.record('get', start_time)
+        return content
+
+    def get_file(self, bucket, key, dst_path):
+        start_time = time.time()
+        (path, meta_path) = self.get_paths(bucket, key)
+        if not os.path.isfile(path):
+            self.record('get', start_time)
+            raise StorageNotFoundError('%s/%s not found' %(bucket, key))
+        # copy to a temporary file, so dst_path is never a partial object
+        tmp_path = '%s.tmp' % dst_path
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.rename(tmp_path, dst_path)
+        except (IOError, OSError), e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.record('get', start_time, True)
+            raise StorageError(e)
+        self.record('get', start_time)
+
+    def write_object(self, bucket, key, src, metadata, content_type):
+        # src is the content or a file object of it, the object is written in the tmp directory and renamed in place
+        (path, meta_path) = self.get_paths(bucket, key)
+        for dir_path in (os.path.dirname(path), os.path.dirname(meta_path)):
+            if not os.path.isdir(dir_path):
+                try:
+                    os.makedirs(dir_path)
+                except OSError, e:
+                    # created by a concurrent put
+                    if e.errno != errno.EEXIST:
+                        raise
+        md5 = hashlib.md5()
+        (fd, tmp_path) = tempfile.mkstemp(dir = self.tmp_dir)
+        f = os.fdopen(fd, 'wb')
+        try:
+            try:
+                if type(src) == str:
+                    md5.update(src)
+                    f.write(src)
+                else:
+                    while True:
+                        chunk = src.read(COPY_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        md5.update(chunk)
+                        f.write(chunk)
+            finally:
+                f.close()
+            meta = {'etag': '"%s"' % md5.hexdigest(), 'metadata': metadata or {}, 'content_type': content_type}
+            tmp_meta_path = '%s.json' % tmp_path
+            meta_file = open(tmp_meta_path, 'w')
+            try:
+                json.dump(meta, meta_file, sort_keys = True)
+            finally:
+                meta_file.close()
+            # the metadata is renamed first, so a visible object always has its metadata
+            os.rename(tmp_meta_path, meta_path)
+            os.rename(tmp_path, path)
+        except Exception:
+            for tmp in (tmp_path, '%s.json' % tmp_path):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            raise
+
+    def put(self, bucket, key, content, metadata = None, content_type = None):
+        start_time = time.time()
+        try:
+            self.write_object(bucket, key, content, metadata, content_type)
+        except (IOError, OSError), e:
+            self.record('put', start_time, True)
+            raise StorageError(e)
+        self.record('put', start_time)
+
+    def put_file(self, bucket, key, src_path, metadata = None, content_type = None):
+        start_time = time.time()
+        try:
+            f = open(src_path, 'rb')
+            try:
+                self.write_object(bucket, key, f, metadata, content_type)
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            self.record('put', start_time, True)
+            raise StorageError(e)
+        self.record('put', start_time)
+
+    def delete(self, bucket, keys):
+        start_time = time.time()
+        deleted = 0
+        try:
+            for key in keys:
+                (path, meta_path) = self.get_paths(bucket, key)
+                for remove_path in (path, meta_path):
+                    try:
+                        os.remove(remove_path)
+                    except OSError, e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                deleted += 1
+        except OSError, e:
+            self.record('delete', start_time, True)
+            raise StorageError(e)
+        self.record('delete', start_time)
+        return deleted
+
+    def head(self, bucket, key):
+        start_time = time.time()
+        (path, meta_path) = self.get_paths(bucket, key)
+        try:
+            size = os.path.getsize(path)
+            meta = self.read_meta(meta_path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                self.record('head', start_time)
+                raise StorageNotFoundError('%s/%s not found' %(bucket, key))
+            self.record('head', start_time, True)
+            raise StorageError(e)
+        except (IOError, ValueError), e:
+            self.record('head', start_time, True)
+            raise StorageError(e)
+        self.record('head', start_time)
+        return {'size': size, 'etag': meta.get('etag'), 'metadata': meta.get('metadata', {}), 'content_type': meta.get('content_type')}
+
+def new_storage(backend, local_root = None, **s3_kwargs):
+    # s3_kwargs are the arguments of aws_s3_util.S3Handler
+    if backend == 's3':
+        return S3Storage(aws_s3_util.S3Handler(**s3_kwargs))
+    if backend == 'local':
+        return LocalStorage(local_root)
+    raise StorageError('unknown storage backend %s' % backend)
@@ -0,0 +1,265 @@
+#!/usr/bin/python2.6
+'''
+pattern_store keep the generated files of a directory in a local content-addressed store, and install them by an atomic switch
+Following is specification of the store:
+
+    Each file is an object named by the sha256 of its content, written once and never modified.
+    A file with the content of an existing object is not written again, the object is shared.
+    A set is the files of one install, {name: object}, named by the sha256 of its names and objects,
+    and kept as a directory of symlinks to its objects, so the same files are always the same set.
+    <root>/current is a symlink to the installed set, replaced by rename, so it switches all files of a set at once.
+    Each name of a set is a symlink <root>/<name> to current/<name>, e.g. ptn/public_suffix.txt.gz -> current/public_suffix.txt.gz,
+    so a reader which opens the name always gets a complete file of the installed set, and never a file being written.
+    Installing the installed set again changes nothing, so the mtime of the files is only changed by a new set.
+    The installed sets are kept in a history, rollback installs the set before the current one again without any write.
+    Sets which are not in the last 'keep' entries of the history, and objects which are not in a kept set, are deleted.
+
+Layout:
+<root>/.store/objects/<2 hex>/<sha256>      objects
+<root>/.store/sets/<sha256>/<name>          symlink to ../../objects/<2 hex>/<sha256>
+<root>/.store/history                       installed sets, one per line, the current one last
+<root>/.store/tmp/                          stage directories of files to install
+<root>/current                              symlink to .store/sets/<sha256>
+
+usage:  python pattern_store.py ptn [history|rollback]
+
+'''
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+STORE_DIR = '.store'
+CURRENT = 'current'
+DEFAULT_KEEP = 10
+READ_CHUNK_SIZE = 64 * 1024
+# stage directories of a failed install are deleted by prune after this time
+TMP_EXPIRE_SECONDS = 3600
+
+class PatternStoreError(Exception): pass
+
+def get_file_id(path):
+    m = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            m.update(chunk)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+def get_set_id(entries):
+    m = hashlib.sha256()
+    for name in sorted(entries.keys()):
+        m.update('%s\t%s\n' %(name, entries[name]))
+    return m.hexdigest()
+
+def get_top_name(name):
+    return name.split('/')[0]
+
+def replace_symlink(target, path):
+    # point path to target by a rename, so path is never missing or half written
+    tmp_path = os.path.join(os.path.dirname(path), '.%s.tmp' %os.path.basename(path))
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.symlink(target, tmp_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # a directory of the layout before the store, only replaced once
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+class PatternStore(object):
+    def __init__(self, root, keep = DEFAULT_KEEP):
+        if not os.path.isdir(root):
+            raise PatternStoreError('directory %s not exists' %root)
+        if keep < 1:
+            raise PatternStoreError('keep at least the current set')
+        self.root = root
+        self.keep = keep
+        self.store_dir = os.path.join(root, STORE_DIR)
+        self.objects_dir = os.path.join(self.store_dir, 'objects')
+        self.sets_dir = os.path.join(self.store_dir, 'sets')
+        self.tmp_dir = os.path.join(self.store_dir, 'tmp')
+        self.history_path = os.path.join(self.store_dir, 'history')
+        self.current_path = os.path.join(root, CURRENT)
+        for path in (self.objects_dir, self.sets_dir, self.tmp_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def get_object_path(self, object_id):
+        return os.path.join(self.objects_dir, object_id[:2], object_id)
+
+    def get_set_path(self, set_id):
+        return os.path.join(self.sets_dir, set_id)
+
+    def new_stage_dir(self):
+        # the files of an install are written here with their names, then installed by install_dir
+        return tempfile.mkdtemp(dir = self.tmp_dir)
+
+    def add_file(self, path):
+        # move the file at path into the store, return (object id, True if it is a new object)
+        object_id = get_file_id(path)
+        object_path = self.get_object_path(object_id)
+        if os.path.exists(object_path):
+            os.remove(path)
+            return (object_id, False)
+        if not os.path.isdir(os.path.dirname(object_path)):
+            os.makedirs(os.path.dirname(object_path))
+        os.chmod(path, 0444)
+        os.rename(path, object_path)
+        return (object_id, True)
+
+    def install_dir(self, stage_dir):
+        # add the files of stage_dir and install them as a set, return (set id, True if the set is switched, number of new objects)
+        entries = {}
+        added = 0
+        try:
+            for (dir_path, dir_names, file_names) in os.walk(stage_dir):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    name = os.path.relpath(path, stage_dir).replace(os.sep, '/')
+                    (entries[name], is_new) = self.add_file(path)
+                    if is_new:
+                        added += 1
+        finally:
+            shutil.rmtree(stage_dir, True)
+        (set_id, changed) = self.install(entries)
+        return (set_id, changed, added)
+
+    def install(self, entries):
+        # install {name: object id} as the current set, return (set id, True if the set is switched)
+        if not entries:
+            raise PatternStoreError('no file to install in %s' %self.root)
+        for (name, object_id) in entries.items():
+            if name.startswith('/') or '..' in name.split('/') or get_top_name(name) in (STORE_DIR, CURRENT):
+                raise PatternStoreError('invalid name %s' %name)
+            if not os.path.exists(self.get_object_path(object_id)):
+                raise PatternStoreError('no object %s of %s' %(object_id, name))
+        set_id = get_set_id(entries)
+        if set_id == self.get_current():
+            return (set_id, False)
+        if not os.path.isdir(self.get_set_path(set_id)):
+            self.write_set(set_id, entries)
+        self.switch(set_id)
+        history = [item for item in self.get_history() if item != set_id]
+        history.append(set_id)
+        self.write_history(history)
+        self.prune()
+        return (set_id, True)
+
+    def write_set(self, set_id, entries):
+        # the set directory is built apart and renamed, so it is complete once it exists
+        tmp_path = tempfile.mkdtemp(dir = self.tmp_dir)
+        for (name, object_id) in entries.items():
+            link_path = os.path.join(tmp_path, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(link_path)):
+                os.makedirs(os.path.dirname(link_path))
+            object_path = os.path.join(self.get_set_path(set_id), *name.split('/'))
+            os.symlink(os.path.relpath(self.get_object_path(object_id), os.path.dirname(object_path)), link_path)
+        os.rename(tmp_path, self.get_set_path(set_id))
+
+    def get_names(self, set_id):
+        # top-level names of a set
+        return sorted(os.listdir(self.get_set_path(set_id)))
+
+    def switch(self, set_id):
+        # point current to the set, then the names of the set to current, and remove the names of the previous set
+        names = self.get_names(set_id)
+        replace_symlink(os.path.join(STORE_DIR, 'sets', set_id), self.current_path)
+        for name in names:
+            target = '%s/%s' %(CURRENT, name)
+            path = os.path.join(self.root, name)
+            if not os.path.islink(path) or os.readlink(path) != target:
+                replace_symlink(target, path)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name not in names and os.path.islink(path) and os.readlink(path).startswith(CURRENT + '/'):
+                os.remove(path)
+
+    def get_current(self):
+        if not os.path.islink(self.current_path):
+            return None
+        return os.path.basename(os.readlink(self.current_path))
+
+    def get_history(self):
+        if not os.path.exists(self.history_path):
+            return []
+        f = open(self.history_path, 'r')
+        try:
+            return [line.strip() for line in f if line.strip()]
+        finally:
+            f.close()
+
+    def write_history(self, history):
+        tmp_path = '%s.tmp' %self.history_path
+        f = open(tmp_path, 'w')
+        try:
+            f.write(''.join(['%s\n' %set_id for set_id in history]))
+        finally:
+            f.close()
+        os.rename(tmp_path, self.history_path)
+
+    def rollback(self):
+        # install the set before the current one, return its id
+        history = [set_id for set_id in self.get_history() if os.path.isdir(self.get_set_path(set_id))]
+        if len(history) < 2:
+            raise PatternStoreError('no previous set to roll back to in %s' %self.root)
+        history.pop()
+        self.switch(history[-1])
+        self.write_history(history)
+        return history[-1]
+
+    def prune(self):
+        # delete sets out of the history and objects which are not in a kept set, return (sets, objects) deleted
+        history = self.get_history()[-self.keep:]
+        current = self.get_current()
+        if current is not None and current not in history:
+            history.append(current)
+        deleted_sets = 0
+        for set_id in os.listdir(self.sets_dir):
+            if set_id not in history:
+                shutil.rmtree(self.get_set_path(set_id))
+                deleted_sets += 1
+        self.write_history(history)
+        kept_objects = set()
+        for set_id in os.listdir(self.sets_dir):
+            for (dir_path, dir_names, file_names) in os.walk(self.get_set_path(set_id)):
+                for file_name in file_names:
+                    kept_objects.add(os.path.basename(os.readlink(os.path.join(dir_path, file_name))))
+        deleted_objects = 0
+        for prefix in os.listdir(self.objects_dir):
+            for object_id in os.listdir(os.path.join(self.objects_dir, prefix)):
+                if object_id not in kept_objects:
+                    os.remove(os.path.join(self.objects_dir, prefix, object_id))
+                    deleted_objects += 1
+        expire_time = time.time() - TMP_EXPIRE_SECONDS
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            if os.path.getmtime(path) < expire_time:
+                shutil.rmtree(path, True)
+        return (deleted_sets, deleted_objects)
+
+def main(argv):
+    if len(argv) < 2 or len(argv) > 3 or (len(argv) == 3 and argv[2] not in ('history', 'rollback')):
+        print >> sys.stderr, 'Usage: %s Directory [history|rollback]' %(argv[0])
+        return -1
+    try:
+        store = PatternStore(argv[1])
+        if len(argv) == 3 and argv[2] == 'rollback':
+            print 'current\t%s' %store.rollback()
+            return 0
+        current = store.get_current()
+        for set_id in store.get_history():
+            print '%s%s\t%s' %('*' if set_id == current else ' ', set_id, ' '.join(store.get_names(set_id)))
+    except PatternStoreError, e:
+        print >> sys.stderr, 'Error: %s' %e
+        return -1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
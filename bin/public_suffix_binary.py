@@ -0,0 +1,209 @@
+#!/usr/bin/python2.6
+'''
+public_suffix_binary encode the public suffix rule set to a binary, index-ready pattern which can be memory-mapped and looked up without parsing
+Following is specification of the file (all integers are little-endian):
+
+    header:     magic 'PSBN' (4 bytes), format version (uint16), reserved (uint16), rule count N (uint32), key blob size (uint32)
+    offsets:    N + 1 uint32, the start offset of each key in the key blob, the last one is the key blob size
+    flags:      N int32, the flag of each rule
+    thresholds: N int32, the threshold of each rule
+    key blob:   the keys of all rules, concatenated without separator
+
+    A key is the reversed labels of a rule joined by '\\x01', e.g. rule 'co.uk' is encoded as 'uk\\x01co'.
+    A wildcard rule '*.ck' is encoded as 'ck\\x01*'.
+    An exception rule '!www.ck' is encoded as 'ck\\x01www\\x00'.
+    Keys are sorted bytewise and unique. Since '\\x00' < '\\x01' < '*' < any hostname character, the keys of a node are always
+    stored in order: the normal rule, the exception rule, the wildcard rule, then the rules of its children.
+    So a lookup is one binary search per label of the host name, starting from the position found for the previous label.
+
+usage:  python public_suffix_binary.py -p ptn/public_suffix.txt.gz -o ptn/public_suffix.bin
+
+'''
+import array
+import mmap
+import os
+import struct
+import sys
+from optparse import OptionParser
+
+import pattern_codec
+import public_suffix_lookup
+
+BINARY_MAGIC = 'PSBN'
+BINARY_VERSION = 1
+HEADER_FORMAT = '<4sHHII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+KEY_SEPARATOR = '\x01'
+KEY_EXCEPTION = '\x00'
+
+class PublicSuffixBinaryError(public_suffix_lookup.PublicSuffixLookupError): pass
+
+def encode_rule_key(rule):
+    (kind, name) = public_suffix_lookup.parse_rule(rule)
+    labels = name.split('.')
+    labels.reverse()
+    if kind == public_suffix_lookup.RULE_WILDCARD:
+        labels.append('*')
+    key = KEY_SEPARATOR.join(labels)
+    if kind == public_suffix_lookup.RULE_EXCEPTION:
+        key += KEY_EXCEPTION
+    return key
+
+def pack_array(values):
+    # the little-endian bytes of an array of 4-byte integers
+    if values.itemsize != 4:
+        raise PublicSuffixBinaryError('array %s has %d-byte items' % (values.typecode, values.itemsize))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tostring()
+
+def write_binary_pattern(path, rules):
+    # rules is an iterable of (rule, flag, threshold), later rules overwrite earlier rules with the same key
+    # the arrays are built in one pass over the sorted keys, the records of the rules are not kept as Python objects twice
+    records = {}
+    values = {}
+    for (rule, flag, threshold) in rules:
+        value = (flag, threshold)
+        records[encode_rule_key(rule)] = values.setdefault(value, value)
+    keys = records.keys()
+    keys.sort()
+    count = len(keys)
+    offsets = array.array('I')
+    flags = array.array('i')
+    thresholds = array.array('i')
+    offset = 0
+    for key in keys:
+        offsets.append(offset)
+        offset += len(key)
+        (flag, threshold) = records[key]
+        flags.append(flag)
+        thresholds.append(threshold)
+    offsets.append(offset)
+    del records
+    tmp_path = '%s.tmp' % path
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(struct.pack(HEADER_FORMAT, BINARY_MAGIC, BINARY_VERSION, 0, count, offset))
+        f.write(pack_array(offsets))
+        f.write(pack_array(flags))
+        f.write(pack_array(thresholds))
+        f.write(''.join(keys))
+    finally:
+        f.close()
+    # rename, so the readers which already mapped the old file keep a consistent view
+    os.rename(tmp_path, path)
+    return count
+
+class BinaryPublicSuffixTable(object):
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(self.mm) < HEADER_SIZE:
+            self.close()
+            raise PublicSuffixBinaryError('binary pattern %s is truncated' % path)
+        (magic, version, reserved, count, blob_size) = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            self.close()
+            raise PublicSuffixBinaryError('binary pattern %s has unknown format %r version %d' % (path, magic, version))
+        self.rule_count = count
+        self.offsets_pos = HEADER_SIZE
+        self.flags_pos = self.offsets_pos + (count + 1) * 4
+        self.thresholds_pos = self.flags_pos + count * 4
+        self.blob_pos = self.thresholds_pos + count * 4
+        if len(self.mm) != self.blob_pos + blob_size:
+            self.close()
+            raise PublicSuffixBinaryError('binary pattern %s is truncated' % path)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def key_at(self, index):
+        (start, end) = struct.unpack_from('<II', self.mm, self.offsets_pos + index * 4)
+        return self.mm[self.blob_pos + start:self.blob_pos + end]
+
+    def record_at(self, index):
+        return (struct.unpack_from('<i', self.mm, self.flags_pos + index * 4)[0],
+                struct.unpack_from('<i', self.mm, self.thresholds_pos + index * 4)[0])
+
+    def bisect(self, key, lo):
+        hi = self.rule_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, hostname):
+        host = public_suffix_lookup.normalize_hostname(hostname)
+        if not host:
+            return None
+        labels = host.split('.')
+        count = len(labels)
+        match_len = 1
+        record = None
+        key = None
+        position = 0
+        for depth in xrange(1, count + 1):
+            label = labels[count - depth]
+            if key is None:
+                key = label
+            else:
+                key = key + KEY_SEPARATOR + label
+            position = self.bisect(key, position)
+            if position >= self.rule_count:
+                break
+            current = self.key_at(position)
+            if current == key:
+                match_len = depth
+                record = self.record_at(position)
+                position += 1
+                if position >= self.rule_count:
+                    break
+                current = self.key_at(position)
+            if current == key + KEY_EXCEPTION:
+                match_len = depth - 1
+                record = self.record_at(position)
+                break
+            child_prefix = key + KEY_SEPARATOR
+            if current == child_prefix + '*':
+                if depth < count:
+                    match_len = depth + 1
+                    record = self.record_at(position)
+                position += 1
+                if position >= self.rule_count:
+                    break
+                current = self.key_at(position)
+            if not current.startswith(child_prefix):
+                break
+        return public_suffix_lookup.build_result(host, labels, match_len, record)
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-p', '--pattern', help = 'path of public suffix pattern', dest = 'pattern', action = 'store', type = 'string')
+    parser.add_option('-o', '--output', help = 'path of binary public suffix pattern', dest = 'output', action = 'store', type = 'string')
+    (opts, args) = parser.parse_args()
+    return (opts.pattern, opts.output)
+
+def main(argv):
+    (ptn_path, output_path) = parse_args()
+    if not ptn_path or not output_path:
+        print >> sys.stderr, 'Usage: %s -p [PatternFileName] -o [BinaryPatternFileName]' %(argv[0])
+        return -1
+    f = pattern_codec.open_read(ptn_path)
+    try:
+        write_binary_pattern(output_path, public_suffix_lookup.iter_pattern_rules(f))
+    finally:
+        f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
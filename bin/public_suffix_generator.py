@@ -8,6 +8,13 @@ Following is specification of the file:
     Each line is read up to the new-line character; entire lines can also be commented using //.
     Each line which is not entirely whitespace or begins with a comment contains a rule record.
     Each rule record has 3 fields separated by tab character: rule, flag, threshold.
+    The rules are merged by pattern_merge: duplicated, shadowed and redundant rules and exceptions which do not change a lookup are removed,
+    a duplicated rule is kept where it is listed last.
+    If pattern_canonical is True (the default), the comments are dropped except the section markers, e.g. '// ===BEGIN ICANN DOMAINS===',
+    the rules between two markers are sorted in canonical order (see pattern_merge), and the pattern starts with a fixed header,
+    so the same rule set in the same sections always has the same checksum, and a change of the upstream comments only does not publish a new version.
+    Otherwise the rules are kept in the order of the upstream list and the customer's file, with their comments and blank lines,
+    and a comment with a non-ASCII character is percent-encoded as a whole, like the pattern before the merge.
     Each rule lists a public suffix, with the subdomain portions separated by dots (.) as usual. There is no leading dot.
     The wildcard character * (asterisk) matches any valid sequence of characters in a hostname part.
     Wildcards may only be used to wildcard an entire level. That is, they must be surrounded by dots (or implicit dots, at the beginning of a line).
@@ -20,31 +27,102 @@ Following is specification of the file:
 Publix Suffix Field:
 rule\tflag\tthreshold
 
-usage:  python public_suffix_generator.py -c public_suffix_generator.conf
+Tenant overlays:
+The rules of custom/customer_public_suffix.txt are merged into the pattern of all tenants.
+The rules of custom/tenants/<tenant>.txt are only written to the overlay pattern ptn/overlay/public_suffix.<tenant>.txt.gz of the tenant,
+which has the same format and is published with each version, so each tenant variant is one small overlay on the shared pattern
+(see public_suffix_lookup.PublicSuffixOverlayTable). Rules which do not change a lookup of the shared pattern, e.g. its own rules, are left out of an overlay.
+A version is published when the shared pattern or any overlay is changed.
+
+Codecs:
+The pattern and the overlays are compressed with pattern_codec (gzip, bz2, lzma or none) at pattern_codec_level,
+and named with the extension of the codec, e.g. ptn/public_suffix.txt.bz2 and public_suffix.txt.<version>.bz2 in S3.
+The manifest entry of a version keeps its codec, and a new codec publishes a new version. Readers detect the codec from the content.
+
+Local store:
+The files of ptn/ (pattern, binary pattern, checksum and overlays) and the raw download of raw/ are kept by pattern_store,
+each file once by the sha256 of its content. A generated pattern set is installed by switching the symlink ptn/current to it at once,
+and ptn/public_suffix.txt.gz and the other names are symlinks to current/<name>, so a reader never opens a file which is being written.
+A generated pattern which is the same as the installed one is not installed again, so the files and their mtime are not changed.
+The last local_store_keep pattern sets are kept, rollback installs the previous one again without generating it.
+
+Memory:
+The input is streamed, only a window of NORMALIZE_WINDOW_LINES lines is held at once. The merge needs the whole rule set,
+so generate holds the rule records of the input, about 400 bytes per rule, and the comments kept if pattern_canonical is False.
+Memory grows with the number of rules, not with the size of the input, its comments or the number of runs of --watch mode.
+
+Commands:
+run         generate the pattern and publish it if it is changed (default)
+generate    generate the pattern in ptn/ only, no publish target is accessed
+publish     publish the pattern of the last generate if it is changed
+check       exit with 1 if the inputs are modified or a publish target does not have the local pattern, 0 if up to date
+rollback    install the previous local pattern set again, publish it by publish
+gc          delete the pattern, overlays and delta of expired versions from the publish targets, also of versions missing from the manifest
+Modules of other commands are imported on first use, e.g. generate never imports boto3 and publish never imports urllib2.
+
+usage:  python public_suffix_generator.py -c public_suffix_generator.conf [run|generate|publish|check|rollback|gc]
 
 '''
 import conf_util
 import aws_s3_util
-import gzip
-import urlparse
-import httplib
+import pattern_storage
+import public_suffix_binary
+import pattern_manifest
+import pattern_delta
+import pattern_merge
+import public_suffix_lookup
+import run_metrics
+import pattern_codec
+import pattern_store
+import re
 import sys
 import os
+import shutil
 import logging
 import time
 import hashlib
-import urllib
-import urllib2
-import contextlib
+import json
+import signal
+import bisect
+import calendar
+import itertools
+import encodings.idna
 from optparse import OptionParser
 
 #public_suffix_provider = 'https://publicsuffix.org/list/public_suffix_list.dat'
 valid_scheme = ['http', 'https']
 
 PUBLIC_SUFFIX_PTN = 'public_suffix.txt'
+PUBLIC_SUFFIX_BIN = 'public_suffix.bin'
+PUBLIC_SUFFIX_CHECKSUM = 'public_suffix.txt.checksum'
+RAW_DOWNLOAD_PUBLIC_SUFFIX = 'download_public_suffix.txt'
+OVERLAY_DIR = 'overlay'
+# name of the overlay of a tenant without the extension of the codec
+PUBLIC_SUFFIX_OVERLAY = 'public_suffix.%s.txt'
+# the only comment of a canonical pattern besides the section markers, so a canonical pattern only changes with its rules
+PUBLIC_SUFFIX_PTN_HEADER = '''// This Source Code Form is subject to the terms of the Mozilla Public License, v. 2.0.
+// If a copy of the MPL was not distributed with this file, You can obtain one at https://mozilla.org/MPL/2.0/.
+// Rules of https://publicsuffix.org/ and the customer's public suffix, merged by public_suffix_generator in canonical order.
+'''
+# a comment line which begins or ends a section, e.g. '// ===BEGIN ICANN DOMAINS===', kept by a canonical pattern
+SECTION_MARKER_RE = re.compile(r'^// ===(BEGIN|END) ')
+TENANT_PUBLIC_SUFFIX_EXT = '.txt'
+# S3 object metadata which keeps the md5 of the uncompressed pattern
+PTN_MD5_METADATA = 'ptn-md5'
 VERSION_TIME_FORMAT_MIN = '%Y%m%d%H%M'
-VERSION_TIME_FORMAT_HOUR = '%Y%m%d%H'
 NS_RETRY = 2
+READ_CHUNK_SIZE = 64 * 1024
+# non-ASCII labels which are converted by a worker pool instead of one by one
+PUNY_CODE_POOL_THRESHOLD = 2000
+PUNY_CODE_POOL_CHUNK_SIZE = 500
+# lines normalized together, the non-ASCII labels of a window are converted in one batch
+NORMALIZE_WINDOW_LINES = 50000
+# removed rules which are logged one by one by the dedupe stage, the rest are only counted
+MERGE_REPORT_LIMIT = 100
+# commands of run(), 'gc' is run by run_gc()
+RUN_COMMANDS = ['run', 'generate', 'publish', 'check', 'rollback']
+# metric name prefix of the Prometheus textfile
+METRICS_PREFIX = 'public_suffix_generator'
 
 class PublicSuffixError(Exception): pass
 class PublicSuffixEnvError(Exception): pass
@@ -59,6 +137,213 @@ def timestamp2str(timestamp, fmt):
 def get_format_time(org_time, org_fmt, new_fmt):
     return time.strftime(new_fmt, time.strptime(org_time, org_fmt))
 
+def get_publish_version(timestamp, latest_versions):
+    # the minute of timestamp, or the minute after the newest of latest_versions, so each publish has a new version
+    version = timestamp2str(timestamp, VERSION_TIME_FORMAT_MIN)
+    latest_versions = [latest for latest in latest_versions if latest]
+    if latest_versions and max(latest_versions) >= version:
+        latest_time = calendar.timegm(time.strptime(max(latest_versions), VERSION_TIME_FORMAT_MIN))
+        version = timestamp2str(latest_time + 60, VERSION_TIME_FORMAT_MIN)
+    return version
+
+def iter_file_chunks(path, chunk_size=READ_CHUNK_SIZE):
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+def iter_lines(chunks):
+    # same lines as ''.join(chunks).split('\n'), without holding the whole content
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    yield pending
+
+class ChecksumWriter(object):
+    # pass writes through to fileobj and keep md5 and size of the written data
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+class HTTPChunks(object):
+    # chunks of an HTTP response, which is closed once it has been read or by close(), whether it has been read or not
+    def __init__(self, f, public_suffix_provider):
+        self.f = f
+        self.public_suffix_provider = public_suffix_provider
+
+    def __iter__(self):
+        size = 0
+        try:
+            while True:
+                try:
+                    chunk = self.f.read(READ_CHUNK_SIZE)
+                except Exception, e:
+                    raise PublicSuffixDownloadError(e)
+                if not chunk:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.close()
+        if size == 0:
+            raise PublicSuffixDownloadError("Fail to get public suffix from %s. Content length is 0" %(self.public_suffix_provider))
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def split_rule_prefix(line):
+    # return (prefix, rule) of a rule line, prefix is '*.', '!' or ''
+    if line.startswith("*."):
+        return (line[0:2], line[2:])
+    elif line.startswith("!"):
+        return (line[0:1], line[1:])
+    return ("", line)
+
+NON_ASCII_RE = re.compile('[\x80-\xff]')
+
+def is_ascii(rule):
+    return NON_ASCII_RE.search(rule) is None
+
+def split_idna_labels(rule):
+    # split a unicode rule like the idna codec does, return (labels, trailing dot)
+    labels = encodings.idna.dots.split(rule)
+    if labels and len(labels[-1]) == 0:
+        del labels[-1]
+        return (labels, '.')
+    return (labels, '')
+
+def check_ascii_rule(rule):
+    # an ASCII rule is not changed by the idna codec, only the label length is checked
+    if len(rule) < 64 and '..' not in rule and not rule.startswith('.'):
+        return rule
+    labels = rule.split('.')
+    if labels and len(labels[-1]) == 0:
+        del labels[-1]
+    for label in labels:
+        if not 0 < len(label) < 64:
+            raise UnicodeError("label empty or too long")
+    return rule
+
+def idna_encode_labels(labels):
+    return [encodings.idna.ToASCII(label) for label in labels]
+
+def get_pattern_set_checksum(md5, overlays, codec = None):
+    # checksum of a pattern, its overlays ({tenant: {'md5': ...}}) and its codec, the md5 of the pattern if it is a gzip pattern without overlay
+    if codec is None:
+        codec = pattern_codec.DEFAULT_CODEC
+    if not md5 or (not overlays and codec == pattern_codec.DEFAULT_CODEC):
+        return md5
+    m = hashlib.md5(md5)
+    for tenant in sorted((overlays or {}).keys()):
+        m.update('\n%s\t%s' %(tenant, overlays[tenant]['md5']))
+    if codec != pattern_codec.DEFAULT_CODEC:
+        m.update('\ncodec\t%s' %codec)
+    return m.hexdigest()
+
+def escape_comment(line):
+    # the pattern is ASCII, a comment with a non-ASCII character is percent-encoded as a whole
+    if is_ascii(line):
+        return line
+    import urllib
+    return urllib.quote(line)
+
+def is_section_marker(line):
+    return SECTION_MARKER_RE.match(line) is not None
+
+def get_last_indexes(records, rules):
+    # {rule: index of its last record in records} of the merged rules, a duplicated rule is written where it is listed last
+    last = dict.fromkeys((record[0] for record in rules), -1)
+    for index in xrange(len(records) - 1, -1, -1):
+        rule = records[index][0]
+        if last.get(rule) == -1:
+            last[rule] = index
+    return last
+
+def iter_pattern_lines(records, comments, last):
+    # the merged records and the comments in the order of the input, comments are (index of the next record, line)
+    comments = iter(comments)
+    comment = next(comments, None)
+    for (index, record) in enumerate(records):
+        while comment is not None and comment[0] <= index:
+            yield comment[1] + '\n'
+            comment = next(comments, None)
+        if last.get(record[0]) == index:
+            yield "%s\t%d\t%d\n" % record
+    while comment is not None:
+        yield comment[1] + '\n'
+        comment = next(comments, None)
+
+def iter_canonical_pattern_lines(rules, markers, last):
+    # the section markers and the merged rules between them in canonical order, rules are in canonical order
+    indexes = [index for (index, line) in markers]
+    get_section = lambda record: bisect.bisect_right(indexes, last[record[0]])
+    section = 0
+    # the sort is stable, so the rules of a section stay in canonical order
+    for record in sorted(rules, key = get_section):
+        while section < get_section(record):
+            yield markers[section][1] + '\n'
+            section += 1
+        yield "%s\t%d\t%d\n" % record
+    for (index, line) in markers[section:]:
+        yield line + '\n'
+
+def iter_windows(lines, size):
+    # lists of size lines of lines, the last one may be shorter
+    lines = iter(lines)
+    while True:
+        window = list(itertools.islice(lines, size))
+        if not window:
+            return
+        yield window
+
+def iter_joined_chunks(lines, chunk_size=READ_CHUNK_SIZE):
+    # join lines into chunks of about chunk_size, so a compressor is not called once per line
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+def write_pattern(path, lines, codec, level):
+    # write lines with codec to path while they are produced, return (md5, size) of the uncompressed content
+    tmp_path = '%s.tmp' %path
+    f = pattern_codec.open_write(tmp_path, codec, level)
+    try:
+        # checksum of the uncompressed content, gzip header has timestamp so the compressed file is not comparable
+        fout = ChecksumWriter(f)
+        for chunk in iter_joined_chunks(lines):
+            fout.write(chunk)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+    return (fout.hexdigest(), fout.size)
+
 class public_suffix_generator(object):
     def __init__(self, config_file):
         self.config_file = config_file
@@ -67,10 +352,59 @@ class public_suffix_generator(object):
         self.validate_config()
         self.prepare_env()
         self.logger = self.get_logger()
-        self.s3_client =aws_s3_util.S3Handler(proxy= self.config['proxy'], proxy_port= self.config['proxy_port'], connect_timeout = self.config['aws_s3_connect_timeout'], read_timeout = self.config['aws_s3_read_timeout'])
+        self.download_validators = {}
+        # state kept between runs of --watch mode
+        self.customer_public_suffix_signature = None
+        self.customer_public_suffix_md5 = None
+        self.puny_code_cache = {}
+        self.previous_puny_code_cache = {}
+        # converted non-ASCII labels of this run
+        self.puny_code_labels = {}
+        self.puny_code_stats = {}
+        self.puny_code_debug = False
+        # worker pool of the IDNA conversion, kept for all windows of a run
+        self.puny_code_pool = None
+        # stage metrics and result of the current run, written to the run report when the run ends
+        self.metrics = run_metrics.RunMetrics()
+        self.run_result = {}
+        self.watching = False
+        # (md5, rules) of the pattern generated by the last run, the base of the delta of a new version
+        self.public_suffix_rules = None
+        self.previous_public_suffix = None
+        self.publish_targets = self.get_publish_targets()
+        # one storage per region, shared by all publish targets in the region, S3 clients are only created by the first request
+        self.storages = {}
+        for target in self.publish_targets:
+            if target['region'] not in self.storages:
+                self.storages[target['region']] = self.new_storage(target['region'])
+        # manifest of each publish target read by this run, keyed by target name
+        self.publish_manifests = {}
+
+    def new_storage(self, region_name):
+        return pattern_storage.new_storage(self.config['storage_backend'], local_root = self.storage_local_root,
+                                           proxy= self.config['proxy'], proxy_port= self.config['proxy_port'], connect_timeout = self.config['aws_s3_connect_timeout'], read_timeout = self.config['aws_s3_read_timeout'],
+                                           multipart_threshold = self.config['aws_s3_multipart_threshold'], multipart_chunksize = self.config['aws_s3_multipart_chunksize'],
+                                           max_concurrency = self.config['aws_s3_max_concurrency'], region_name = region_name)
+
+    def get_storage(self, target):
+        return self.storages[target['region']]
+
+    def get_publish_targets(self):
+        # 'aws_s3_publish_targets' is a list of {'bucket': ..., 'prefix': ..., 'region': ...}
+        # if it is empty, publish to 'aws_s3_bucket'/'aws_s3_prefix' in 'aws_s3_region'
+        if not self.config['aws_s3_publish_targets']:
+            return [{'bucket': self.config['aws_s3_bucket'], 'prefix': self.config['aws_s3_prefix'], 'region': self.config['aws_s3_region']}]
+        targets = []
+        for target in self.config['aws_s3_publish_targets']:
+            targets.append({'bucket': target['bucket'], 'prefix': target['prefix'], 'region': target.get('region', self.config['aws_s3_region'])})
+        return targets
 
     def load_config(self):
-        return conf_util.load_config(self.config_file, ['proxy', 'proxy_port','public_suffix_provider', 'log_level', 'logger_name', 'aws_s3_prefix', 'aws_s3_bucket', 'aws_s3_connect_timeout', 'aws_s3_read_timeout'])
+        return conf_util.load_config(self.config_file, ['proxy', 'proxy_port','public_suffix_provider', 'log_level', 'logger_name', 'aws_s3_prefix', 'aws_s3_bucket', 'aws_s3_connect_timeout', 'aws_s3_read_timeout',
+                                                         'aws_s3_region', 'aws_s3_publish_targets', 'retention_keep_last', 'retention_keep_days', 'watch_interval',
+                                                         'aws_s3_multipart_threshold', 'aws_s3_multipart_chunksize', 'aws_s3_max_concurrency',
+                                                         'metrics_report_path', 'metrics_prometheus_path', 'storage_backend', 'storage_local_root',
+                                                         'pattern_codec', 'pattern_codec_level', 'pattern_canonical', 'local_store_keep'])
 
 
     def set_env_variable(self, var_name):
@@ -85,8 +419,17 @@ class public_suffix_generator(object):
         self.set_env_variable('logger_name')
         self.set_env_variable('aws_s3_bucket')
         self.set_env_variable('aws_s3_prefix')
+        self.set_env_variable('aws_s3_region')
         self.set_env_variable('aws_s3_connect_timeout')
         self.set_env_variable('aws_s3_read_timeout')
+        self.set_env_variable('aws_s3_multipart_threshold')
+        self.set_env_variable('aws_s3_multipart_chunksize')
+        self.set_env_variable('aws_s3_max_concurrency')
+        self.set_env_variable('metrics_report_path')
+        self.set_env_variable('metrics_prometheus_path')
+        self.set_env_variable('storage_backend')
+        self.set_env_variable('storage_local_root')
+        self.set_env_variable('pattern_codec')
 
     def __get_logger(self, logger_name, log_level):
         log_format = '%(name)s[%(asctime)s]-[%(process)s]-[%(levelname)s]: %(message)s'
@@ -126,9 +469,31 @@ class public_suffix_generator(object):
         self.customer_public_suffix_path = os.path.join(self.root, 'custom/customer_public_suffix.txt')
         if not os.path.exists(self.customer_public_suffix_path):
             raise PublicSuffixEnvError('customer public suffix file %s not exists' %self.customer_public_suffix_path)
-        self.raw_download_public_suffix_path = os.path.join(self.raw_dir, 'download_public_suffix.txt')
-        self.public_suffix_ptn_path = os.path.join(self.ptn_dir, '%s.gz' %PUBLIC_SUFFIX_PTN)
-        self.public_suffix_ptn_old = os.path.join(self.ptn_dir, '%s.gz.old' %PUBLIC_SUFFIX_PTN)
+        # optional, a tenant has no overlay if the directory does not exist
+        self.tenant_public_suffix_dir = os.path.join(self.root, 'custom/tenants')
+        self.overlay_ptn_dir = os.path.join(self.ptn_dir, OVERLAY_DIR)
+        self.raw_download_public_suffix_path = os.path.join(self.raw_dir, RAW_DOWNLOAD_PUBLIC_SUFFIX)
+        # the files of ptn/ and raw/ are installed from the local stores
+        self.ptn_store = pattern_store.PatternStore(self.ptn_dir, self.config['local_store_keep'])
+        self.raw_store = pattern_store.PatternStore(self.raw_dir, self.config['local_store_keep'])
+        # ETag/Last-Modified of the raw download and checksum of the customer file used to generate the pattern
+        self.raw_download_validators_path = os.path.join(self.raw_dir, 'download_public_suffix.validators')
+        self.ptn_extension = pattern_codec.get_extension(self.config['pattern_codec'])
+        self.public_suffix_ptn_path = os.path.join(self.ptn_dir, PUBLIC_SUFFIX_PTN + self.ptn_extension)
+        self.public_suffix_checksum_path = os.path.join(self.ptn_dir, PUBLIC_SUFFIX_CHECKSUM)
+        self.public_suffix_bin_path = os.path.join(self.ptn_dir, PUBLIC_SUFFIX_BIN)
+        # relative report paths are in the root directory
+        self.metrics_report_path = None
+        if self.config['metrics_report_path']:
+            self.metrics_report_path = os.path.join(self.root, self.config['metrics_report_path'])
+        self.metrics_prometheus_path = None
+        if self.config['metrics_prometheus_path']:
+            self.metrics_prometheus_path = os.path.join(self.root, self.config['metrics_prometheus_path'])
+        self.storage_local_root = None
+        if self.config['storage_backend'] == 'local':
+            self.storage_local_root = os.path.join(self.root, self.config['storage_local_root'])
+            if not os.path.isdir(self.storage_local_root):
+                raise PublicSuffixEnvError('Local storage directory %s not exists' %self.storage_local_root)
 
     def validate_config(self):
         #conf_util.config_validate_str('proxy', self.config['proxy'])
@@ -139,11 +504,54 @@ class public_suffix_generator(object):
         conf_util.config_validate_str('logger_name', self.config['logger_name'])
         conf_util.config_validate_str('aws_s3_prefix', self.config['aws_s3_prefix'])
         conf_util.config_validate_str('aws_s3_bucket', self.config['aws_s3_bucket'])
+        conf_util.config_validate_str('aws_s3_region', self.config['aws_s3_region'])
+        if self.config['aws_s3_publish_targets']:
+            conf_util.config_validate_list('aws_s3_publish_targets', self.config['aws_s3_publish_targets'])
+            for target in self.config['aws_s3_publish_targets']:
+                if type(target) != dict:
+                    raise conf_util.ConfigKeyError('"aws_s3_publish_targets" should be a list of dictionary')
+                conf_util.config_validate_str('aws_s3_publish_targets bucket', target.get('bucket'))
+                conf_util.config_validate_str('aws_s3_publish_targets prefix', target.get('prefix'))
+                if 'region' in target:
+                    conf_util.config_validate_str('aws_s3_publish_targets region', target['region'])
         conf_util.config_validate_int('aws_s3_connect_timeout', self.config['aws_s3_connect_timeout'], 5, 300)
         conf_util.config_validate_int('aws_s3_read_timeout', self.config['aws_s3_read_timeout'], 5, 300)
+        conf_util.config_validate_int('aws_s3_multipart_threshold', self.config['aws_s3_multipart_threshold'], aws_s3_util.MULTIPART_MIN_CHUNKSIZE, 5 * 1024 * aws_s3_util.MB)
+        conf_util.config_validate_int('aws_s3_multipart_chunksize', self.config['aws_s3_multipart_chunksize'], aws_s3_util.MULTIPART_MIN_CHUNKSIZE, 5 * 1024 * aws_s3_util.MB)
+        conf_util.config_validate_int('aws_s3_max_concurrency', self.config['aws_s3_max_concurrency'], 1, 64)
+        conf_util.config_validate_int('retention_keep_last', self.config['retention_keep_last'], 0, 1000000)
+        conf_util.config_validate_int('retention_keep_days', self.config['retention_keep_days'], 0, 36500)
+        conf_util.config_validate_int('watch_interval', self.config['watch_interval'], 10, 86400)
+        conf_util.config_validate_bool('pattern_canonical', self.config['pattern_canonical'])
+        conf_util.config_validate_int('local_store_keep', self.config['local_store_keep'], 1, 1000)
+        if self.config['metrics_report_path']:
+            conf_util.config_validate_str('metrics_report_path', self.config['metrics_report_path'])
+        if self.config['metrics_prometheus_path']:
+            conf_util.config_validate_str('metrics_prometheus_path', self.config['metrics_prometheus_path'])
+        conf_util.config_validate_str('storage_backend', self.config['storage_backend'])
+        if self.config['storage_backend'] not in pattern_storage.STORAGE_BACKENDS:
+            raise conf_util.ConfigKeyError('"storage_backend" should be one of %s' %', '.join(pattern_storage.STORAGE_BACKENDS))
+        if self.config['storage_backend'] == 'local':
+            conf_util.config_validate_str('storage_local_root', self.config['storage_local_root'])
+        conf_util.config_validate_str('pattern_codec', self.config['pattern_codec'])
+        if self.config['pattern_codec'] not in pattern_codec.CODECS:
+            raise conf_util.ConfigKeyError('"pattern_codec" should be one of %s' %', '.join(pattern_codec.CODECS))
+        if not pattern_codec.is_available(self.config['pattern_codec']):
+            raise conf_util.ConfigKeyError('"pattern_codec" %s is not available, install the lzma module' %self.config['pattern_codec'])
+        if self.config['pattern_codec_level'] is not None:
+            (min_level, max_level, default_level) = pattern_codec.LEVELS[self.config['pattern_codec']]
+            conf_util.config_validate_int('pattern_codec_level', self.config['pattern_codec_level'], min_level, max_level)
 
-    def http_get_public_suffix_data(self, public_suffix_provider):
-        data = None
+    def http_get_public_suffix_data(self, public_suffix_provider, validators=None):
+        # return None if the provider answers 304 Not Modified to the validators of the previous download
+        import urllib2
+        import httplib
+        request = urllib2.Request(public_suffix_provider)
+        if validators:
+            if validators.get('etag'):
+                request.add_header('If-None-Match', validators['etag'])
+            if validators.get('last_modified'):
+                request.add_header('If-Modified-Since', validators['last_modified'])
         try:
             if self.config['proxy'] and self.config['proxy_port']:
                 proxy_url = "%s:%d" %(self.config['proxy'], self.config['proxy_port'])
@@ -152,195 +560,819 @@ class public_suffix_generator(object):
                 url_opener = urllib2.build_opener(proxy_handler)
             else :
                 url_opener = urllib2.build_opener()
-            with contextlib.closing(url_opener.open(public_suffix_provider)) as f:
-                data = f.read()
+            f = url_opener.open(request)
+        except urllib2.HTTPError, e:
+            if validators and e.code == httplib.NOT_MODIFIED:
+                self.download_validators = {'etag': validators.get('etag'), 'last_modified': validators.get('last_modified')}
+                return None
+            raise PublicSuffixDownloadError(e)
         except Exception, e:
             raise PublicSuffixDownloadError(e)
-        if not data:
-            raise PublicSuffixDownloadError("Fail to get public suffix from %s. Content length is 0" %(public_suffix_provider))
-        return data
+        info = f.info()
+        self.download_validators = {'etag': info.getheader('ETag'), 'last_modified': info.getheader('Last-Modified')}
+        return HTTPChunks(f, public_suffix_provider)
 
-    def write_download_public_suffix(self, public_suffix_content):
-        f = open(self.raw_download_public_suffix_path, 'w')
-        f.write("%s" %public_suffix_content)
-        f.close()
+    def write_download_public_suffix(self, public_suffix_chunks):
+        # tee the downloaded chunks to the raw file, the file is installed from the raw store once the download completes
+        stage_dir = self.raw_store.new_stage_dir()
+        try:
+            f = open(os.path.join(stage_dir, RAW_DOWNLOAD_PUBLIC_SUFFIX), 'wb')
+            try:
+                for chunk in public_suffix_chunks:
+                    f.write(chunk)
+                    yield chunk
+            finally:
+                f.close()
+        except:
+            shutil.rmtree(stage_dir, True)
+            raise
+        (set_id, changed, added) = self.raw_store.install_dir(stage_dir)
+        if not changed:
+            self.logger.info('raw public suffix data is the same as the last download')
+
+    def read_download_validators(self):
+        if not os.path.exists(self.raw_download_validators_path) or not os.path.exists(self.raw_download_public_suffix_path):
+            return {}
+        try:
+            with open(self.raw_download_validators_path, 'r') as f:
+                return json.load(f)
+        except Exception, e:
+            self.logger.warn('ignore broken validators file %s. Error: %s' %(self.raw_download_validators_path, e))
+            return {}
+
+    def write_download_validators(self, validators):
+        tmp_path = '%s.tmp' %self.raw_download_validators_path
+        with open(tmp_path, 'w') as f:
+            json.dump(validators, f)
+        os.rename(tmp_path, self.raw_download_validators_path)
+
+    def get_customized_public_suffix_checksum(self):
+        # the file is only read again if its mtime or size is changed since the last run
+        signature = None
+        if os.path.exists(self.customer_public_suffix_path):
+            stat = os.stat(self.customer_public_suffix_path)
+            signature = (stat.st_mtime, stat.st_size)
+            if signature == self.customer_public_suffix_signature:
+                return self.customer_public_suffix_md5
+        m = hashlib.md5()
+        for chunk in self.read_customized_public_suffix_data():
+            m.update(chunk)
+        self.customer_public_suffix_signature = signature
+        self.customer_public_suffix_md5 = m.hexdigest()
+        return self.customer_public_suffix_md5
+
+    def get_tenant_public_suffix_paths(self):
+        # [(tenant, path)] of the tenant public suffix files sorted by tenant
+        if not os.path.isdir(self.tenant_public_suffix_dir):
+            return []
+        paths = []
+        for filename in sorted(os.listdir(self.tenant_public_suffix_dir)):
+            (tenant, ext) = os.path.splitext(filename)
+            if ext != TENANT_PUBLIC_SUFFIX_EXT:
+                continue
+            if not pattern_manifest.is_valid_tenant(tenant):
+                self.logger.warn('ignore tenant public suffix file %s, a tenant name only has letters, digits, \'_\' and \'-\'' %filename)
+                continue
+            paths.append((tenant, os.path.join(self.tenant_public_suffix_dir, filename)))
+        return paths
+
+    def get_custom_inputs_checksum(self):
+        # checksum of the customer's and the tenants' public suffix, the md5 of the customer's public suffix if there is no tenant
+        customer_public_suffix_md5 = self.get_customized_public_suffix_checksum()
+        tenant_paths = self.get_tenant_public_suffix_paths()
+        if not tenant_paths:
+            return customer_public_suffix_md5
+        m = hashlib.md5(customer_public_suffix_md5)
+        for (tenant, path) in tenant_paths:
+            m.update('\n%s\n' %tenant)
+            for chunk in iter_file_chunks(path):
+                m.update(chunk)
+        return m.hexdigest()
 
     def read_customized_public_suffix_data(self):
         if os.path.exists(self.customer_public_suffix_path):
-            f = open(self.customer_public_suffix_path, 'r')
-            content = f.read()
-            f.close()
-            return content
+            return iter_file_chunks(self.customer_public_suffix_path)
         else:
-            return ''
+            return iter([])
+
+    def merge_public_suffix_lines(self, public_suffix_chunks, customer_public_suffix_chunks):
+        lines = itertools.chain(iter_lines(public_suffix_chunks), ['// ===BEGIN WCS TESTKIT DOMAINS'],
+                                iter_lines(customer_public_suffix_chunks), ['// ===END WCS TESTKIT DOMAINS', ''])
+        line_count = 0
+        for line in lines:
+            line_count += 1
+            yield line
+        self.metrics.add('merge', 'lines', line_count)
 
     def puny_code_convert(self, rule):
-        # convert punycode
-        returl = rule
-        punyurl = rule
-        try:
-            punyurl = unicode(returl, 'utf-8').encode('idna')
-            if(returl == punyurl) :
-                msg = "Success, doesn't contain any multi-byte in Domain"
+        # most rules are ASCII, which the idna codec returns as they are, they are checked again rather than cached
+        if is_ascii(rule):
+            self.puny_code_stats['ascii'] += 1
+            punyurl = check_ascii_rule(rule)
+        else:
+            # non-ASCII rules converted by the previous run are reused, so a run only converts new rules
+            punyurl = self.previous_puny_code_cache.get(rule)
+            if punyurl is not None:
+                self.puny_code_stats['cached'] += 1
+                self.puny_code_cache[rule] = punyurl
+                return punyurl
+            self.puny_code_stats['idna'] += 1
+            (labels, trailing_dot) = split_idna_labels(unicode(rule, 'utf-8'))
+            punyurl = '.'.join([self.puny_code_convert_label(label) for label in labels]) + trailing_dot
+            self.puny_code_cache[rule] = punyurl
+        if self.puny_code_debug:
+            if rule == punyurl:
+                self.logger.debug("Success, doesn't contain any multi-byte in Domain[%s]" % punyurl)
             else:
-                msg = "Success, url has converted to puny code"
-            self.logger.debug("%s[%s]" % (msg, punyurl))
-        except Exception, e:
-            raise
+                self.logger.debug("Success, url has converted to puny code[%s]" % punyurl)
         return punyurl
 
-    def generate_public_suffix_ptn(self, public_suffix_content):
-        lines = public_suffix_content.split('\n')
-        fout = gzip.open(self.public_suffix_ptn_path, 'wb')
+    def puny_code_convert_label(self, label):
+        punylabel = self.puny_code_labels.get(label)
+        if punylabel is None:
+            punylabel = self.puny_code_labels[label] = encodings.idna.ToASCII(label)
+            self.puny_code_stats['labels'] += 1
+        return punylabel
+
+    def prepare_puny_code_labels(self, lines):
+        # convert the non-ASCII labels of new rules by a worker pool when there are many of them
+        labels = set()
         for line in lines:
-            if len(line) == 0:
-                fout.write("%s\n" % line)
+            if is_ascii(line) or line.startswith("//"):
                 continue
-            if line.startswith("//") == True:
-                try:
-                    line = line.encode("ascii")
-                    fout.write("%s\n" % line)
-                except Exception, e:
-                    try:# if 'ascii' encode fail, try percent encode
-                        line = urllib.quote(line)
-                        fout.write("%s\n" % line)
-                    except Exception, e:
-                        fout.write("\n")
+            rule = split_rule_prefix(line)[1]
+            if rule in self.previous_puny_code_cache:
                 continue
+            labels.update(split_idna_labels(unicode(rule, 'utf-8'))[0])
+        labels = [label for label in labels if label not in self.puny_code_labels]
+        if len(labels) < PUNY_CODE_POOL_THRESHOLD:
+            return
+        if self.puny_code_pool is None:
+            import multiprocessing
+            self.puny_code_pool = multiprocessing.Pool()
+        chunks = [labels[start:start + PUNY_CODE_POOL_CHUNK_SIZE] for start in range(0, len(labels), PUNY_CODE_POOL_CHUNK_SIZE)]
+        results = self.puny_code_pool.map(idna_encode_labels, chunks)
+        for (chunk, punylabels) in zip(chunks, results):
+            for (label, punylabel) in zip(chunk, punylabels):
+                self.puny_code_labels[label] = punylabel
+        self.puny_code_stats['labels'] += len(labels)
+        self.puny_code_stats['pool_labels'] += len(labels)
+
+    def close_puny_code_pool(self):
+        if self.puny_code_pool is not None:
+            self.puny_code_pool.close()
+            self.puny_code_pool.join()
+            self.puny_code_pool = None
+
+    def generate_public_suffix_ptn(self, public_suffix_lines, output_dir):
+        # write the pattern and the binary pattern to output_dir
+        # only keep the rules of this run in the cache, so it does not grow with removed rules
+        self.previous_puny_code_cache = self.puny_code_cache
+        self.puny_code_cache = {}
+        self.puny_code_labels = {}
+        self.puny_code_stats = {'cached': 0, 'ascii': 0, 'idna': 0, 'labels': 0, 'pool_labels': 0}
+        # debug messages are only built if they are logged
+        self.puny_code_debug = self.logger.isEnabledFor(logging.DEBUG)
+        # the lines are read in windows of NORMALIZE_WINDOW_LINES, so the non-ASCII labels of a window are converted in a batch,
+        # only the rule records are kept for the merge, and the comments by the index of the record they precede
+        canonical = self.config['pattern_canonical']
+        records = []
+        # a canonical pattern only keeps the section markers
+        comments = []
+        with self.metrics.stage('normalize'):
             try:
-                prefix = ""
-                rule = line
-                if line.startswith("*."):
-                    prefix = line[0:2]
-                    rule = line[2:]
-                elif line.startswith("!"):
-                    prefix = line[0:1]
-                    rule = line[1:]
-                rule_ascii = prefix  + self.puny_code_convert(rule)
-            except Exception, e:
-                    raise
-            if rule_ascii is None:
-                raise Exception("can't normalize rule %s" % (line))
-            fout.write("%s\t0\t-1\n" % (rule_ascii))
-        fout.close()
-
-    def is_public_suffix_ptn_checksum_identical(self, old, new):
-        if not os.path.exists(old):
+                for window in iter_windows(public_suffix_lines, NORMALIZE_WINDOW_LINES):
+                    self.prepare_puny_code_labels(window)
+                    for line in window:
+                        if len(line) == 0 or line.startswith("//"):
+                            if not canonical or is_section_marker(line):
+                                comments.append((len(records), escape_comment(line)))
+                            continue
+                        (prefix, rule) = split_rule_prefix(line)
+                        rule_ascii = prefix  + self.puny_code_convert(rule)
+                        if rule_ascii is None:
+                            raise Exception("can't normalize rule %s" % (line))
+                        records.append((rule_ascii, 0, -1))
+            finally:
+                self.close_puny_code_pool()
+        self.metrics.add('normalize', 'rules', len(records))
+        with self.metrics.stage('dedupe'):
+            rules = self.dedupe_public_suffix_rules(records)
+            last = get_last_indexes(records, rules)
+        self.metrics.add('dedupe', 'rules', len(rules))
+        # the merged rules are formatted while they are compressed, the whole pattern is never held as one string
+        if canonical:
+            output = itertools.chain([PUBLIC_SUFFIX_PTN_HEADER], iter_canonical_pattern_lines(rules, comments, last))
+        else:
+            output = iter_pattern_lines(records, comments, last)
+        ptn_path = os.path.join(output_dir, PUBLIC_SUFFIX_PTN + self.ptn_extension)
+        with self.metrics.stage('compress'):
+            (md5, size) = write_pattern(ptn_path, output, self.config['pattern_codec'], self.config['pattern_codec_level'])
+        del records, comments, last, output
+        self.metrics.add('compress', 'bytes_in', size)
+        self.metrics.add('compress', 'bytes_out', os.path.getsize(ptn_path))
+        self.logger.info('puny code: %(cached)d cached rules, %(ascii)d ASCII rules, %(idna)d non-ASCII rules, %(labels)d labels converted (%(pool_labels)d by worker pool)' % self.puny_code_stats)
+        self.public_suffix_ptn_checksum = {'md5': md5, 'size': size, 'rule_count': len(rules), 'codec': self.config['pattern_codec']}
+        # binary index of the same rule set for consumers which mmap the pattern
+        bin_path = os.path.join(output_dir, PUBLIC_SUFFIX_BIN)
+        with self.metrics.stage('binary'):
+            public_suffix_binary.write_binary_pattern(bin_path, rules)
+        self.metrics.add('binary', 'bytes_out', os.path.getsize(bin_path))
+        self.public_suffix_rules = rules
+
+    def dedupe_public_suffix_rules(self, rules, base_index = None):
+        # return the merged rules in canonical order, removed rules are reported and counted in the dedupe stage
+        (rules, removed) = pattern_merge.merge_rules(rules, base_index)
+        for (record, reason, cause) in removed[:MERGE_REPORT_LIMIT]:
+            if cause is None:
+                self.logger.info('remove %s rule %s' %(reason.replace('_', ' '), record[0]))
+            else:
+                self.logger.info('remove %s rule %s by %s' %(reason.replace('_', ' '), record[0], cause))
+        counts = pattern_merge.count_removed(removed)
+        if removed:
+            self.logger.info('remove %d rules: %s' %(len(removed), ', '.join(['%d %s' %(counts[reason], reason) for reason in pattern_merge.REMOVE_REASONS])))
+        for (reason, count) in counts.items():
+            self.metrics.add('dedupe', reason, count)
+        return rules
+
+    def generate_overlay_ptns(self, output_dir):
+        # one overlay pattern per tenant in output_dir/overlay, the rules are normalized like the rules of the shared pattern
+        base_index = pattern_merge.RuleIndex()
+        for record in self.public_suffix_rules:
+            base_index.add(record)
+        overlays = {}
+        tenant_paths = self.get_tenant_public_suffix_paths()
+        if tenant_paths and not os.path.exists(os.path.join(output_dir, OVERLAY_DIR)):
+            os.makedirs(os.path.join(output_dir, OVERLAY_DIR))
+        for (tenant, path) in tenant_paths:
+            rules = []
+            for line in iter_lines(iter_file_chunks(path)):
+                line = line.strip()
+                if not line or line.startswith("//"):
+                    continue
+                (prefix, rule) = split_rule_prefix(line)
+                rules.append((prefix + self.puny_code_convert(rule), 0, -1))
+            output = ["%s\t%d\t%d\n" % record for record in self.dedupe_public_suffix_rules(rules, base_index)]
+            overlay_path = self.get_overlay_ptn_path(tenant, output_dir)
+            (md5, size) = write_pattern(overlay_path, output, self.config['pattern_codec'], self.config['pattern_codec_level'])
+            overlays[tenant] = {'md5': md5, 'size': size, 'rule_count': len(output)}
+            self.metrics.add('overlay', 'rules', len(output))
+            self.metrics.add('overlay', 'bytes_out', os.path.getsize(overlay_path))
+        if overlays:
+            self.logger.info('generate overlay patterns of %d tenants' %len(overlays))
+        return overlays
+
+    def get_overlay_ptn_path(self, tenant, ptn_dir = None):
+        if ptn_dir is None:
+            ptn_dir = self.ptn_dir
+        return os.path.join(ptn_dir, OVERLAY_DIR, PUBLIC_SUFFIX_OVERLAY %tenant + self.ptn_extension)
+
+    def load_previous_public_suffix(self):
+        # rules of the pattern before this run, kept in memory by --watch mode, otherwise read from the local pattern
+        if self.public_suffix_rules is not None:
+            return (self.public_suffix_ptn_checksum['md5'], self.public_suffix_rules)
+        if not os.path.exists(self.public_suffix_ptn_path) or not os.path.exists(self.public_suffix_checksum_path):
+            return None
+        try:
+            with open(self.public_suffix_checksum_path, 'r') as f:
+                md5 = json.load(f)['md5']
+            f = pattern_codec.open_read(self.public_suffix_ptn_path)
+            try:
+                return (md5, list(public_suffix_lookup.iter_pattern_rules(f)))
+            finally:
+                f.close()
+        except Exception, e:
+            self.logger.warn('ignore previous public suffix pattern %s. Error: %s' %(self.public_suffix_ptn_path, e))
+            return None
+
+    def write_public_suffix_ptn_checksum(self, checksum, output_dir):
+        # keys are sorted, so the same checksum is always the same file
+        with open(os.path.join(output_dir, PUBLIC_SUFFIX_CHECKSUM), 'w') as f:
+            json.dump(checksum, f, sort_keys = True)
+
+    def read_public_suffix_ptn_checksum(self):
+        # checksum of the installed pattern, None if there is none
+        if not os.path.exists(self.public_suffix_checksum_path) or not os.path.exists(self.public_suffix_ptn_path):
+            return None
+        try:
+            with open(self.public_suffix_checksum_path, 'r') as f:
+                return json.load(f)
+        except Exception, e:
+            self.logger.warn('ignore broken checksum file %s. Error: %s' %(self.public_suffix_checksum_path, e))
+            return None
+
+    def install_public_suffix_ptn(self, stage_dir):
+        # install the generated files of stage_dir as the local pattern set, unless it is the installed pattern
+        # a pattern written before the store is installed once, so its names are switched to the store
+        if self.ptn_store.get_current() is not None and self.read_public_suffix_ptn_checksum() == self.public_suffix_ptn_checksum:
+            # e.g. a gzip pattern of Python 2.6 has the time of the write, so its bytes are not the bytes of the same rules
+            shutil.rmtree(stage_dir, True)
+            self.logger.info('public suffix pattern is the same as the installed pattern %s' %self.ptn_store.get_current())
+            self.run_result['pattern_set'] = self.ptn_store.get_current()
+            return
+        (set_id, changed, added) = self.ptn_store.install_dir(stage_dir)
+        self.metrics.add('install', 'objects_added', added)
+        if changed:
+            self.logger.info('install public suffix pattern set %s (%d new files)' %(set_id, added))
+        else:
+            self.logger.info('public suffix pattern set %s is installed already' %set_id)
+        self.run_result['pattern_set'] = set_id
+
+    def is_public_suffix_ptn_checksum_identical(self, old_md5, new_md5):
+        if not old_md5:
             # not found old public suffix table
             # view as not identical and should generate new public suffix table to S3
             return False
-        m1 = hashlib.md5()
-        m2 = hashlib.md5()
-        old_f = gzip.open(old, 'rb')
-        old_content = old_f.read()
-        with open('old_f', 'w') as f:
-            f.write(old_content)
-        old_f.close()
-        m1.update(old_content)
-        old_md5 = m1.hexdigest()
-        new_f = gzip.open(new, 'rb')
-        new_content = new_f.read()
-        with open('new_f', 'w') as f:
-            f.write(new_content)
-        m2.update(new_content)
-        new_md5 = m2.hexdigest()
-        if old_md5 == new_md5:
-            return True
-        else:
-            return False
+        return old_md5 == new_md5
+
+    def get_target_name(self, target):
+        if self.config['storage_backend'] == 'local':
+            return '%s/%s/%s' %(self.storage_local_root, target['bucket'], target['prefix'])
+        return 's3://%s/%s (%s)' %(target['bucket'], target['prefix'], target['region'])
+
+    def run_on_publish_targets(self, func, targets, *args):
+        # call func(target, *args) for all targets concurrently
+        # return [(target, result, error)], a failed target does not stop the other targets
+        def call(target):
+            try:
+                return (target, func(target, *args), None)
+            except Exception, e:
+                return (target, None, e)
+        return aws_s3_util.run_in_threads(call, [(target,) for target in targets], len(targets))
+
+    def get_publish_manifest(self, target):
+        # the manifest is one GET, the bucket is only listed once to build the manifest of a target which does not have it yet
+        storage = self.get_storage(target)
+        manifest_key = pattern_manifest.get_manifest_key(target['prefix'])
+        try:
+            return pattern_manifest.loads(storage.get(target['bucket'], manifest_key))
+        except pattern_storage.StorageNotFoundError:
+            self.logger.info('no public suffix manifest in %s, build it from the bucket content' %self.get_target_name(target))
+        content_filename_list = storage.list(target['bucket'], prefix = target['prefix'])
+        return pattern_manifest.build_manifest_from_keys(content_filename_list)
+
+    def put_publish_manifest(self, target, manifest):
+        manifest_key = pattern_manifest.get_manifest_key(target['prefix'])
+        self.get_storage(target).put(target['bucket'], manifest_key, pattern_manifest.dumps(manifest), content_type = 'application/json')
 
-    def get_the_latest_public_suffix_ptn(self):
+    def get_the_latest_public_suffix_ptn_checksum(self, target):
+        # md5 of the latest public suffix pattern in S3, read from the manifest
         try:
-            content_filename_list = self.s3_client.list_bucket_content(self.config['aws_s3_bucket'], prefix = self.config['aws_s3_prefix'])
-            if not content_filename_list:
-                self.logger.info('no reference public suffix pattern in S3')
+            manifest = self.get_publish_manifest(target)
+            self.publish_manifests[self.get_target_name(target)] = manifest
+            latest = pattern_manifest.get_latest(manifest)
+            if latest is None:
+                self.logger.info('no reference public suffix pattern in %s' %self.get_target_name(target))
                 self.logger.info('not able to get the latest public suffix pattern')
-                return
-            content_filename_list.sort()
-            current_latest_key_in_s3 = content_filename_list[-1]
-            self.s3_client.cp_s3_file_to_local(self.config['aws_s3_bucket'], self.public_suffix_ptn_old, current_latest_key_in_s3)
+                return None
+            latest_md5 = latest['md5']
+            if not latest_md5:
+                # published before the manifest existed, the checksum is in the object metadata
+                latest_md5 = self.get_storage(target).head(target['bucket'], latest['key'])['metadata'].get(PTN_MD5_METADATA)
         except Exception, e:
             raise PublicSuffixS3CopyError(e)
-        return
+        if not latest_md5:
+            self.logger.info('the latest public suffix pattern %s has no checksum metadata' %latest['key'])
+        return get_pattern_set_checksum(latest_md5, latest.get('overlays'), latest.get('codec'))
 
-    def save_pattern_to_s3(self, dump_ver):
+    def save_pattern_to_s3(self, target, dump_ver):
         try:
-            remote_filename = "%s.%s.gz" %(PUBLIC_SUFFIX_PTN, dump_ver)
-            remote_path = os.path.join( self.config['aws_s3_prefix'], remote_filename)
-            s3_filename_list = self.s3_client.list_bucket_content( self.config['aws_s3_bucket'], prefix = self.config['aws_s3_prefix'])
-            # check if the specified pattern already in S3 
-            # if already in S3, return directly
-            if remote_path in s3_filename_list:
-                self.logger.info('public suffix version %s already in AWS S3 storage' %dump_ver)
+            codec = self.public_suffix_ptn_checksum.get('codec', pattern_codec.DEFAULT_CODEC)
+            remote_path = pattern_manifest.get_pattern_key(target['prefix'], dump_ver, codec)
+            manifest = self.publish_manifests.get(self.get_target_name(target))
+            if manifest is None:
+                manifest = self.get_publish_manifest(target)
+            # a version is only published once, a retry of the same pattern is done already
+            entry = pattern_manifest.get_version(manifest, dump_ver)
+            if entry is not None:
+                local_md5 = get_pattern_set_checksum(self.public_suffix_ptn_checksum['md5'], self.public_suffix_ptn_checksum.get('overlays'), codec)
+                if get_pattern_set_checksum(entry['md5'], entry.get('overlays'), entry.get('codec')) != local_md5:
+                    raise PublicSuffixS3CopyError('public suffix version %s in %s is another pattern' %(dump_ver, self.get_target_name(target)))
+                self.logger.info('public suffix version %s already in %s' %(dump_ver, self.get_target_name(target)))
                 return
             # if not in S3, copy to S3
-            self.s3_client.cp_local_file_to_s3( self.config['aws_s3_bucket'], self.public_suffix_ptn_path, remote_path, customer_sse_key= None)
-            s3_filename_list.append(remote_path)
+            metadata = {PTN_MD5_METADATA: self.public_suffix_ptn_checksum['md5']}
+            self.get_storage(target).put_file(target['bucket'], remote_path, self.public_suffix_ptn_path, metadata = metadata)
+            overlays = self.save_overlays_to_s3(target, dump_ver)
+            delta = self.save_delta_to_s3(target, pattern_manifest.get_latest(manifest), dump_ver)
+            # the manifest is updated after the pattern, so it never points to a missing pattern
+            pattern_manifest.add_version(manifest, dump_ver, remote_path, md5 = self.public_suffix_ptn_checksum['md5'],
+                                         size = os.path.getsize(self.public_suffix_ptn_path), timestamp = int(time.time()), delta = delta, overlays = overlays, codec = codec)
+            self.put_publish_manifest(target, manifest)
         except Exception, e:
             raise PublicSuffixS3CopyError(e)
 
-    def run(self):
+    def save_overlays_to_s3(self, target, dump_ver):
+        # return the manifest entries of the overlays, {tenant: {'key': ..., 'md5': ..., 'size': ...}}
+        overlays = {}
+        for (tenant, checksum) in self.public_suffix_ptn_checksum.get('overlays', {}).items():
+            overlay_key = pattern_manifest.get_overlay_key(target['prefix'], tenant, dump_ver, self.public_suffix_ptn_checksum.get('codec', pattern_codec.DEFAULT_CODEC))
+            overlay_path = self.get_overlay_ptn_path(tenant)
+            self.get_storage(target).put_file(target['bucket'], overlay_key, overlay_path, metadata = {PTN_MD5_METADATA: checksum['md5']})
+            overlays[tenant] = {'key': overlay_key, 'md5': checksum['md5'], 'size': os.path.getsize(overlay_path)}
+        return overlays
+
+    def load_published_public_suffix(self, target, latest):
+        # rules of the latest version of a target, None if it can not be read or its md5 is not the one of the manifest
+        try:
+            content = pattern_codec.decompress(self.get_storage(target).get(target['bucket'], latest['key']))
+        except Exception, e:
+            self.logger.warn('fail to read public suffix version %s from %s. Error: %s' %(latest['version'], self.get_target_name(target), e))
+            return None
+        if hashlib.md5(content).hexdigest() != latest['md5']:
+            return None
+        return list(public_suffix_lookup.iter_pattern_rules(content.splitlines(True)))
+
+    def save_delta_to_s3(self, target, latest, dump_ver):
+        # the delta base is the previous local pattern if it is the latest version of the target, otherwise it is read from the target
+        # a delta is an optimization for consumers, so a failure only costs them a full download
+        if latest is None or not latest['md5']:
+            return None
+        if self.previous_public_suffix is not None and self.previous_public_suffix[0] == latest['md5']:
+            previous_rules = self.previous_public_suffix[1]
+        else:
+            previous_rules = self.load_published_public_suffix(target, latest)
+            if previous_rules is None:
+                self.logger.info('latest public suffix version %s in %s is not readable, no delta' %(latest['version'], self.get_target_name(target)))
+                return None
+        delta = pattern_delta.compute_delta(previous_rules, self.public_suffix_rules, latest['version'], dump_ver)
+        content = pattern_delta.dumps(delta)
+        delta_key = pattern_delta.get_delta_key(target['prefix'], latest['version'], dump_ver)
+        try:
+            self.get_storage(target).put(target['bucket'], delta_key, content, content_type = 'application/json')
+        except Exception, e:
+            self.logger.warn('fail to copy public suffix delta %s to %s. Error: %s' %(delta_key, self.get_target_name(target), e))
+            return None
+        self.logger.info('public suffix delta from %s: %d added, %d removed, %d changed, %d bytes' %(latest['version'], len(delta['added']), len(delta['removed']), len(delta['changed']), len(content)))
+        # consumers verify the rules they patch with the md5 of the rules of this version
+        rules_md5 = pattern_delta.get_rules_md5(pattern_delta.get_rule_records(self.public_suffix_rules))
+        return {'from': latest['version'], 'key': delta_key, 'size': len(content), 'md5': rules_md5}
+
+    def select_expired_versions(self, versions, latest, keep_last, keep_days, now):
+        # versions are sorted from the oldest to the newest
+        # a version is kept if it is one of the last keep_last versions or it is newer than keep_days, the latest is always kept
+        keep = set([latest])
+        if keep_last > 0:
+            keep.update(versions[-keep_last:])
+        if keep_days > 0:
+            min_version = timestamp2str(now - keep_days * 86400, VERSION_TIME_FORMAT_MIN)
+            keep.update([version for version in versions if version >= min_version])
+        return [version for version in versions if version not in keep]
+
+    def get_version_keys(self, manifest, listed_keys):
+        # {version: set of keys} of the pattern, the overlays and the delta of each version, a delta belongs to the version it leads to
+        # the keys of the bucket are included, so the keys of versions missing from the manifest are collected too
+        keys = {}
+        for entry in manifest['versions']:
+            version_keys = keys.setdefault(entry['version'], set())
+            version_keys.add(entry['key'])
+            if entry.get('delta'):
+                version_keys.add(entry['delta']['key'])
+            for overlay in (entry.get('overlays') or {}).values():
+                version_keys.add(overlay['key'])
+        for key in listed_keys:
+            version = pattern_manifest.parse_pattern_version(key) or pattern_manifest.parse_overlay_version(key)
+            if version is None and pattern_delta.parse_delta_versions(key) is not None:
+                version = pattern_delta.parse_delta_versions(key)[1]
+            if version is not None:
+                keys.setdefault(version, set()).add(key)
+        return keys
+
+    def gc_target(self, target, keep_last, keep_days, dry_run):
+        storage = self.get_storage(target)
+        manifest = self.get_publish_manifest(target)
+        keys = self.get_version_keys(manifest, storage.list(target['bucket'], prefix = target['prefix']))
+        versions = sorted(keys.keys())
+        if not versions:
+            self.logger.info('no public suffix pattern in %s' %self.get_target_name(target))
+            return 0
+        latest = manifest['latest'] or versions[-1]
+        expired_versions = self.select_expired_versions(versions, latest, keep_last, keep_days, int(time.time()))
+        report_prefix = '[dry-run] ' if dry_run else ''
+        expired_size = 0
+        for version in expired_versions:
+            entry = pattern_manifest.get_version(manifest, version)
+            if entry is not None and entry['size']:
+                expired_size += entry['size']
+            self.logger.info('%sexpired public suffix pattern version %s: %s' %(report_prefix, version, ' '.join(sorted(keys[version]))))
+        self.logger.info('%s%s: %d versions, %d expired (%d bytes known), %d kept' %(report_prefix, self.get_target_name(target), len(versions), len(expired_versions), expired_size, len(versions) - len(expired_versions)))
+        if dry_run or not expired_versions:
+            return len(expired_versions)
+        # remove from the manifest first, so consumers never see a deleted version
+        expired_keys = []
+        for version in expired_versions:
+            expired_keys.extend(sorted(keys[version]))
+        pattern_manifest.remove_versions(manifest, expired_versions)
+        self.put_publish_manifest(target, manifest)
+        return storage.delete(target['bucket'], expired_keys)
+
+    def run_gc(self, keep_last = None, keep_days = None, dry_run = False):
         returncode = 0
+        if keep_last is None:
+            keep_last = self.config['retention_keep_last']
+        if keep_days is None:
+            keep_days = self.config['retention_keep_days']
+        if keep_last <= 0 and keep_days <= 0:
+            self.logger.error('no retention policy, set keep last versions or keep days')
+            return -1
+        self.logger.info('delete public suffix patterns except the last %d versions and versions of the last %d days' %(keep_last, keep_days))
+        for (target, deleted, error) in self.run_on_publish_targets(self.gc_target, self.publish_targets, keep_last, keep_days, dry_run):
+            if error is not None:
+                self.logger.error('fail to delete expired public suffix pattern in %s. Error: %s' %(self.get_target_name(target), error))
+                returncode = -1
+            elif not dry_run:
+                self.logger.info('delete %d objects of expired public suffix patterns in %s' %(deleted, self.get_target_name(target)))
+        return returncode
+
+    def get_storage_request_stats(self):
+        operations = {}
+        for storage in self.storages.values():
+            aws_s3_util.merge_request_stats(operations, storage.stats.get())
+        return operations
+
+    def write_run_report(self, returncode):
+        # a report which can not be written only costs the metrics of this run
+        report = self.metrics.report(returncode = returncode, storage_backend = self.config['storage_backend'], storage = self.get_storage_request_stats(), **self.run_result)
+        self.logger.info('run metrics: %s' % ', '.join(['%s %.3fs' %(stage['name'], stage['seconds']) for stage in report['stages']]))
         try:
-            # 1. download the latest public suffix table
-            self.logger.info('download public suffix from [%s]' % self.config['public_suffix_provider'])
-            public_suffix_content = self.http_get_public_suffix_data( self.config['public_suffix_provider'])
-            # 2. get the latest public suffix pattern from S3 bucket
-            self.logger.info('get the latest public suffix pattern from S3')
-            #self.get_the_latest_public_suffix_ptn()
-            # 3. write raw public suffix
-            self.logger.info('write raw public suffix data')
-            self.write_download_public_suffix(public_suffix_content)
-            # 4. read local customized public suffix table
-            self.logger.info('read customer\'s public suffix data')
-            customer_public_suffix_content = self.read_customized_public_suffix_data()
-            # 5. merge download public suffix table with customized table
-            self.logger.info('merge download and customer\'s public suffix data')
-            merged_public_suffix_content = public_suffix_content + '\n' \
-                                           + '// ===BEGIN WCS TESTKIT DOMAINS' +'\n' \
-                                           + customer_public_suffix_content + '\n'  \
-                                           + '// ===END WCS TESTKIT DOMAINS\n'
-            # 6. generate public suffix pattern
-            self.logger.info('generate public suffix pattern')
-            self.generate_public_suffix_ptn(merged_public_suffix_content)
-            # 7. compare checksum of new and the latest public suffix in S3
-            #is_identical = self.is_public_suffix_ptn_checksum_identical(self.public_suffix_ptn_old, self.public_suffix_ptn_path)
-            # 8. Copy to S3
-            '''
-            if is_identical:
-                self.logger.info('puglic suffix pattern is not updated')
+            if self.metrics_report_path:
+                run_metrics.write_file(self.metrics_report_path, run_metrics.dumps(report))
+            if self.metrics_prometheus_path:
+                run_metrics.write_file(self.metrics_prometheus_path, run_metrics.format_prometheus(report, METRICS_PREFIX))
+        except Exception, e:
+            self.logger.warn('fail to write run metrics. Error: %s' %e)
+
+    def download_public_suffix(self):
+        # 1. download the latest public suffix table if it is modified since the last download
+        # return (public suffix chunks, customer's public suffix md5), chunks is None if the inputs of the local pattern are not modified
+        self.logger.info('download public suffix from [%s]' % self.config['public_suffix_provider'])
+        with self.metrics.stage('check_inputs'):
+            validators = self.read_download_validators()
+            customer_public_suffix_md5 = self.get_custom_inputs_checksum()
+        with self.metrics.stage('download'):
+            public_suffix_chunks = self.http_get_public_suffix_data( self.config['public_suffix_provider'], validators)
+        if public_suffix_chunks is None:
+            # validators written by 'generate' are not published yet, the pattern is generated again to publish it
+            if validators.get('customer_md5') == customer_public_suffix_md5 and validators.get('published', True) and os.path.exists(self.public_suffix_ptn_path):
+                self.logger.info('public suffix and customer\'s public suffix are not modified')
                 self.logger.info('do not have to generate new public suffix pattern')
-            else: 
-                self.logger.info('copy public suffix pattern to S3')
-                # convert current timestamp to '%Y%m%d%H' format
-                dump_ver = timestamp2str(int(time.time()), VERSION_TIME_FORMAT_HOUR)
-                # extend time to '%Y%m%d%H%M' format
-                dump_ver = get_format_time(dump_ver, VERSION_TIME_FORMAT_HOUR, VERSION_TIME_FORMAT_MIN)
-                self.save_pattern_to_s3(dump_ver)
-            '''
+                return (None, customer_public_suffix_md5)
+            self.logger.info('public suffix is not modified, use raw public suffix data of the last download')
+            public_suffix_chunks = self.metrics.iter_stage('read_raw', iter_file_chunks(self.raw_download_public_suffix_path), 'bytes_in')
+        else:
+            # 3. write raw public suffix while it is downloading
+            self.logger.info('write raw public suffix data')
+            public_suffix_chunks = self.metrics.iter_stage('download', public_suffix_chunks, 'bytes_in')
+            public_suffix_chunks = self.metrics.iter_stage('write_raw', self.write_download_public_suffix(public_suffix_chunks), 'bytes_out')
+        return (public_suffix_chunks, customer_public_suffix_md5)
+
+    def get_latest_checksums(self):
+        # 2. get the checksum of the latest public suffix pattern from all publish targets
+        self.logger.info('get the latest public suffix pattern checksum from S3')
+        with self.metrics.stage('latest_checksum'):
+            return self.run_on_publish_targets(self.get_the_latest_public_suffix_ptn_checksum, self.publish_targets)
+
+    def generate(self, public_suffix_chunks):
+        # 4. read local customized public suffix table
+        self.logger.info('read customer\'s public suffix data')
+        customer_public_suffix_chunks = self.metrics.iter_stage('read_customer', self.read_customized_public_suffix_data(), 'bytes_in')
+        # 6. the rules of the installed pattern are the delta base of the new pattern
+        with self.metrics.stage('load_previous'):
+            self.previous_public_suffix = self.load_previous_public_suffix()
+        # 5. merge download public suffix table with customized table, steps 1, 3 and 4 are streamed through this step in one pass
+        # each stage is timed while it produces its chunks or lines, so the lines are not collected to time the stages apart
+        # the merge stage is timed per window of lines rather than per line, which would cost more than the merge itself
+        self.logger.info('merge download and customer\'s public suffix data and generate public suffix pattern')
+        merged_public_suffix_windows = self.metrics.iter_stage('merge', iter_windows(self.merge_public_suffix_lines(public_suffix_chunks, customer_public_suffix_chunks),
+                                                                                       NORMALIZE_WINDOW_LINES))
+        merged_public_suffix_lines = itertools.chain.from_iterable(merged_public_suffix_windows)
+        # the files are written to a stage directory and installed together, the installed pattern is never written in place
+        stage_dir = self.ptn_store.new_stage_dir()
+        try:
+            self.generate_public_suffix_ptn(merged_public_suffix_lines, stage_dir)
+            with self.metrics.stage('overlay'):
+                self.public_suffix_ptn_checksum['overlays'] = self.generate_overlay_ptns(stage_dir)
+            self.write_public_suffix_ptn_checksum(self.public_suffix_ptn_checksum, stage_dir)
+            with self.metrics.stage('install'):
+                self.install_public_suffix_ptn(stage_dir)
+        except:
+            shutil.rmtree(stage_dir, True)
+            raise
+
+    def load_local_public_suffix(self):
+        # the pattern of the last 'generate', published by 'publish'
+        with self.metrics.stage('load_local'):
+            local_public_suffix = self.load_previous_public_suffix()
+            if local_public_suffix is None:
+                raise PublicSuffixError('no public suffix pattern in %s, generate it first' %self.ptn_dir)
+            with open(self.public_suffix_checksum_path, 'r') as f:
+                self.public_suffix_ptn_checksum = json.load(f)
+            for tenant in self.public_suffix_ptn_checksum.get('overlays', {}):
+                if not os.path.exists(self.get_overlay_ptn_path(tenant)):
+                    raise PublicSuffixError('no overlay pattern of tenant %s in %s, generate it first' %(tenant, self.overlay_ptn_dir))
+            self.public_suffix_rules = local_public_suffix[1]
+            # the delta base is read from the publish targets
+            self.previous_public_suffix = None
+
+    def publish(self, latest_checksum_results):
+        # 7. compare checksum of new and the latest public suffix in each publish target
+        failed_targets = []
+        changed_targets = []
+        for (target, latest_public_suffix_md5, error) in latest_checksum_results:
+            if error is not None:
+                self.logger.error('fail to get the latest public suffix pattern checksum from %s. Error: %s' %(self.get_target_name(target), error))
+                failed_targets.append(target)
+            elif self.is_public_suffix_ptn_checksum_identical(latest_public_suffix_md5, get_pattern_set_checksum(self.public_suffix_ptn_checksum['md5'], self.public_suffix_ptn_checksum.get('overlays'), self.public_suffix_ptn_checksum.get('codec'))):
+                self.logger.info('puglic suffix pattern is not updated in %s' %self.get_target_name(target))
+            else:
+                changed_targets.append(target)
+        # 8. Copy to S3, all changed publish targets are copied concurrently
+        if not changed_targets:
+            self.logger.info('do not have to generate new public suffix pattern')
+            self.run_result['result'] = 'unchanged'
+        else: 
+            self.logger.info('copy public suffix pattern to S3')
+            # one version for all changed targets, newer than the latest version of each of them
+            latest_versions = []
+            for target in changed_targets:
+                manifest = self.publish_manifests.get(self.get_target_name(target))
+                if manifest is None:
+                    manifest = self.publish_manifests[self.get_target_name(target)] = self.get_publish_manifest(target)
+                latest_versions.append(manifest['latest'])
+            dump_ver = get_publish_version(int(time.time()), latest_versions)
+            self.run_result['version'] = dump_ver
+            with self.metrics.stage('publish'):
+                publish_results = self.run_on_publish_targets(self.save_pattern_to_s3, changed_targets, dump_ver)
+            for (target, result, error) in publish_results:
+                if error is not None:
+                    self.logger.error('fail to copy public suffix pattern to %s. Error: %s' %(self.get_target_name(target), error))
+                    failed_targets.append(target)
+                else:
+                    self.logger.info('copy public suffix pattern to %s successfully' %self.get_target_name(target))
+                    self.metrics.add('publish', 'targets', 1)
+                    self.metrics.add('publish', 'bytes_out', os.path.getsize(self.public_suffix_ptn_path))
+                    for tenant in self.public_suffix_ptn_checksum.get('overlays', {}):
+                        self.metrics.add('publish', 'bytes_out', os.path.getsize(self.get_overlay_ptn_path(tenant)))
+            self.run_result['result'] = 'published'
+        if failed_targets:
+            raise PublicSuffixS3CopyError('fail to publish public suffix pattern to %s' %', '.join([self.get_target_name(target) for target in failed_targets]))
+
+    def run_generate_and_publish(self):
+        (public_suffix_chunks, customer_public_suffix_md5) = self.download_public_suffix()
+        if public_suffix_chunks is None:
+            self.run_result['result'] = 'not_modified'
+            return 0
+        latest_checksum_results = self.get_latest_checksums()
+        self.generate(public_suffix_chunks)
+        self.publish(latest_checksum_results)
+        # keep validators only after the pattern is published, so a failed run is retried by the next run
+        self.download_validators['customer_md5'] = customer_public_suffix_md5
+        self.download_validators['published'] = True
+        self.write_download_validators(self.download_validators)
+        return 0
+
+    def run_generate(self):
+        # steps 1, 3, 4, 5 and 6 only, no publish target is accessed
+        (public_suffix_chunks, customer_public_suffix_md5) = self.download_public_suffix()
+        if public_suffix_chunks is None:
+            self.run_result['result'] = 'not_modified'
+            return 0
+        self.generate(public_suffix_chunks)
+        self.download_validators['customer_md5'] = customer_public_suffix_md5
+        self.download_validators['published'] = False
+        self.write_download_validators(self.download_validators)
+        self.run_result['result'] = 'generated'
+        return 0
+
+    def run_publish(self):
+        # steps 2, 7 and 8 for the pattern of the last 'generate'
+        self.load_local_public_suffix()
+        self.publish(self.get_latest_checksums())
+        validators = self.read_download_validators()
+        if validators and validators.get('customer_md5') and not validators.get('published', True):
+            validators['published'] = True
+            self.write_download_validators(validators)
+        return 0
+
+    def run_rollback(self):
+        # install the previous pattern set, the validators are kept, so 'run' does not generate it again until the inputs are modified
+        current = self.ptn_store.get_current()
+        set_id = self.ptn_store.rollback()
+        self.logger.info('roll back public suffix pattern set %s to %s' %(current, set_id))
+        # the rules in memory of --watch mode are not the rules of the installed pattern any more
+        self.public_suffix_rules = None
+        self.run_result['pattern_set'] = set_id
+        self.run_result['result'] = 'rolled_back'
+        return 0
+
+    def run_check(self):
+        # report whether the inputs of the local pattern are modified and whether the publish targets have the local pattern
+        # return 0 if everything is up to date, 1 if 'run' would generate or publish a pattern
+        with self.metrics.stage('check_inputs'):
+            validators = self.read_download_validators()
+            customer_public_suffix_md5 = self.get_custom_inputs_checksum()
+        with self.metrics.stage('download'):
+            public_suffix_chunks = self.http_get_public_suffix_data( self.config['public_suffix_provider'], validators)
+        inputs_modified = public_suffix_chunks is not None or validators.get('customer_md5') != customer_public_suffix_md5 or not os.path.exists(self.public_suffix_ptn_path)
+        if public_suffix_chunks is not None:
+            # only the response headers have been read
+            public_suffix_chunks.close()
+        if inputs_modified:
+            self.logger.info('public suffix inputs are modified since the local pattern')
+        local_md5 = None
+        if os.path.exists(self.public_suffix_checksum_path):
+            with open(self.public_suffix_checksum_path, 'r') as f:
+                local_checksum = json.load(f)
+            local_md5 = get_pattern_set_checksum(local_checksum['md5'], local_checksum.get('overlays'), local_checksum.get('codec'))
+        outdated_targets = []
+        for (target, latest_public_suffix_md5, error) in self.get_latest_checksums():
+            if error is not None:
+                raise PublicSuffixS3CopyError('fail to get the latest public suffix pattern checksum from %s. Error: %s' %(self.get_target_name(target), error))
+            if not self.is_public_suffix_ptn_checksum_identical(latest_public_suffix_md5, local_md5):
+                self.logger.info('latest public suffix pattern in %s is not the local pattern' %self.get_target_name(target))
+                outdated_targets.append(target)
+        if inputs_modified or outdated_targets:
+            self.run_result['result'] = 'outdated'
+            return 1
+        self.logger.info('public suffix pattern is up to date')
+        self.run_result['result'] = 'up_to_date'
+        return 0
+
+    def run(self, command = 'run'):
+        # command is one of RUN_COMMANDS
+        returncode = 0
+        self.metrics = run_metrics.RunMetrics()
+        for storage in self.storages.values():
+            storage.stats.reset()
+        # result is one of 'not_modified', 'generated', 'unchanged', 'published', 'up_to_date', 'outdated', 'rolled_back' and 'failed'
+        self.run_result = {'command': command, 'result': 'failed', 'version': None}
+        run_funcs = {'run': self.run_generate_and_publish, 'generate': self.run_generate, 'publish': self.run_publish, 'check': self.run_check,
+                     'rollback': self.run_rollback}
+        try:
+            returncode = run_funcs[command]()
         except Exception, e:
-            self.logger.error("fail to generate public suffix pattern. Error: %s" %e)
+            self.logger.error("fail to %s public suffix pattern. Error: %s" %(command, e))
+            self.run_result['result'] = 'failed'
             returncode = -1
+        finally:
+            self.write_run_report(returncode)
         return returncode
 
+    def stop_watch(self, signum, frame):
+        self.logger.info('receive signal %d, stop watching' %signum)
+        self.watching = False
+
+    def watch(self, interval = None, command = 'run'):
+        # keep running and regenerate the pattern when the provider or the customer's public suffix is modified
+        # config, S3 clients and converted rules are kept between runs
+        if interval is None:
+            interval = self.config['watch_interval']
+        self.watching = True
+        signal.signal(signal.SIGTERM, self.stop_watch)
+        signal.signal(signal.SIGINT, self.stop_watch)
+        self.logger.info('watch public suffix every %d seconds' %interval)
+        while self.watching:
+            start_time = time.time()
+            if self.run(command) < 0:
+                self.logger.error('fail to run public suffix generator, retry after %d seconds' %interval)
+            # sleep in short steps, so a stop signal is handled promptly
+            next_time = start_time + interval
+            while self.watching and time.time() < next_time:
+                time.sleep(min(1, next_time - time.time()))
+        return 0
+
 def parse_args():
     parser = OptionParser(option_class=conf_util.ConfigOption)
     parser.add_option('-c', '--config', help = 'path of config file', dest = 'config', action = 'store', type = 'string')
+    parser.add_option('--gc', help = 'same as the gc command', dest = 'gc', action = 'store_true', default = False)
+    parser.add_option('--keep-last', help = 'keep the last N versions (default is retention_keep_last of config)', dest = 'keep_last', action = 'store', type = 'int')
+    parser.add_option('--keep-days', help = 'keep versions of the last N days (default is retention_keep_days of config)', dest = 'keep_days', action = 'store', type = 'int')
+    parser.add_option('--dry-run', help = 'only report expired public suffix patterns', dest = 'dry_run', action = 'store_true', default = False)
+    parser.add_option('--watch', help = 'keep running and regenerate pattern when the inputs are modified', dest = 'watch', action = 'store_true', default = False)
+    parser.add_option('--interval', help = 'seconds between two runs of --watch (default is watch_interval of config)', dest = 'interval', action = 'store', type = 'int')
     (opts, args) = parser.parse_args()
-    return (opts.config)
+    return (opts, args)
 
 
 def main(argv):
-    if len(argv) !=3:
-        print >> sys.stderr, 'Usage: %s -c [ConfigFileName]' %(argv[0])
-        print >> sys.stderr, 'Example: %s -c ./conf/new_domain_redis_agent.conf' %(argv[0])
-        return -1
-    (config_file) = parse_args()
-    if not config_file:
-        print >> sys.stderr, 'Fail to parse --config argument.'
+    (opts, args) = parse_args()
+    command = 'run'
+    if args:
+        command = args[0]
+    if opts.gc:
+        command = 'gc'
+    if not opts.config or len(args) > 1 or command not in RUN_COMMANDS + ['gc']:
+        print >> sys.stderr, 'Usage: %s -c [ConfigFileName] [run|generate|publish|check] [--watch [--interval N]]' %(argv[0])
+        print >> sys.stderr, '       %s -c [ConfigFileName] rollback' %(argv[0])
+        print >> sys.stderr, '       %s -c [ConfigFileName] gc [--keep-last N] [--keep-days N] [--dry-run]' %(argv[0])
+        print >> sys.stderr, 'Example: %s -c ./conf/public_suffix_generator.conf generate' %(argv[0])
         return -1
-    psg = public_suffix_generator(config_file)
-    return psg.run()
+    psg = public_suffix_generator(opts.config)
+    if command == 'gc':
+        return psg.run_gc(opts.keep_last, opts.keep_days, opts.dry_run)
+    if opts.watch:
+        return psg.watch(opts.interval, command)
+    return psg.run(command)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+#!/usr/bin/python2.6
+'''
+public_suffix_log_enrich read access or URL logs, resolve the host of each line against the public suffix pattern and count the lines per registrable domain (eTLD+1)
+Following is specification of the enrichment:
+
+    A log line is split by the delimiter (whitespace by default), and the host is extracted from the given field (0 by default).
+    The field may be a URL ('http://user@www.example.com:8080/path'), a host with port ('www.example.com:8080') or a host name.
+    A quoted field, e.g. the request line of the combined log format '"GET http://www.example.com/ HTTP/1.1"', is split the same way,
+    so the URL of that request line is field 6 of the whole line.
+    The enriched line is the original line plus registrable domain, flag and threshold, separated by tab.
+    The registrable domain is '-' if the line has no host, the host is an IP address, or the host is itself a public suffix.
+    Lines are read in chunks, each chunk is resolved by a worker process, and the partial counts of the workers are merged at the end.
+
+Enriched line:
+<original line>\t<registrable domain>\t<flag>\t<threshold>
+
+Count line (sorted by count descending, then by domain):
+<registrable domain>\t<count>
+
+usage:  python public_suffix_log_enrich.py -p ptn/public_suffix.txt.gz [-f field] [-d delimiter] [-o enriched.gz] [-a counts.txt] [-j processes] access.log.gz ...
+
+'''
+import gzip
+import re
+import sys
+from optparse import OptionParser
+
+import public_suffix_lookup
+
+NO_DOMAIN = '-'
+# lines sent to a worker process at once
+ENRICH_CHUNK_SIZE = 50000
+
+IPV4_RE = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+
+def extract_host(value):
+    # return the host of a URL, 'host:port' or host name, None if there is no host
+    value = value.strip('"')
+    scheme_end = value.find('://')
+    if scheme_end >= 0:
+        value = value[scheme_end + 3:]
+    for separator in '/?#':
+        end = value.find(separator)
+        if end >= 0:
+            value = value[:end]
+    value = value[value.rfind('@') + 1:]
+    if value.startswith('['):
+        # IPv6 literal
+        return None
+    end = value.find(':')
+    if end >= 0:
+        value = value[:end]
+    if not value or IPV4_RE.match(value):
+        return None
+    return value
+
+def open_log(path, mode = 'rb'):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+def iter_log_lines(paths):
+    for path in paths:
+        f = open_log(path)
+        try:
+            for line in f:
+                yield line.rstrip('\r\n')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def iter_chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def enrich_lines(table, lines, field, delimiter = None):
+    # return (enriched text, {registrable domain: count}) of lines
+    hosts = []
+    for line in lines:
+        fields = line.split(delimiter)
+        if field < len(fields):
+            hosts.append(extract_host(fields[field]) or '')
+        else:
+            hosts.append('')
+    results = table.resolve_many(hosts)
+    output = []
+    counts = {}
+    for (line, result) in zip(lines, results):
+        if result is None:
+            (domain, flag, threshold) = (NO_DOMAIN, public_suffix_lookup.DEFAULT_FLAG, public_suffix_lookup.DEFAULT_THRESHOLD)
+        else:
+            (public_suffix, domain, flag, threshold) = result
+            domain = domain or NO_DOMAIN
+        counts[domain] = counts.get(domain, 0) + 1
+        output.append('%s\t%s\t%d\t%d\n' %(line, domain, flag, threshold))
+    return (''.join(output), counts)
+
+def merge_counts(total, counts):
+    for (domain, count) in counts.iteritems():
+        total[domain] = total.get(domain, 0) + count
+    return total
+
+def format_counts(counts):
+    items = sorted(counts.iteritems(), key = lambda item: (-item[1], item[0]))
+    return ''.join(['%s\t%d\n' %(domain, count) for (domain, count) in items])
+
+# (table, field, delimiter) of a worker process of new_enrich_pool, only set in the worker by _init_worker
+_worker_args = None
+
+def _init_worker(table, field, delimiter):
+    global _worker_args
+    _worker_args = (table, field, delimiter)
+
+def _enrich_chunk(lines):
+    (table, field, delimiter) = _worker_args
+    return enrich_lines(table, lines, field, delimiter)
+
+def new_enrich_pool(table, field, delimiter, processes):
+    # imported here, so a run with one process does not import multiprocessing
+    import multiprocessing
+    return multiprocessing.Pool(processes, _init_worker, (table, field, delimiter))
+
+def enrich_logs(table, lines, output, field = 0, delimiter = None, processes = 1, chunk_size = ENRICH_CHUNK_SIZE):
+    # write the enriched lines to output (None to skip) in the input order, return the merged counts
+    total = {}
+    chunks = iter_chunks(lines, chunk_size)
+    pool = None
+    if processes > 1:
+        pool = new_enrich_pool(table, field, delimiter, processes)
+        # the lines are read only a few chunks per worker ahead of the output
+        results = public_suffix_lookup.imap_window(pool, _enrich_chunk, chunks)
+    else:
+        results = (enrich_lines(table, chunk, field, delimiter) for chunk in chunks)
+    try:
+        for (text, counts) in results:
+            if output is not None:
+                output.write(text)
+            merge_counts(total, counts)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-p', '--pattern', help = 'path of public suffix pattern', dest = 'pattern', action = 'store', type = 'string')
+    parser.add_option('-f', '--field', help = 'index of the field which has the URL or host (default is 0)', dest = 'field', action = 'store', type = 'int', default = 0)
+    parser.add_option('-d', '--delimiter', help = 'field delimiter (default is whitespace)', dest = 'delimiter', action = 'store', type = 'string', default = None)
+    parser.add_option('-o', '--output', help = 'path of enriched log, gzip compressed if it ends with .gz, \'-\' for stdout', dest = 'output', action = 'store', type = 'string')
+    parser.add_option('-a', '--aggregate', help = 'path of per registrable domain counts, \'-\' for stdout', dest = 'aggregate', action = 'store', type = 'string')
+    parser.add_option('-j', '--processes', help = 'number of worker processes (default is 1)', dest = 'processes', action = 'store', type = 'int', default = 1)
+    (opts, args) = parser.parse_args()
+    return (opts, args)
+
+def main(argv):
+    (opts, log_paths) = parse_args()
+    if not opts.pattern or not (opts.output or opts.aggregate):
+        print >> sys.stderr, 'Usage: %s -p [PatternFileName] [-f Field] [-d Delimiter] [-o EnrichedFileName] [-a CountFileName] [-j Processes] [LogFileName ...]' %(argv[0])
+        return -1
+    if opts.field < 0:
+        print >> sys.stderr, 'field must not be negative: %d' % opts.field
+        return -1
+    table = public_suffix_lookup.load_public_suffix_table(opts.pattern)
+    output = None
+    if opts.output:
+        output = open_log(opts.output, 'wb')
+    try:
+        counts = enrich_logs(table, iter_log_lines(log_paths or ['-']), output, opts.field, opts.delimiter, opts.processes)
+    finally:
+        if output is not None and output is not sys.stdout:
+            output.close()
+    if opts.aggregate:
+        f = open_log(opts.aggregate, 'wb')
+        try:
+            f.write(format_counts(counts))
+        finally:
+            if f is not sys.stdout:
+                f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,505 @@
+#!/usr/bin/python2.6
+'''
+public_suffix_lookup load the public suffix pattern generated by public_suffix_generator and resolve host names against it
+Following is specification of the lookup:
+
+    The pattern is loaded into a trie keyed by reversed labels, e.g. rule 'co.uk' is stored as root -> 'uk' -> 'co'.
+    A wildcard rule '*.ck' is stored as a '*' child of the node 'ck'.
+    An exception rule '!www.ck' is stored as an exception mark on the node 'ck' -> 'www'.
+    A host name is walked from its last label to its first label, and the longest matching rule (the one with the most levels) will be used.
+    A normal rule takes priority over a wildcard rule of the same level.
+    An exception rule takes priority over any other matching rule, and the public suffix is the exception rule without its first label.
+    If no rule matches, the default rule '*' is used, i.e. the public suffix is the last label of the host name.
+    The registrable domain is the public suffix plus one more label. It is None if the host name is itself a public suffix.
+    If the table is created with a cache size, the results of the most recently used host names are kept in an LRU cache,
+    which is cleared whenever rules are added or a pattern is loaded.
+    An overlay table (PublicSuffixOverlayTable) layers the rules of a small pattern, e.g. the custom suffixes of one tenant,
+    on a base table. The base is shared by all its overlays and never copied or changed, so it must not be changed while they use it.
+    A host name resolved by an overlay gets the result of a table loaded with both patterns, and a rule in both uses the record of the overlay.
+
+Lookup result:
+(public_suffix, registrable_domain, flag, threshold)
+
+usage:  python public_suffix_lookup.py -p ptn/public_suffix.txt.gz [hostname ...]
+        python public_suffix_lookup.py -p ptn/public_suffix.txt.gz -o ptn/overlay/public_suffix.<tenant>.txt.gz [hostname ...]
+        python public_suffix_lookup.py -p ptn/public_suffix.txt.gz [-f hostname_file ...] [-j processes] < hostnames
+
+'''
+import collections
+import gzip
+import sys
+import pattern_codec
+from optparse import OptionParser
+
+RULE_NORMAL = 0
+RULE_WILDCARD = 1
+RULE_EXCEPTION = 2
+
+DEFAULT_FLAG = 0
+DEFAULT_THRESHOLD = -1
+
+# host names sent to a worker process at once by resolve_many
+RESOLVE_CHUNK_SIZE = 50000
+# host names read from the input at once by the command line
+RESOLVE_BATCH_SIZE = 100000
+# chunks submitted to a worker pool and not yet returned, per worker process, so the input is not read ahead of the output
+POOL_CHUNKS_PER_PROCESS = 2
+
+# keys of rule records inside a trie node, labels are always str so the int keys never collide
+_RULE = 0
+_EXCEPTION = 1
+_WILDCARD = '*'
+
+class PublicSuffixLookupError(Exception): pass
+class PublicSuffixRuleError(PublicSuffixLookupError): pass
+
+def parse_rule(rule):
+    if rule.startswith('*.'):
+        return (RULE_WILDCARD, rule[2:])
+    elif rule.startswith('!'):
+        return (RULE_EXCEPTION, rule[1:])
+    return (RULE_NORMAL, rule)
+
+def parse_rule_line(line):
+    # return (rule, flag, threshold) of a pattern line, None for comments and blank lines
+    line = line.strip()
+    if not line or line.startswith('//'):
+        return None
+    fields = line.split('\t')
+    try:
+        if len(fields) == 1:
+            return (fields[0], DEFAULT_FLAG, DEFAULT_THRESHOLD)
+        return (fields[0], int(fields[1]), int(fields[2]))
+    except (IndexError, ValueError):
+        raise PublicSuffixRuleError('invalid pattern line [%s]' % line)
+
+def iter_pattern_rules(lines):
+    for line in lines:
+        record = parse_rule_line(line)
+        if record is not None:
+            yield record
+
+def normalize_hostname(hostname):
+    if isinstance(hostname, unicode):
+        hostname = hostname.encode('idna')
+    hostname = hostname.strip().lower()
+    if hostname.endswith('.'):
+        hostname = hostname[:-1]
+    return hostname
+
+def build_result(host, labels, match_len, record):
+    if record is None:
+        record = (DEFAULT_FLAG, DEFAULT_THRESHOLD)
+    count = len(labels)
+    if match_len >= count:
+        return (host, None, record[0], record[1])
+    return ('.'.join(labels[count - match_len:]), '.'.join(labels[count - match_len - 1:]), record[0], record[1])
+
+# fields of a cache link
+_PREV = 0
+_NEXT = 1
+_KEY = 2
+_VALUE = 3
+
+class LRUCache(object):
+    # size-bounded mapping which evicts the least recently used key, links are [prev, next, key, value] in a circular list
+    def __init__(self, size):
+        if size <= 0:
+            raise PublicSuffixLookupError('invalid cache size %d' % size)
+        self.size = size
+        self.links = {}
+        self.head = []
+        self.head[:] = [self.head, self.head, None, None]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.links)
+
+    def _move_to_front(self, link):
+        head = self.head
+        if link[_PREV] is not head:
+            link[_PREV][_NEXT] = link[_NEXT]
+            link[_NEXT][_PREV] = link[_PREV]
+            link[_PREV] = head
+            link[_NEXT] = head[_NEXT]
+            head[_NEXT][_PREV] = link
+            head[_NEXT] = link
+
+    def get(self, key, default = None):
+        link = self.links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._move_to_front(link)
+        return link[_VALUE]
+
+    def put(self, key, value):
+        link = self.links.get(key)
+        if link is not None:
+            link[_VALUE] = value
+            self._move_to_front(link)
+            return
+        head = self.head
+        if len(self.links) >= self.size:
+            last = head[_PREV]
+            last[_PREV][_NEXT] = head
+            head[_PREV] = last[_PREV]
+            del self.links[last[_KEY]]
+            self.evictions += 1
+        link = [head, head[_NEXT], key, value]
+        head[_NEXT][_PREV] = link
+        head[_NEXT] = link
+        self.links[key] = link
+
+    def clear(self):
+        self.links.clear()
+        self.head[:] = [self.head, self.head, None, None]
+
+    def stats(self):
+        return {'size': self.size, 'entries': len(self.links), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class PublicSuffixTable(object):
+    def __init__(self, cache_size = 0):
+        self.root = {}
+        self.rule_count = 0
+        # most rules share the same (flag, threshold), keep one tuple per distinct value
+        self._records = {}
+        self.cache = None
+        if cache_size > 0:
+            self.cache = LRUCache(cache_size)
+
+    def _record(self, flag, threshold):
+        key = (flag, threshold)
+        return self._records.setdefault(key, key)
+
+    def _get_node(self, labels, create):
+        node = self.root
+        for label in reversed(labels):
+            child = node.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = node[label] = {}
+            node = child
+        return node
+
+    def add_rule(self, rule, flag=DEFAULT_FLAG, threshold=DEFAULT_THRESHOLD):
+        self._add_rule(rule, flag, threshold)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _add_rule(self, rule, flag, threshold):
+        # add a rule without clearing the cache, which is cleared once by the caller
+        (kind, name) = parse_rule(rule)
+        if not name:
+            raise PublicSuffixRuleError('empty rule [%s]' % rule)
+        labels = name.split('.')
+        if kind == RULE_WILDCARD:
+            labels.insert(0, _WILDCARD)
+        node = self._get_node(labels, True)
+        key = _EXCEPTION if kind == RULE_EXCEPTION else _RULE
+        if key not in node:
+            self.rule_count += 1
+        node[key] = self._record(flag, threshold)
+
+    def remove_rule(self, rule):
+        # return False if the rule is not in the table
+        (kind, name) = parse_rule(rule)
+        labels = name.split('.')
+        if kind == RULE_WILDCARD:
+            labels.insert(0, _WILDCARD)
+        labels.reverse()
+        path = [self.root]
+        for label in labels:
+            child = path[-1].get(label)
+            if child is None:
+                return False
+            path.append(child)
+        key = _EXCEPTION if kind == RULE_EXCEPTION else _RULE
+        if key not in path[-1]:
+            return False
+        del path[-1][key]
+        self.rule_count -= 1
+        # drop the nodes which have neither rules nor children
+        for index in xrange(len(labels) - 1, -1, -1):
+            if path[index + 1]:
+                break
+            del path[index][labels[index]]
+        if self.cache is not None:
+            self.cache.clear()
+        return True
+
+    def load(self, lines):
+        for (rule, flag, threshold) in iter_pattern_rules(lines):
+            self._add_rule(rule, flag, threshold)
+        if self.cache is not None:
+            self.cache.clear()
+        return self
+
+    def cache_stats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def _match(self, labels, index, node, depth, match_len, record):
+        # walk labels[index], labels[index - 1], ... from node, return the (match_len, record) of the prevailing rule
+        while index >= 0:
+            depth += 1
+            wildcard = node.get(_WILDCARD)
+            if wildcard is not None and _RULE in wildcard:
+                match_len = depth
+                record = wildcard[_RULE]
+            child = node.get(labels[index])
+            if child is None:
+                break
+            if _EXCEPTION in child:
+                return (depth - 1, child[_EXCEPTION])
+            if _RULE in child:
+                match_len = depth
+                record = child[_RULE]
+            node = child
+            index -= 1
+        return (match_len, record)
+
+    def _match_root(self):
+        # node the walk of _match starts from
+        return self.root
+
+    def lookup(self, hostname):
+        cache = self.cache
+        if cache is not None:
+            result = cache.get(hostname)
+            if result is not None:
+                return result
+        host = normalize_hostname(hostname)
+        if not host:
+            return None
+        labels = host.split('.')
+        # start with the default rule '*'
+        (match_len, record) = self._match(labels, len(labels) - 1, self._match_root(), 0, 1, None)
+        result = build_result(host, labels, match_len, record)
+        if cache is not None:
+            cache.put(hostname, result)
+        return result
+
+    def _first_level(self, tld):
+        # (match_len, record, node) after the walk of the last label, None node if the walk stops there
+        match_len = 1
+        record = None
+        wildcard = self.root.get(_WILDCARD)
+        if wildcard is not None and _RULE in wildcard:
+            record = wildcard[_RULE]
+        child = self.root.get(tld)
+        if child is None:
+            return (match_len, record, None)
+        if _EXCEPTION in child:
+            return (0, child[_EXCEPTION], None)
+        if _RULE in child:
+            record = child[_RULE]
+        return (match_len, record, child)
+
+    def resolve_many(self, hostnames, pool = None, chunk_size = RESOLVE_CHUNK_SIZE):
+        # return the lookup results in the order of hostnames
+        # if pool is created by new_resolve_pool, chunks of hostnames are resolved by the worker processes
+        if pool is not None and len(hostnames) > chunk_size:
+            chunks = (hostnames[start:start + chunk_size] for start in xrange(0, len(hostnames), chunk_size))
+            results = []
+            for chunk_results in imap_window(pool, _resolve_chunk, chunks):
+                results.extend(chunk_results)
+            return results
+        # duplicated host names are resolved once, and the walk of the last label is done once per top-level label
+        resolved = {}
+        first_levels = {}
+        results = []
+        for hostname in hostnames:
+            host = normalize_hostname(hostname)
+            result = resolved.get(host)
+            if result is None and host:
+                labels = host.split('.')
+                first_level = first_levels.get(labels[-1])
+                if first_level is None:
+                    first_level = first_levels[labels[-1]] = self._first_level(labels[-1])
+                (match_len, record, node) = first_level
+                if node is not None:
+                    (match_len, record) = self._match(labels, len(labels) - 2, node, 1, match_len, record)
+                result = resolved[host] = build_result(host, labels, match_len, record)
+            results.append(result)
+        return results
+
+class PublicSuffixOverlayTable(PublicSuffixTable):
+    # rules added to an overlay are kept in its own trie, rule_count is the number of rules of the overlay only
+    # a node of the walk is the pair (base node, overlay node), either may be None
+    def __init__(self, base, cache_size = 0):
+        if isinstance(base, PublicSuffixOverlayTable):
+            raise PublicSuffixLookupError('the base of an overlay can not be an overlay')
+        PublicSuffixTable.__init__(self, cache_size)
+        self.base = base
+
+    def _match_root(self):
+        return (self.base.root, self.root)
+
+    def _match(self, labels, index, nodes, depth, match_len, record):
+        (base_node, node) = nodes
+        while index >= 0:
+            # below the overlay rules, the rest of the walk is the walk of one trie
+            if node is None:
+                return PublicSuffixTable._match(self.base, labels, index, base_node, depth, match_len, record)
+            if base_node is None:
+                return PublicSuffixTable._match(self, labels, index, node, depth, match_len, record)
+            depth += 1
+            wildcard = node.get(_WILDCARD)
+            if wildcard is None or _RULE not in wildcard:
+                wildcard = base_node.get(_WILDCARD)
+            if wildcard is not None and _RULE in wildcard:
+                match_len = depth
+                record = wildcard[_RULE]
+            label = labels[index]
+            base_child = base_node.get(label)
+            child = node.get(label)
+            if child is None and base_child is None:
+                break
+            if child is not None and _EXCEPTION in child:
+                return (depth - 1, child[_EXCEPTION])
+            if base_child is not None and _EXCEPTION in base_child:
+                return (depth - 1, base_child[_EXCEPTION])
+            if child is not None and _RULE in child:
+                match_len = depth
+                record = child[_RULE]
+            elif base_child is not None and _RULE in base_child:
+                match_len = depth
+                record = base_child[_RULE]
+            (base_node, node) = (base_child, child)
+            index -= 1
+        return (match_len, record)
+
+    def _first_level(self, tld):
+        (match_len, record) = self._match([tld], 0, self._match_root(), 0, 1, None)
+        if match_len == 0:
+            return (match_len, record, None)
+        base_child = self.base.root.get(tld)
+        child = self.root.get(tld)
+        if base_child is None and child is None:
+            return (match_len, record, None)
+        return (match_len, record, (base_child, child))
+
+def format_results(hostnames, results):
+    output = []
+    for (hostname, result) in zip(hostnames, results):
+        if result is None:
+            continue
+        (public_suffix, registrable_domain, flag, threshold) = result
+        output.append('%s\t%s\t%s\t%d\t%d\n' %(hostname, public_suffix, registrable_domain or '', flag, threshold))
+    return ''.join(output)
+
+# table of a worker process of new_resolve_pool, only set in the worker by _init_worker
+_worker_table = None
+
+def _init_worker(table):
+    global _worker_table
+    _worker_table = table
+
+def _resolve_chunk(hostnames):
+    return _worker_table.resolve_many(hostnames)
+
+def _format_chunk(hostnames):
+    # formatted in the worker, so only one string per chunk is sent back
+    return format_results(hostnames, _worker_table.resolve_many(hostnames))
+
+def new_resolve_pool(table, processes):
+    # imported here, so loading a table for lookups does not import multiprocessing
+    import multiprocessing
+    # the table is an argument of the initializer of each worker, inherited by fork, so pools of different tables do not share it
+    # and a worker which is started again by the pool gets the table of its own pool
+    return multiprocessing.Pool(processes, _init_worker, (table,))
+
+def imap_window(pool, func, items):
+    # same as pool.imap(func, items), but pool.imap submits all items at once, here at most POOL_CHUNKS_PER_PROCESS per worker are in flight
+    window = len(pool._pool) * POOL_CHUNKS_PER_PROCESS
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+def load_public_suffix_table(ptn_path, cache_size = 0):
+    # the codec of the pattern is detected from its content
+    f = pattern_codec.open_read(ptn_path)
+    try:
+        return PublicSuffixTable(cache_size).load(f)
+    finally:
+        f.close()
+
+def load_public_suffix_overlay(base, ptn_path, cache_size = 0):
+    f = pattern_codec.open_read(ptn_path)
+    try:
+        return PublicSuffixOverlayTable(base, cache_size).load(f)
+    finally:
+        f.close()
+
+def iter_hostname_files(paths):
+    for path in paths:
+        if path == '-':
+            f = sys.stdin
+        elif path.endswith('.gz'):
+            f = gzip.open(path, 'rb')
+        else:
+            f = open(path, 'r')
+        try:
+            for line in f:
+                hostname = line.strip()
+                if hostname:
+                    yield hostname
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-p', '--pattern', help = 'path of public suffix pattern', dest = 'pattern', action = 'store', type = 'string')
+    parser.add_option('-o', '--overlay', help = 'path of overlay pattern, e.g. the pattern of a tenant, layered on the public suffix pattern', dest = 'overlay', action = 'store', type = 'string')
+    parser.add_option('-f', '--file', help = 'file of host names, one per line, \'-\' for stdin. Read stdin if neither file nor host name is given', dest = 'files', action = 'append', type = 'string', default = [])
+    parser.add_option('-j', '--processes', help = 'number of worker processes (default is 1)', dest = 'processes', action = 'store', type = 'int', default = 1)
+    (opts, args) = parser.parse_args()
+    return (opts.pattern, opts.overlay, opts.files, opts.processes, args)
+
+def main(argv):
+    (ptn_path, overlay_path, hostname_files, processes, hostnames) = parse_args()
+    if not ptn_path:
+        print >> sys.stderr, 'Usage: %s -p [PatternFileName] [-o OverlayFileName] [-f HostnameFileName ...] [-j Processes] [hostname ...]' %(argv[0])
+        return -1
+    table = load_public_suffix_table(ptn_path)
+    if overlay_path:
+        table = load_public_suffix_overlay(table, overlay_path)
+    if not hostnames and not hostname_files:
+        hostname_files = ['-']
+    hostnames = iter(hostnames) if hostnames else iter_hostname_files(hostname_files)
+    if processes <= 1:
+        for batch in iter_batches(hostnames, RESOLVE_BATCH_SIZE):
+            sys.stdout.write(format_results(batch, table.resolve_many(batch)))
+        return 0
+    pool = new_resolve_pool(table, processes)
+    try:
+        for output in imap_window(pool, _format_chunk, iter_batches(hostnames, RESOLVE_CHUNK_SIZE)):
+            sys.stdout.write(output)
+    finally:
+        pool.close()
+        pool.join()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
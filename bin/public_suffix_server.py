@@ -0,0 +1,383 @@
+#!/usr/bin/python2.6
+'''
+public_suffix_server load the public suffix pattern once and serve lookups to local clients over HTTP, on localhost or on a Unix socket
+Following is specification of the service:
+
+    The pattern is read from a local file (-p) or from the latest version in S3 (-c, the manifest of aws_s3_bucket/aws_s3_prefix).
+    The source is checked every interval seconds, and immediately on SIGHUP.
+    The manifest in S3 is read with a conditional GET (If-None-Match of its last ETag), so an unchanged manifest costs a 304 response.
+    When a new version is found, the new table is built while the old one keeps serving, then both are swapped in one assignment,
+    so a request always uses one complete table.
+    A pattern downloaded from S3 is verified against the md5 in the manifest before it is loaded.
+    After the first pattern, a new version is patched from the last fetched pattern by the deltas in the manifest if it can be,
+    and the full pattern is only downloaded if the delta chain is broken or the patched rules are not verified (see pattern_delta).
+    After a new table is loaded, the other patterns downloaded or patched in the cache directory are deleted, other files are left.
+    If the new version cannot be loaded, the old table keeps serving.
+
+Requests:
+GET  /lookup?host=www.example.com[&host=...]     lookup of each host name
+POST /lookup                                      lookup of the host names in the body, one per line
+GET  /status                                      version, rule count and load time of the current table
+
+Lookup response (JSON list, one object per host name, null fields if the host name is empty):
+[{"host": "www.example.co.uk", "public_suffix": "co.uk", "registrable_domain": "example.co.uk", "flag": 0, "threshold": -1}]
+
+usage:  python public_suffix_server.py -p ptn/public_suffix.txt.gz [-l 127.0.0.1:8053 | -s /var/run/public_suffix.sock]
+        python public_suffix_server.py -c conf/public_suffix_generator.conf -d /var/cache/public_suffix [-l 127.0.0.1:8053 | -s /var/run/public_suffix.sock]
+
+'''
+import BaseHTTPServer
+import SocketServer
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import urlparse
+from optparse import OptionParser
+
+import aws_s3_util
+import conf_util
+import pattern_codec
+import pattern_delta
+import pattern_manifest
+import public_suffix_lookup
+
+DEFAULT_LISTEN = '127.0.0.1:8053'
+DEFAULT_INTERVAL = 60
+# max size of a batch lookup request body
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+class PublicSuffixServerError(Exception): pass
+class PublicSuffixSourceError(PublicSuffixServerError): pass
+
+def is_cache_file(name):
+    # a pattern downloaded or patched by S3PatternSource, or its temporary file
+    for suffix in ('.tmp', '.patch'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return pattern_manifest.parse_pattern_version(name) is not None
+
+class LocalPatternSource(object):
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def get_latest_version(self):
+        # the version of a local pattern is its modification time and size
+        try:
+            st = os.stat(self.path)
+        except OSError, e:
+            raise PublicSuffixSourceError('fail to stat public suffix pattern %s: %s' %(self.path, e))
+        return '%d.%d' %(int(st.st_mtime), st.st_size)
+
+    def fetch(self, version):
+        return self.path
+
+    def prune(self, path):
+        pass
+
+class S3PatternSource(object):
+    def __init__(self, s3_client, bucket, prefix, cache_dir, logger = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.logger = logger or logging.getLogger('public_suffix_server')
+        self.manifest = None
+        self.manifest_etag = None
+        # (version, path) of the last fetched pattern, the base of the deltas of the next version
+        self.fetched = None
+
+    def __str__(self):
+        return 's3://%s/%s' %(self.bucket, self.prefix)
+
+    def get_latest_version(self):
+        manifest_key = pattern_manifest.get_manifest_key(self.prefix)
+        try:
+            (content, etag) = self.s3_client.get_s3_file_content_if_modified(self.bucket, manifest_key, self.manifest_etag)
+            self.manifest = pattern_manifest.loads(content)
+            self.manifest_etag = etag
+        except aws_s3_util.AWS_S3NotModifiedError:
+            pass
+        except Exception, e:
+            raise PublicSuffixSourceError('fail to get public suffix manifest %s: %s' %(manifest_key, e))
+        return self.manifest['latest']
+
+    def fetch(self, version):
+        entry = pattern_manifest.get_version(self.manifest, version)
+        if entry is None:
+            raise PublicSuffixSourceError('version %s is not in the manifest of %s' %(version, self))
+        path = os.path.join(self.cache_dir, os.path.basename(entry['key']))
+        if not os.path.exists(path):
+            patch_path = self.patch(entry)
+            if patch_path is not None:
+                self.fetched = (version, patch_path)
+                return patch_path
+            try:
+                self.s3_client.cp_s3_file_to_local(self.bucket, path, entry['key'])
+            except Exception, e:
+                raise PublicSuffixSourceError('fail to download public suffix pattern %s: %s' %(entry['key'], e))
+        if entry['md5'] is not None:
+            md5 = pattern_manifest.get_pattern_md5(path)
+            if md5 != entry['md5']:
+                os.remove(path)
+                raise PublicSuffixSourceError('md5 of public suffix pattern %s is %s, expected %s' %(entry['key'], md5, entry['md5']))
+        self.fetched = (version, path)
+        return path
+
+    def get_delta_content(self, key):
+        return self.s3_client.get_s3_file_content(self.bucket, key)
+
+    def patch(self, entry):
+        # apply the deltas after the last fetched version to its pattern, return the path of the patched pattern, None if it can not be patched
+        if self.fetched is None or not os.path.exists(self.fetched[1]):
+            return None
+        path = os.path.join(self.cache_dir, '%s.patch' %os.path.basename(entry['key']))
+        try:
+            pattern_delta.patch_pattern(self.fetched[1], path, self.manifest, self.fetched[0], self.get_delta_content,
+                                        entry['version'], entry.get('codec') or pattern_codec.DEFAULT_CODEC)
+        except Exception, e:
+            self.logger.info('download the full public suffix pattern of version %s: %s' %(entry['version'], e))
+            return None
+        return path
+
+    def prune(self, path):
+        # delete the cached patterns except the pattern at path, which is the base of the deltas of the next version
+        for name in os.listdir(self.cache_dir):
+            cache_path = os.path.join(self.cache_dir, name)
+            if is_cache_file(name) and cache_path != path:
+                try:
+                    os.remove(cache_path)
+                except OSError, e:
+                    self.logger.warning('fail to delete cached public suffix pattern %s: %s' %(cache_path, e))
+
+class PublicSuffixService(object):
+    def __init__(self, source, logger, cache_size = 0):
+        self.source = source
+        self.logger = logger
+        self.cache_size = cache_size
+        # (table, version, load time) of the current table, always replaced as a whole
+        self.state = None
+        # the LRU cache of a table is not thread safe
+        self.cache_lock = threading.Lock()
+
+    def reload(self):
+        # load the latest version if it is not the current one, return True if the table is swapped
+        version = self.source.get_latest_version()
+        if version is None:
+            raise PublicSuffixSourceError('no public suffix pattern in %s' % self.source)
+        if self.state is not None and self.state[1] == version:
+            return False
+        path = self.source.fetch(version)
+        start_time = time.time()
+        table = public_suffix_lookup.load_public_suffix_table(path, self.cache_size)
+        self.state = (table, version, int(time.time()))
+        self.logger.info('load public suffix pattern %s version %s, %d rules in %.3f seconds' %(path, version, table.rule_count, time.time() - start_time))
+        self.source.prune(path)
+        return True
+
+    def try_reload(self):
+        try:
+            return self.reload()
+        except Exception, e:
+            self.logger.error('fail to reload public suffix pattern from %s: %s' %(self.source, e))
+            return False
+
+    def lookup(self, hostnames):
+        table = self.state[0]
+        if len(hostnames) == 1 and table.cache is not None:
+            self.cache_lock.acquire()
+            try:
+                results = [table.lookup(hostnames[0])]
+            finally:
+                self.cache_lock.release()
+        else:
+            results = table.resolve_many(hostnames)
+        response = []
+        for (hostname, result) in zip(hostnames, results):
+            if result is None:
+                result = (None, None, None, None)
+            response.append({'host': hostname, 'public_suffix': result[0], 'registrable_domain': result[1], 'flag': result[2], 'threshold': result[3]})
+        return response
+
+    def status(self):
+        (table, version, load_time) = self.state
+        status = {'source': str(self.source), 'version': version, 'rule_count': table.rule_count, 'load_time': load_time}
+        if table.cache is not None:
+            self.cache_lock.acquire()
+            try:
+                status['cache'] = table.cache_stats()
+            finally:
+                self.cache_lock.release()
+        return status
+
+class LookupRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def address_string(self):
+        # the client address of a Unix socket is empty
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        self.server.service.logger.debug('%s %s' %(self.address_string(), format % args))
+
+    def send_json(self, code, content):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == '/status':
+            self.send_json(200, self.server.service.status())
+        elif url.path == '/lookup':
+            hostnames = urlparse.parse_qs(url.query).get('host')
+            if not hostnames:
+                self.send_json(400, {'error': 'no host'})
+                return
+            self.send_json(200, self.server.service.lookup(hostnames))
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % url.path})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/lookup':
+            self.send_json(404, {'error': 'unknown path %s' % url.path})
+            return
+        try:
+            size = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            size = -1
+        if size < 0 or size > MAX_BODY_SIZE:
+            self.send_json(400, {'error': 'invalid Content-Length'})
+            return
+        hostnames = [line.strip() for line in self.rfile.read(size).splitlines()]
+        self.send_json(200, self.server.service.lookup([hostname for hostname in hostnames if hostname]))
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        # attributes used by BaseHTTPRequestHandler
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def new_server(service, listen = None, socket_path = None):
+    if socket_path:
+        server = ThreadingUnixHTTPServer(socket_path, LookupRequestHandler)
+    else:
+        (host, port) = (listen or DEFAULT_LISTEN).rsplit(':', 1)
+        server = ThreadingHTTPServer((host, int(port)), LookupRequestHandler)
+    server.service = service
+    return server
+
+class PublicSuffixServer(object):
+    def __init__(self, service, server, interval = DEFAULT_INTERVAL):
+        self.service = service
+        self.server = server
+        self.interval = interval
+        self.running = False
+        self.reload_requested = False
+
+    def request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def stop(self, signum, frame):
+        self.service.logger.info('receive signal %d, stop public suffix server' %signum)
+        self.running = False
+
+    def run(self):
+        # requests are served by threads, the main thread checks the source and handles signals
+        if self.service.state is None:
+            self.service.reload()
+        self.running = True
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        server_thread = threading.Thread(target = self.server.serve_forever)
+        server_thread.setDaemon(True)
+        server_thread.start()
+        self.service.logger.info('serve public suffix lookup on %s' %(self.server.server_address,))
+        next_time = time.time() + self.interval
+        try:
+            while self.running:
+                if self.reload_requested or time.time() >= next_time:
+                    self.reload_requested = False
+                    self.service.try_reload()
+                    next_time = time.time() + self.interval
+                time.sleep(0.5)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server, ThreadingUnixHTTPServer) and os.path.exists(self.server.server_address):
+                os.remove(self.server.server_address)
+        return 0
+
+def new_s3_source(config_file, cache_dir, logger = None):
+    # boto3 is only imported by the first S3 request
+    config = conf_util.load_config(config_file, ['proxy', 'proxy_port', 'aws_s3_bucket', 'aws_s3_prefix', 'aws_s3_region', 'aws_s3_connect_timeout', 'aws_s3_read_timeout'])
+    s3_client = aws_s3_util.S3Handler(proxy = config['proxy'], proxy_port = config['proxy_port'], connect_timeout = config['aws_s3_connect_timeout'], read_timeout = config['aws_s3_read_timeout'],
+                                      region_name = config['aws_s3_region'])
+    return S3PatternSource(s3_client, config['aws_s3_bucket'], config['aws_s3_prefix'], cache_dir, logger)
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-p', '--pattern', help = 'path of public suffix pattern', dest = 'pattern', action = 'store', type = 'string')
+    parser.add_option('-c', '--config', help = 'path of public suffix generator config file, serve the latest pattern in S3', dest = 'config', action = 'store', type = 'string')
+    parser.add_option('-d', '--cache-dir', help = 'directory of the patterns downloaded from S3 (default is /tmp)', dest = 'cache_dir', action = 'store', type = 'string', default = '/tmp')
+    parser.add_option('-l', '--listen', help = 'address:port of HTTP server (default is %s)' % DEFAULT_LISTEN, dest = 'listen', action = 'store', type = 'string', default = DEFAULT_LISTEN)
+    parser.add_option('-s', '--socket', help = 'path of Unix socket, instead of HTTP on address:port', dest = 'socket', action = 'store', type = 'string')
+    parser.add_option('-i', '--interval', help = 'seconds between two checks of a new pattern version (default is %d)' % DEFAULT_INTERVAL, dest = 'interval', action = 'store', type = 'int', default = DEFAULT_INTERVAL)
+    parser.add_option('--pid-file', help = 'path of pid file, e.g. for agent1 to send SIGHUP after it installs a new pattern', dest = 'pid_file', action = 'store', type = 'string')
+    parser.add_option('--cache-size', help = 'size of LRU cache of lookup results, 0 to disable (default is 0)', dest = 'cache_size', action = 'store', type = 'int', default = 0)
+    (opts, args) = parser.parse_args()
+    return opts
+
+def main(argv):
+    opts = parse_args()
+    if bool(opts.pattern) == bool(opts.config):
+        print >> sys.stderr, 'Usage: %s -p [PatternFileName] | -c [ConfigFileName] [-d CacheDir] [-l Address:Port | -s SocketPath] [-i Interval] [--pid-file PidFileName] [--cache-size N]' %(argv[0])
+        return -1
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('public_suffix_server')
+    if opts.pattern:
+        source = LocalPatternSource(opts.pattern)
+    else:
+        source = new_s3_source(opts.config, opts.cache_dir, logger)
+    service = PublicSuffixService(source, logger, opts.cache_size)
+    try:
+        service.reload()
+        server = new_server(service, opts.listen, opts.socket)
+    except (PublicSuffixServerError, public_suffix_lookup.PublicSuffixLookupError, socket.error, IOError), e:
+        logger.error('fail to start public suffix server: %s' % e)
+        return -1
+    if opts.pid_file:
+        f = open(opts.pid_file, 'w')
+        try:
+            f.write('%d\n' % os.getpid())
+        finally:
+            f.close()
+    try:
+        return PublicSuffixServer(service, server, opts.interval).run()
+    finally:
+        if opts.pid_file and os.path.exists(opts.pid_file):
+            os.remove(opts.pid_file)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
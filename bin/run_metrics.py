@@ -0,0 +1,171 @@
+#!/usr/bin/python2.6
+'''
+run_metrics measure the stages of a run (wall time, bytes in and out, rules, peak RSS) and write them as a JSON run report or a Prometheus textfile
+Following is specification of the metrics:
+
+    The time of a stage is its own time, a stage entered while another stage is running pauses the outer stage.
+    So the stages of a streamed pipeline, e.g. a download iterator consumed by the pattern generation, are measured apart,
+    and the times of all stages add up to at most the time of the run.
+    The counters of a stage (bytes_in, bytes_out, rules, ...) are free form integers added by the measured code.
+    peak_rss of a stage is the peak resident set size of the process when the stage is left, it never decreases during a run,
+    so the first stage whose peak_rss is close to the peak of the run is the one which allocated the memory.
+    The report and the textfile are written to a temporary file and renamed, so a collector never reads a partial file.
+
+Run report:
+{"start_time": 1449622800, "seconds": 3.2, "peak_rss": 52428800, "result": "published", ...,
+ "stages": [{"name": "download", "seconds": 1.5, "bytes_in": 230000, "peak_rss": 20971520}, ...],
+ "storage": {"put_object": {"requests": 2, "errors": 0, "retries": 0, "seconds": 0.4, "max_seconds": 0.3}, ...}}
+
+Prometheus textfile (one sample per stage counter and per storage operation):
+<prefix>_stage_seconds{stage="download"} 1.5
+<prefix>_storage_requests{operation="put_object"} 2
+
+'''
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+def get_peak_rss():
+    # peak resident set size of the process in bytes, ru_maxrss is in KB except on Mac OS X
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss
+    return peak_rss * 1024
+
+class RunMetrics(object):
+    def __init__(self):
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        # names of the running stages, the last one is charged for the time
+        self.running = []
+        self.stage_names = []
+        self.stages = {}
+
+    def get_stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {'seconds': 0.0}
+            self.stage_names.append(name)
+        return stage
+
+    def switch(self):
+        now = time.time()
+        if self.running:
+            self.stages[self.running[-1]]['seconds'] += now - self.last_time
+        self.last_time = now
+
+    def enter(self, name):
+        self.switch()
+        self.get_stage(name)
+        self.running.append(name)
+
+    def leave(self):
+        self.switch()
+        name = self.running.pop()
+        self.stages[name]['peak_rss'] = get_peak_rss()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield self.stages[name]
+        finally:
+            self.leave()
+
+    def iter_stage(self, name, iterable, counter = None):
+        # measure the time spent producing the items of iterable as stage name, add the length of each item to counter
+        # it is called once per item, e.g. per line, so the time is switched inline and peak_rss is only sampled at the end
+        iterator = iter(iterable)
+        stage = self.get_stage(name)
+        running = self.running
+        try:
+            while True:
+                start = time.time()
+                if running:
+                    self.stages[running[-1]]['seconds'] += start - self.last_time
+                running.append(name)
+                try:
+                    item = iterator.next()
+                except StopIteration:
+                    return
+                finally:
+                    self.last_time = time.time()
+                    stage['seconds'] += self.last_time - start
+                    running.pop()
+                if counter is not None:
+                    stage[counter] = stage.get(counter, 0) + len(item)
+                yield item
+        finally:
+            stage['peak_rss'] = get_peak_rss()
+
+    def add(self, name, counter, value):
+        stage = self.get_stage(name)
+        stage[counter] = stage.get(counter, 0) + value
+
+    def report(self, **fields):
+        # return the run report, fields are added to the top level, e.g. result or version
+        self.switch()
+        stages = []
+        for name in self.stage_names:
+            stage = dict(self.stages[name])
+            stage['name'] = name
+            stages.append(stage)
+        report = {'start_time': int(self.start_time), 'seconds': self.last_time - self.start_time, 'peak_rss': get_peak_rss(), 'stages': stages}
+        report.update(fields)
+        return report
+
+def dumps(report):
+    return json.dumps(report, sort_keys = True, indent = 1)
+
+def format_prometheus_value(value):
+    if value is None:
+        return 'NaN'
+    if type(value) == float:
+        return '%.6f' % value
+    return '%d' % value
+
+def format_prometheus(report, prefix):
+    # gauges of the last run, its stages and its storage requests
+    samples = []
+    def add(name, help_text, metric_type, values):
+        samples.append('# HELP %s_%s %s' %(prefix, name, help_text))
+        samples.append('# TYPE %s_%s %s' %(prefix, name, metric_type))
+        for (labels, value) in values:
+            samples.append('%s_%s%s %s' %(prefix, name, labels, format_prometheus_value(value)))
+    add('last_run_timestamp_seconds', 'start time of the last run', 'gauge', [('', report['start_time'])])
+    add('last_run_seconds', 'wall time of the last run', 'gauge', [('', report['seconds'])])
+    add('last_run_success', '1 if the last run succeeded', 'gauge', [('', int(report.get('returncode', 0) == 0))])
+    add('last_run_peak_rss_bytes', 'peak resident set size of the process', 'gauge', [('', report['peak_rss'])])
+    counters = []
+    for stage in report['stages']:
+        for counter in sorted(stage.keys()):
+            if counter not in ('name', 'seconds', 'peak_rss') and counter not in counters:
+                counters.append(counter)
+    add('stage_seconds', 'wall time of the stage in the last run', 'gauge',
+        [('{stage="%s"}' % stage['name'], stage['seconds']) for stage in report['stages']])
+    add('stage_peak_rss_bytes', 'peak resident set size when the stage was left', 'gauge',
+        [('{stage="%s"}' % stage['name'], stage.get('peak_rss')) for stage in report['stages']])
+    for counter in counters:
+        add('stage_%s' % counter, '%s of the stage in the last run' % counter, 'gauge',
+            [('{stage="%s"}' % stage['name'], stage[counter]) for stage in report['stages'] if counter in stage])
+    operations = sorted(report.get('storage', {}).keys())
+    if operations:
+        storage = report['storage']
+        add('storage_requests', 'storage requests of the last run', 'gauge', [('{operation="%s"}' % operation, storage[operation]['requests']) for operation in operations])
+        add('storage_errors', 'failed storage requests of the last run', 'gauge', [('{operation="%s"}' % operation, storage[operation]['errors']) for operation in operations])
+        add('storage_retries', 'storage request retries of the last run', 'gauge', [('{operation="%s"}' % operation, storage[operation]['retries']) for operation in operations])
+        add('storage_request_seconds_sum', 'total latency of storage requests of the last run', 'gauge', [('{operation="%s"}' % operation, storage[operation]['seconds']) for operation in operations])
+        add('storage_request_seconds_max', 'max latency of storage requests of the last run', 'gauge', [('{operation="%s"}' % operation, storage[operation]['max_seconds']) for operation in operations])
+    return '\n'.join(samples) + '\n'
+
+def write_file(path, content):
+    tmp_path = '%s.tmp' % path
+    f = open(tmp_path, 'w')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
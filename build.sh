@@ -42,3 +42,19 @@ if [ "$?" -ne "0" ]; then
 fi
 
 #rpm -e boto-2.38.0-1.noarch 
+
+# copy the installed files of ptn to deploy, ptn/.store and the current symlink are local to this host
+rm -rf deploy && mkdir deploy
+if [ "$?" -ne "0" ]; then
+	echo "fail to create deploy drectory"
+	exit -1
+fi
+for path in ptn/*; do
+	if [ "$(basename $path)" != "current" ]; then
+		cp -RL $path deploy/
+		if [ "$?" -ne "0" ]; then
+			echo "fail to copy $path to deploy directory"
+			exit -1
+		fi
+	fi
+done
@@ -1,7 +1,7 @@
 #!/bin/sh
 
 mkdir -p /tmp/agent1_test
-cp ${PWD}/bin/agent1.py /tmp/agent1_test
+cp ${PWD}/bin/agent1.py ${PWD}/bin/conf_util.py ${PWD}/bin/aws_s3_util.py ${PWD}/bin/pattern_manifest.py ${PWD}/bin/pattern_codec.py ${PWD}/bin/pattern_delta.py ${PWD}/bin/public_suffix_lookup.py /tmp/agent1_test
 cp ${PWD}/test/unittest/unittest_agent1.py /tmp/agent1_test
 mkdir -p /tmp/agent/report
 nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/agent1_unit_result.xml --cover-erase --with-coverage --cover-package=agent1 -w /tmp/agent1_test/ unittest_agent1.py
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/aws_s3_util_test
+cp ${PWD}/bin/aws_s3_util.py /tmp/aws_s3_util_test
+cp ${PWD}/test/unittest/unittest_aws_s3_util.py /tmp/aws_s3_util_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/aws_s3_util_unit_result.xml --cover-erase --with-coverage --cover-package=aws_s3_util -w /tmp/aws_s3_util_test/ unittest_aws_s3_util.py
+coverage xml -o /tmp/agent/report/aws_s3_util_coverage.xml /tmp/aws_s3_util_test/aws_s3_util.py
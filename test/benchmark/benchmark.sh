@@ -0,0 +1,4 @@
+#!/bin/sh
+# run from the project root, e.g. test/benchmark/benchmark.sh -s 10000,100000 -o /tmp/benchmark.json
+
+PYTHONPATH=${PWD}/bin:${PYTHONPATH} python ${PWD}/test/benchmark/benchmark_public_suffix.py "$@"
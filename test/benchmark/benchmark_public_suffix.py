@@ -0,0 +1,403 @@
+#!/bin/env python2.6
+'''
+benchmark_public_suffix time every stage of public suffix pattern generation, lookup and S3 transfer on synthetic suffix lists
+Following is specification of the benchmark:
+
+    A synthetic list of N rules is generated from a fixed seed, so the same arguments always produce the same list.
+    About 85% of rules are normal rules of 1 to 3 labels, 4% are wildcard rules, 1% are exception rules of a wildcard rule
+    and 10% are IDN rules written in UTF-8, like the rules of the public suffix list.
+    Every stage is run --repeat times on the same input and the fastest run is reported.
+    'items' of a stage is the number of rules, host names or bytes it processes, depending on the stage.
+    S3 transfers use S3Handler with a local stand-in of the S3 client which keeps objects in a temporary directory,
+    so the benchmark runs offline and measures the handler itself (streaming, multipart split, threads) plus local disk I/O.
+    The same objects are also put and got through the local storage backend of pattern_storage.
+    The pattern is compressed with every available codec of pattern_codec at its lowest and default levels,
+    the compressed size of a codec stage is its 'compressed_bytes'.
+    The trie of 5M rules needs several GB of memory, so sizes above 1M are only run if they are given by --sizes.
+
+Result (JSON):
+{"commit": "...", "python": "2.6.9", "platform": "...", "timestamp": 1449622800, "seed": 1, "repeat": 3,
+ "results": [{"stage": "parse", "rules": 10000, "items": 10000, "seconds": 0.052, "items_per_second": 192307.7}]}
+
+usage:  test/benchmark/benchmark.sh [-s 10000,100000,1000000] [-o results.json] [-c previous_results.json]
+
+'''
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import aws_s3_util
+import pattern_codec
+import pattern_merge
+import pattern_storage
+import public_suffix_binary
+import public_suffix_generator
+import public_suffix_lookup
+import run_metrics
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_HOSTS = 200000
+DEFAULT_REPEAT = 3
+DEFAULT_SEED = 1
+# object sizes of the S3 transfer stages, the large one is transferred by multipart upload and ranged GETs
+S3_SMALL_SIZE = 1024 * 1024
+S3_LARGE_SIZE = 64 * 1024 * 1024
+
+LABEL_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+IDN_CHARS = [unichr(code) for code in range(0x4e00, 0x4e00 + 500)] + [unichr(code) for code in range(0xe0, 0xfe)]
+
+def random_label(rnd, min_len = 2, max_len = 10):
+    return ''.join([rnd.choice(LABEL_CHARS) for i in range(rnd.randint(min_len, max_len))])
+
+def random_idn_label(rnd):
+    return u''.join([rnd.choice(IDN_CHARS) for i in range(rnd.randint(2, 5))]).encode('utf-8')
+
+def make_synthetic_list(count, seed):
+    # return the lines of a raw suffix list with count rules
+    rnd = random.Random(seed)
+    tlds = [random_label(rnd, 2, 6) for i in range(max(10, count // 100))]
+    lines = ['// ===BEGIN ICANN DOMAINS===', '']
+    rules = set()
+    wildcards = []
+    while len(rules) < count:
+        kind = rnd.random()
+        tld = rnd.choice(tlds)
+        if kind < 0.85:
+            rule = '.'.join([random_label(rnd) for i in range(rnd.randint(0, 2))] + [tld])
+        elif kind < 0.89:
+            rule = '*.%s.%s' %(random_label(rnd), tld)
+            wildcards.append(rule[2:])
+        elif kind < 0.90 and wildcards:
+            rule = '!%s.%s' %(random_label(rnd), rnd.choice(wildcards))
+        else:
+            rule = '%s.%s' %(random_idn_label(rnd), tld)
+        if rule not in rules:
+            rules.add(rule)
+            lines.append(rule)
+        if len(lines) % 1000 == 0:
+            lines.append('// comment %d' % len(lines))
+    lines.append('// ===END ICANN DOMAINS===')
+    return lines
+
+def make_hostnames(rules, count, seed):
+    # host names under random rules, plus hosts which only match the default rule
+    rnd = random.Random(seed)
+    hostnames = []
+    for i in range(count):
+        if rnd.random() < 0.1:
+            hostnames.append('%s.%s' %(random_label(rnd), random_label(rnd, 2, 4)))
+            continue
+        rule = rnd.choice(rules)
+        (kind, name) = public_suffix_lookup.parse_rule(rule)
+        hostnames.append('%s.%s.%s' %(random_label(rnd), random_label(rnd), name))
+    return hostnames
+
+class LocalS3Conn(object):
+    # stand-in of the boto3 S3 client calls used by S3Handler, objects are files in root
+    def __init__(self, root):
+        self.root = root
+        self.uploads = {}
+
+    def resp(self, status, **kwargs):
+        kwargs['ResponseMetadata'] = {'HTTPStatusCode': status, 'RetryAttempts': 0}
+        return kwargs
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key.replace('/', '_'))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self.path(Bucket, Key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'wb')
+        try:
+            if isinstance(Body, str):
+                f.write(Body)
+            else:
+                shutil.copyfileobj(Body, f, aws_s3_util.STREAM_CHUNK_SIZE)
+        finally:
+            f.close()
+        return self.resp(200, ETag = '"%d"' % os.path.getsize(path))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = 'upload-%d' % len(self.uploads)
+        self.uploads[upload_id] = {}
+        return self.resp(200, UploadId = upload_id)
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.uploads[UploadId][PartNumber] = self.put_object(Bucket, '%s.%s.%d' %(Key, UploadId, PartNumber), Body)
+        return self.resp(200, ETag = '"%d"' % PartNumber)
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        f = open(self.path(Bucket, Key), 'wb')
+        try:
+            for part in MultipartUpload['Parts']:
+                part_path = self.path(Bucket, '%s.%s.%d' %(Key, UploadId, part['PartNumber']))
+                part_file = open(part_path, 'rb')
+                try:
+                    shutil.copyfileobj(part_file, f, aws_s3_util.STREAM_CHUNK_SIZE)
+                finally:
+                    part_file.close()
+                os.remove(part_path)
+        finally:
+            f.close()
+        del self.uploads[UploadId]
+        return self.resp(200)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        return self.resp(204)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return self.resp(200, ContentLength = os.path.getsize(self.path(Bucket, Key)), Metadata = {})
+
+    def get_object(self, Bucket, Key, Range = None, **kwargs):
+        f = open(self.path(Bucket, Key), 'rb')
+        try:
+            if Range is None:
+                return self.resp(200, Body = LocalBody(f.read()))
+            (start, end) = Range[len('bytes='):].split('-')
+            f.seek(int(start))
+            return self.resp(206, Body = LocalBody(f.read(int(end) - int(start) + 1)))
+        finally:
+            f.close()
+
+class LocalBody(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, amt = None):
+        if amt is None:
+            amt = len(self.data) - self.pos
+        chunk = self.data[self.pos:self.pos + amt]
+        self.pos += len(chunk)
+        return chunk
+
+class Benchmark(object):
+    def __init__(self, work_dir, repeat, hosts, seed):
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.hosts = hosts
+        self.seed = seed
+        self.results = []
+        self.logger = logging.getLogger('benchmark_public_suffix')
+
+    def time_stage(self, stage, rules, items, func, *args):
+        # run func repeat times, keep the fastest run and return the result of the last run
+        best = None
+        for i in range(self.repeat):
+            start_time = time.time()
+            result = func(*args)
+            seconds = time.time() - start_time
+            if best is None or seconds < best:
+                best = seconds
+        self.results.append({'stage': stage, 'rules': rules, 'items': items, 'seconds': round(best, 6),
+                             'items_per_second': round(items / best, 1) if best > 0 else None})
+        print >> sys.stderr, '%-16s %9d rules %9d items %10.4f s' %(stage, rules, items, best)
+        return result
+
+    def new_generator(self):
+        # the stages of public_suffix_generator without its config and environment
+        psg = public_suffix_generator.public_suffix_generator.__new__(public_suffix_generator.public_suffix_generator)
+        psg.logger = self.logger
+        psg.puny_code_cache = {}
+        psg.previous_puny_code_cache = {}
+        psg.puny_code_labels = {}
+        psg.puny_code_pool = None
+        psg.public_suffix_rules = None
+        psg.metrics = run_metrics.RunMetrics()
+        psg.config = {'pattern_codec': pattern_codec.DEFAULT_CODEC, 'pattern_codec_level': None, 'pattern_canonical': True}
+        psg.ptn_dir = self.work_dir
+        psg.ptn_extension = pattern_codec.get_extension(pattern_codec.DEFAULT_CODEC)
+        psg.public_suffix_ptn_path = os.path.join(self.work_dir, 'public_suffix.txt.gz')
+        psg.public_suffix_checksum_path = os.path.join(self.work_dir, 'public_suffix.txt.checksum')
+        psg.public_suffix_bin_path = os.path.join(self.work_dir, 'public_suffix.bin')
+        return psg
+
+    def normalize(self, lines):
+        psg = self.new_generator()
+        psg.puny_code_stats = {'cached': 0, 'ascii': 0, 'idna': 0, 'labels': 0, 'pool_labels': 0}
+        psg.puny_code_debug = False
+        try:
+            psg.prepare_puny_code_labels(lines)
+        finally:
+            psg.close_puny_code_pool()
+        rules = []
+        for line in lines:
+            if len(line) == 0 or line.startswith('//'):
+                continue
+            (prefix, rule) = public_suffix_generator.split_rule_prefix(line)
+            rules.append(prefix + psg.puny_code_convert(rule))
+        return rules
+
+    def pattern_write(self, content, path, codec = pattern_codec.DEFAULT_CODEC, level = None):
+        f = pattern_codec.open_write(path, codec, level)
+        try:
+            for start in range(0, len(content), public_suffix_generator.READ_CHUNK_SIZE):
+                f.write(content[start:start + public_suffix_generator.READ_CHUNK_SIZE])
+        finally:
+            f.close()
+
+    def checksum(self, content):
+        md5 = hashlib.md5()
+        for start in range(0, len(content), public_suffix_generator.READ_CHUNK_SIZE):
+            md5.update(content[start:start + public_suffix_generator.READ_CHUNK_SIZE])
+        return md5.hexdigest()
+
+    def generate(self, lines):
+        psg = self.new_generator()
+        psg.generate_public_suffix_ptn(iter(lines), self.work_dir)
+
+    def lookup(self, table, hostnames):
+        for hostname in hostnames:
+            table.lookup(hostname)
+
+    def run_pattern_stages(self, count):
+        lines = make_synthetic_list(count, self.seed)
+        rules = self.time_stage('normalize', count, count, self.normalize, lines)
+        self.time_stage('dedupe', count, count, pattern_merge.merge_rules, [(rule, 0, -1) for rule in rules])
+        content = ''.join(['%s\t0\t-1\n' % rule for rule in rules])
+        ptn_path = os.path.join(self.work_dir, 'benchmark.txt.gz')
+        self.time_stage('gzip_write', count, len(content), self.pattern_write, content, ptn_path)
+        self.run_codec_stages(count, content)
+        self.time_stage('checksum', count, len(content), self.checksum, content)
+        self.time_stage('generate', count, count, self.generate, lines)
+        table = self.time_stage('parse', count, count, public_suffix_lookup.load_public_suffix_table, ptn_path)
+        bin_path = os.path.join(self.work_dir, 'benchmark.bin')
+        records = list(public_suffix_lookup.iter_pattern_rules(content.splitlines()))
+        self.time_stage('binary_write', count, count, public_suffix_binary.write_binary_pattern, bin_path, records)
+        hostnames = make_hostnames(rules, self.hosts, self.seed)
+        self.time_stage('lookup_trie', count, len(hostnames), self.lookup, table, hostnames)
+        self.time_stage('resolve_many', count, len(hostnames), table.resolve_many, hostnames)
+        binary_table = public_suffix_binary.BinaryPublicSuffixTable(bin_path)
+        try:
+            self.time_stage('lookup_binary', count, len(hostnames), self.lookup, binary_table, hostnames)
+        finally:
+            binary_table.close()
+
+    def run_codec_stages(self, count, content):
+        for codec in pattern_codec.CODECS:
+            if codec == 'none' or not pattern_codec.is_available(codec):
+                continue
+            (min_level, max_level, default_level) = pattern_codec.LEVELS[codec]
+            for level in (min_level, default_level):
+                path = os.path.join(self.work_dir, 'benchmark.%s.%d%s' %(codec, level, pattern_codec.get_extension(codec)))
+                self.time_stage('%s_%d_write' %(codec, level), count, len(content), self.pattern_write, content, path, codec, level)
+                self.results[-1]['compressed_bytes'] = os.path.getsize(path)
+                self.time_stage('%s_%d_read' %(codec, level), count, len(content), self.pattern_read, path)
+                self.results[-1]['compressed_bytes'] = os.path.getsize(path)
+                os.remove(path)
+
+    def pattern_read(self, path):
+        f = pattern_codec.open_read(path)
+        try:
+            while f.read(public_suffix_generator.READ_CHUNK_SIZE):
+                pass
+        finally:
+            f.close()
+
+    def run_s3_stages(self):
+        s3_root = os.path.join(self.work_dir, 's3')
+        s3_client = aws_s3_util.S3Handler(conn = LocalS3Conn(s3_root))
+        local_root = os.path.join(self.work_dir, 'storage')
+        os.mkdir(local_root)
+        local_storage = pattern_storage.LocalStorage(local_root)
+        for (name, size) in (('small', S3_SMALL_SIZE), ('large', S3_LARGE_SIZE)):
+            src_path = os.path.join(self.work_dir, 's3_%s.src' % name)
+            dst_path = os.path.join(self.work_dir, 's3_%s.dst' % name)
+            f = open(src_path, 'wb')
+            try:
+                for start in range(0, size, aws_s3_util.MB):
+                    f.write(os.urandom(min(aws_s3_util.MB, size - start)))
+            finally:
+                f.close()
+            key = 'benchmark/%s' % name
+            self.time_stage('s3_put_%s' % name, 0, size, s3_client.cp_local_file_to_s3, 'bucket', src_path, key)
+            self.time_stage('s3_get_%s' % name, 0, size, s3_client.cp_s3_file_to_local, 'bucket', dst_path, key)
+            self.time_stage('local_put_%s' % name, 0, size, local_storage.put_file, 'bucket', key, src_path)
+            self.time_stage('local_get_%s' % name, 0, size, local_storage.get_file, 'bucket', key, dst_path)
+            os.remove(src_path)
+            os.remove(dst_path)
+
+def get_commit():
+    try:
+        proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        (out, err) = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return out.strip()
+
+def compare_results(results, previous):
+    # print seconds of each stage against the previous results, ratio < 1 is faster
+    previous_seconds = {}
+    for item in previous['results']:
+        previous_seconds[(item['stage'], item['rules'])] = item['seconds']
+    print >> sys.stderr, 'compare with commit %s' % previous.get('commit')
+    for item in results['results']:
+        old = previous_seconds.get((item['stage'], item['rules']))
+        if old:
+            print >> sys.stderr, '%-16s %9d rules %10.4f s -> %10.4f s  x%.2f' %(item['stage'], item['rules'], old, item['seconds'], item['seconds'] / old)
+
+def parse_args():
+    parser = OptionParser()
+    parser.add_option('-s', '--sizes', help = 'comma separated rule counts (default is %s)' % ','.join([str(size) for size in DEFAULT_SIZES]), dest = 'sizes', action = 'store', type = 'string')
+    parser.add_option('-n', '--hosts', help = 'number of host names of lookup stages (default is %d)' % DEFAULT_HOSTS, dest = 'hosts', action = 'store', type = 'int', default = DEFAULT_HOSTS)
+    parser.add_option('-r', '--repeat', help = 'runs of each stage, the fastest is reported (default is %d)' % DEFAULT_REPEAT, dest = 'repeat', action = 'store', type = 'int', default = DEFAULT_REPEAT)
+    parser.add_option('--seed', help = 'seed of synthetic lists (default is %d)' % DEFAULT_SEED, dest = 'seed', action = 'store', type = 'int', default = DEFAULT_SEED)
+    parser.add_option('--no-s3', help = 'skip S3 transfer stages', dest = 's3', action = 'store_false', default = True)
+    parser.add_option('-o', '--output', help = 'path of JSON results (default is stdout)', dest = 'output', action = 'store', type = 'string')
+    parser.add_option('-c', '--compare', help = 'path of JSON results of a previous run to compare with', dest = 'compare', action = 'store', type = 'string')
+    (opts, args) = parser.parse_args()
+    return opts
+
+def main(argv):
+    opts = parse_args()
+    sizes = DEFAULT_SIZES
+    if opts.sizes:
+        try:
+            sizes = [int(size) for size in opts.sizes.split(',') if size.strip()]
+        except ValueError:
+            print >> sys.stderr, 'Usage: %s [-s Size,Size,...] [-n Hosts] [-r Repeat] [--seed Seed] [--no-s3] [-o OutputFileName] [-c PreviousOutputFileName]' %(argv[0])
+            return -1
+    work_dir = tempfile.mkdtemp(prefix = 'benchmark_public_suffix_')
+    benchmark = Benchmark(work_dir, max(1, opts.repeat), opts.hosts, opts.seed)
+    try:
+        for size in sizes:
+            benchmark.run_pattern_stages(size)
+        if opts.s3:
+            benchmark.run_s3_stages()
+    finally:
+        shutil.rmtree(work_dir)
+    results = {'commit': get_commit(), 'python': platform.python_version(), 'platform': platform.platform(), 'timestamp': int(time.time()),
+               'seed': opts.seed, 'repeat': opts.repeat, 'hosts': opts.hosts, 'results': benchmark.results}
+    content = json.dumps(results, sort_keys = True, indent = 1)
+    if opts.output:
+        f = open(opts.output, 'w')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+    else:
+        print content
+    if opts.compare:
+        f = open(opts.compare, 'r')
+        try:
+            compare_results(results, json.load(f))
+        finally:
+            f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/pattern_codec_test
+cp ${PWD}/bin/pattern_codec.py /tmp/pattern_codec_test
+cp ${PWD}/test/unittest/unittest_pattern_codec.py /tmp/pattern_codec_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/pattern_codec_unit_result.xml --cover-erase --with-coverage --cover-package=pattern_codec -w /tmp/pattern_codec_test/ unittest_pattern_codec.py
+coverage xml -o /tmp/agent/report/pattern_codec_coverage.xml /tmp/pattern_codec_test/pattern_codec.py
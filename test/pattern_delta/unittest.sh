@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/pattern_delta_test
+cp ${PWD}/bin/pattern_delta.py ${PWD}/bin/pattern_manifest.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/pattern_codec.py /tmp/pattern_delta_test
+cp ${PWD}/test/unittest/unittest_pattern_delta.py /tmp/pattern_delta_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/pattern_delta_unit_result.xml --cover-erase --with-coverage --cover-package=pattern_delta -w /tmp/pattern_delta_test/ unittest_pattern_delta.py
+coverage xml -o /tmp/agent/report/pattern_delta_coverage.xml /tmp/pattern_delta_test/pattern_delta.py
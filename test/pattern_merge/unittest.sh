@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/pattern_merge_test
+cp ${PWD}/bin/pattern_merge.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/pattern_codec.py /tmp/pattern_merge_test
+cp ${PWD}/test/unittest/unittest_pattern_merge.py /tmp/pattern_merge_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/pattern_merge_unit_result.xml --cover-erase --with-coverage --cover-package=pattern_merge -w /tmp/pattern_merge_test/ unittest_pattern_merge.py
+coverage xml -o /tmp/agent/report/pattern_merge_coverage.xml /tmp/pattern_merge_test/pattern_merge.py
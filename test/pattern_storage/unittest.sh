@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/pattern_storage_test
+cp ${PWD}/bin/pattern_storage.py ${PWD}/bin/aws_s3_util.py /tmp/pattern_storage_test
+cp ${PWD}/test/unittest/unittest_pattern_storage.py /tmp/pattern_storage_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/pattern_storage_unit_result.xml --cover-erase --with-coverage --cover-package=pattern_storage -w /tmp/pattern_storage_test/ unittest_pattern_storage.py
+coverage xml -o /tmp/agent/report/pattern_storage_coverage.xml /tmp/pattern_storage_test/pattern_storage.py
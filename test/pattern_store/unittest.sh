@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/pattern_store_test
+cp ${PWD}/bin/pattern_store.py /tmp/pattern_store_test
+cp ${PWD}/test/unittest/unittest_pattern_store.py /tmp/pattern_store_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/pattern_store_unit_result.xml --cover-erase --with-coverage --cover-package=pattern_store -w /tmp/pattern_store_test/ unittest_pattern_store.py
+coverage xml -o /tmp/agent/report/pattern_store_coverage.xml /tmp/pattern_store_test/pattern_store.py
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/public_suffix_binary_test
+cp ${PWD}/bin/public_suffix_binary.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/pattern_codec.py /tmp/public_suffix_binary_test
+cp ${PWD}/test/unittest/unittest_public_suffix_binary.py /tmp/public_suffix_binary_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/public_suffix_binary_unit_result.xml --cover-erase --with-coverage --cover-package=public_suffix_binary -w /tmp/public_suffix_binary_test/ unittest_public_suffix_binary.py
+coverage xml -o /tmp/agent/report/public_suffix_binary_coverage.xml /tmp/public_suffix_binary_test/public_suffix_binary.py
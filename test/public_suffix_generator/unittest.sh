@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/public_suffix_generator_test
+cp ${PWD}/bin/public_suffix_generator.py ${PWD}/bin/conf_util.py ${PWD}/bin/aws_s3_util.py ${PWD}/bin/pattern_storage.py ${PWD}/bin/pattern_manifest.py ${PWD}/bin/pattern_delta.py ${PWD}/bin/pattern_merge.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/public_suffix_binary.py ${PWD}/bin/run_metrics.py ${PWD}/bin/pattern_codec.py ${PWD}/bin/pattern_store.py /tmp/public_suffix_generator_test
+cp ${PWD}/test/unittest/unittest_public_suffix_generator.py /tmp/public_suffix_generator_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/public_suffix_generator_unit_result.xml --cover-erase --with-coverage --cover-package=public_suffix_generator -w /tmp/public_suffix_generator_test/ unittest_public_suffix_generator.py
+coverage xml -o /tmp/agent/report/public_suffix_generator_coverage.xml /tmp/public_suffix_generator_test/public_suffix_generator.py
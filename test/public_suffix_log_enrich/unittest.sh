@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/public_suffix_log_enrich_test
+cp ${PWD}/bin/public_suffix_log_enrich.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/pattern_codec.py /tmp/public_suffix_log_enrich_test
+cp ${PWD}/test/unittest/unittest_public_suffix_log_enrich.py /tmp/public_suffix_log_enrich_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/public_suffix_log_enrich_unit_result.xml --cover-erase --with-coverage --cover-package=public_suffix_log_enrich -w /tmp/public_suffix_log_enrich_test/ unittest_public_suffix_log_enrich.py
+coverage xml -o /tmp/agent/report/public_suffix_log_enrich_coverage.xml /tmp/public_suffix_log_enrich_test/public_suffix_log_enrich.py
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/public_suffix_server_test
+cp ${PWD}/bin/public_suffix_server.py ${PWD}/bin/public_suffix_lookup.py ${PWD}/bin/pattern_manifest.py ${PWD}/bin/conf_util.py ${PWD}/bin/pattern_codec.py ${PWD}/bin/pattern_delta.py ${PWD}/bin/aws_s3_util.py /tmp/public_suffix_server_test
+cp ${PWD}/test/unittest/unittest_public_suffix_server.py /tmp/public_suffix_server_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/public_suffix_server_unit_result.xml --cover-erase --with-coverage --cover-package=public_suffix_server -w /tmp/public_suffix_server_test/ unittest_public_suffix_server.py
+coverage xml -o /tmp/agent/report/public_suffix_server_coverage.xml /tmp/public_suffix_server_test/public_suffix_server.py
@@ -0,0 +1,8 @@
+#!/bin/sh
+
+mkdir -p /tmp/run_metrics_test
+cp ${PWD}/bin/run_metrics.py /tmp/run_metrics_test
+cp ${PWD}/test/unittest/unittest_run_metrics.py /tmp/run_metrics_test
+mkdir -p /tmp/agent/report
+nosetests -v -s -x --with-xunit --xunit-file=/tmp/agent/report/run_metrics_unit_result.xml --cover-erase --with-coverage --cover-package=run_metrics -w /tmp/run_metrics_test/ unittest_run_metrics.py
+coverage xml -o /tmp/agent/report/run_metrics_coverage.xml /tmp/run_metrics_test/run_metrics.py
@@ -1,27 +1,198 @@
 #!/bin/env python2.6
 import unittest
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import tempfile
 import agent1
-import time
+import aws_s3_util
+import pattern_codec
+import pattern_delta
+import public_suffix_lookup
 
-class UnitTestParallel(unittest.TestCase):
+PATTERN = 'com\t0\t-1\nco.uk\t1\t5\n'
+NEW_PATTERN = PATTERN + 'example.com\t2\t3\n'
+# a pattern which is larger than its deltas
+LARGE_PATTERN = ''.join(['d%d.com\t0\t-1\n' % i for i in range(2000)])
+PREFIX = 'wrs_common_data/public_suffix'
+MANIFEST_KEY = PREFIX + '/public_suffix.manifest.json'
+
+class FakeS3Client(object):
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def get_s3_file_content_if_modified(self, bucket_name, dst_key, etag = None, kwargs = {}):
+        self.calls.append('get_manifest')
+        content = self.objects[dst_key]
+        new_etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if etag == new_etag:
+            raise aws_s3_util.AWS_S3NotModifiedError('304')
+        return (content, new_etag)
+
+    def get_s3_file_content(self, bucket_name, dst_key, kwargs = {}):
+        self.calls.append('get_delta')
+        return self.objects[dst_key]
+
+    def cp_s3_file_to_local(self, bucket_name, src_path, dst_key, kwargs = {}):
+        self.calls.append('download')
+        f = open(src_path, 'wb')
+        f.write(self.objects[dst_key])
+        f.close()
+
+class UnitTestPatternSyncAgent(unittest.TestCase):
     def setUp(self):
-        time.sleep(3)
-        pass
+        self.tmp_dir = tempfile.mkdtemp()
+        self.s3_client = FakeS3Client()
+        self.notified = []
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.notified.append(signum))
+        self.pid_file = os.path.join(self.tmp_dir, 'server.pid')
+        f = open(self.pid_file, 'w')
+        f.write('%d\n' % os.getpid())
+        f.close()
+        self.agent = self.new_agent()
 
     def tearDown(self):
-        pass
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        shutil.rmtree(self.tmp_dir)
+
+    def new_agent(self):
+        agent = agent1.pattern_sync_agent.__new__(agent1.pattern_sync_agent)
+        agent.config = {'aws_s3_bucket': 'bucket', 'aws_s3_prefix': PREFIX, 'ptn_dir': self.tmp_dir, 'sync_interval': 300,
+                        'notify_pid_files': [self.pid_file, os.path.join(self.tmp_dir, 'missing.pid')], 'notify_signal': 'SIGUSR1'}
+        agent.logger = logging.getLogger('unittest_agent1')
+        agent.prepare_env()
+        agent.state = agent.read_sync_state()
+        agent.s3_client = self.s3_client
+        return agent
+
+    def publish(self, version, content, md5 = None, delta_from = None, delta_md5 = None, codec = None):
+        # delta_from is (version, content) of the previous version, whose delta is published with the version
+        # a version without codec is published like a version before codecs existed
+        key = '%s/public_suffix.txt.%s%s' % (PREFIX, version, pattern_codec.get_extension(codec or 'gzip'))
+        self.s3_client.objects[key] = pattern_codec.compress(content, codec or 'gzip')
+        entry = {'version': version, 'key': key, 'md5': md5 or hashlib.md5(content).hexdigest(), 'size': len(self.s3_client.objects[key]), 'timestamp': None}
+        if codec is not None:
+            entry['codec'] = codec
+        versions = []
+        if delta_from is not None:
+            versions = json.loads(self.s3_client.objects[MANIFEST_KEY])['versions']
+            old_rules = list(public_suffix_lookup.iter_pattern_rules(delta_from[1].splitlines(True)))
+            rules = list(public_suffix_lookup.iter_pattern_rules(content.splitlines(True)))
+            delta_key = pattern_delta.get_delta_key(PREFIX, delta_from[0], version)
+            self.s3_client.objects[delta_key] = pattern_delta.dumps(pattern_delta.compute_delta(old_rules, rules, delta_from[0], version))
+            entry['delta'] = {'from': delta_from[0], 'key': delta_key, 'size': len(self.s3_client.objects[delta_key]),
+                              'md5': delta_md5 or pattern_delta.get_rules_md5(pattern_delta.get_rule_records(rules))}
+        versions.append(entry)
+        self.s3_client.objects[MANIFEST_KEY] = json.dumps({'latest': version, 'versions': versions})
+
+    def read_installed(self):
+        f = pattern_codec.open_read(self.agent.get_installed_path())
+        content = f.read()
+        f.close()
+        return content
+
+    def test_sync(self):
+        self.publish('201512090100', PATTERN)
+        self.assertEqual(self.agent.sync(), True)
+        self.assertEqual(self.read_installed(), PATTERN)
+        self.assertEqual(self.notified, [signal.SIGUSR1])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['public_suffix.sync.json', 'public_suffix.txt.gz', 'server.pid'])
+
+    def test_sync_not_modified(self):
+        self.publish('201512090100', PATTERN)
+        self.agent.sync()
+        self.assertEqual(self.agent.sync(), False)
+        self.assertEqual(self.s3_client.calls, ['get_manifest', 'download', 'get_manifest'])
+        self.assertEqual(len(self.notified), 1)
+
+    def test_sync_new_version(self):
+        self.publish('201512090100', PATTERN)
+        self.agent.sync()
+        self.publish('201512090200', NEW_PATTERN)
+        self.assertEqual(self.agent.sync(), True)
+        self.assertEqual(self.read_installed(), NEW_PATTERN)
+        self.assertEqual(len(self.notified), 2)
+
+    def test_sync_state_after_restart(self):
+        self.publish('201512090100', PATTERN)
+        self.agent.sync()
+        agent = self.new_agent()
+        self.assertEqual(agent.state['version'], '201512090100')
+        self.assertEqual(agent.sync(), False)
+        self.assertEqual(self.s3_client.calls.count('download'), 1)
+
+    def test_sync_verify_failure(self):
+        self.publish('201512090100', PATTERN)
+        self.agent.sync()
+        self.publish('201512090200', NEW_PATTERN, md5 = '0' * 32)
+        self.assertRaises(agent1.PatternSyncVerifyError, self.agent.sync)
+        self.assertEqual(self.read_installed(), PATTERN)
+        self.assertEqual(self.agent.state['version'], '201512090100')
+        self.assertEqual(len(self.notified), 1)
+        # the manifest is read again by the next sync
+        self.assertRaises(agent1.PatternSyncVerifyError, self.agent.sync)
+        self.assertEqual(self.s3_client.calls.count('download'), 3)
+
+    def test_sync_delta(self):
+        self.publish('201512090100', LARGE_PATTERN)
+        self.agent.sync()
+        self.publish('201512090200', LARGE_PATTERN + NEW_PATTERN, delta_from = ('201512090100', LARGE_PATTERN))
+        self.publish('201512090300', NEW_PATTERN + LARGE_PATTERN[100:], delta_from = ('201512090200', LARGE_PATTERN + NEW_PATTERN))
+        self.assertEqual(self.agent.sync(), True)
+        self.assertEqual(self.s3_client.calls, ['get_manifest', 'download', 'get_manifest', 'get_delta', 'get_delta'])
+        self.assertEqual(pattern_delta.read_pattern_rules(self.agent.get_installed_path()),
+                         pattern_delta.get_rule_records(public_suffix_lookup.iter_pattern_rules((NEW_PATTERN + LARGE_PATTERN[100:]).splitlines(True))))
+        self.assertEqual(self.agent.state['version'], '201512090300')
+        self.assertEqual(len(self.notified), 2)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['public_suffix.sync.json', 'public_suffix.txt.gz', 'server.pid'])
 
-    def test_return_a(self):
-        self.assertEqual(agent1.return_a(), 'a')
+    def test_sync_delta_fallback(self):
+        self.publish('201512090100', LARGE_PATTERN)
+        self.agent.sync()
+        # the patched rules are not verified, the full pattern is downloaded
+        self.publish('201512090200', LARGE_PATTERN + NEW_PATTERN, delta_from = ('201512090100', LARGE_PATTERN), delta_md5 = '0' * 32)
+        self.assertEqual(self.agent.sync(), True)
+        self.assertEqual(self.s3_client.calls, ['get_manifest', 'download', 'get_manifest', 'get_delta', 'download'])
+        self.assertEqual(self.read_installed(), LARGE_PATTERN + NEW_PATTERN)
+        # a version without a delta is downloaded
+        self.publish('201512090300', PATTERN)
+        self.assertEqual(self.agent.sync(), True)
+        self.assertEqual(self.read_installed(), PATTERN)
+        self.assertEqual(self.s3_client.calls.count('download'), 3)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['public_suffix.sync.json', 'public_suffix.txt.gz', 'server.pid'])
 
-    def test_return_b(self):
-        self.assertEqual(agent1.return_b(), 'b')
- 
-    def test_return_c(self):
-        self.assertEqual(agent1.return_c(), 'c')
+    def test_sync_codec(self):
+        self.publish('201512090100', PATTERN)
+        self.agent.sync()
+        self.publish('201512090200', NEW_PATTERN, codec = 'bz2')
+        self.assertEqual(self.agent.sync(), True)
+        # the pattern is named by its codec, the pattern of the previous codec is removed
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['public_suffix.sync.json', 'public_suffix.txt.bz2', 'server.pid'])
+        self.assertEqual(pattern_codec.detect_file(os.path.join(self.tmp_dir, 'public_suffix.txt.bz2')), 'bz2')
+        self.assertEqual(self.read_installed(), NEW_PATTERN)
+        agent = self.new_agent()
+        self.assertEqual((agent.state['version'], agent.state['codec']), ('201512090200', 'bz2'))
+        self.assertEqual(agent.sync(), False)
+        # a patched pattern is written with the codec of its version
+        self.publish('201512090300', LARGE_PATTERN, codec = 'none')
+        self.assertEqual(agent.sync(), True)
+        self.publish('201512090400', LARGE_PATTERN + PATTERN, delta_from = ('201512090300', LARGE_PATTERN), codec = 'gzip')
+        self.assertEqual(agent.sync(), True)
+        self.assertEqual(self.s3_client.calls.count('get_delta'), 1)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['public_suffix.sync.json', 'public_suffix.txt.gz', 'server.pid'])
+        self.assertEqual(pattern_codec.detect_file(os.path.join(self.tmp_dir, 'public_suffix.txt.gz')), 'gzip')
 
-    def test_return_d(self):
-        self.assertEqual(agent1.return_d(), 'd')
+    def test_sync_unavailable_codec(self):
+        self.publish('201512090100', PATTERN)
+        manifest = json.loads(self.s3_client.objects[MANIFEST_KEY])
+        manifest['versions'][0]['codec'] = 'zip'
+        self.s3_client.objects[MANIFEST_KEY] = json.dumps(manifest)
+        self.assertRaises(agent1.PatternSyncError, self.agent.sync)
+        self.assertEqual(self.s3_client.calls, ['get_manifest'])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,220 @@
+#!/bin/env python2.6
+import unittest
+import os
+import tempfile
+import shutil
+import aws_s3_util
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.data) - self.pos
+        chunk = self.data[self.pos:self.pos + amt]
+        self.pos += len(chunk)
+        return chunk
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.response = {'Error': {'Code': code}}
+
+class FakeS3Conn(object):
+    # in-memory stand-in of the boto3 S3 client calls used by S3Handler
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.retry_attempts = 0
+
+    def resp(self, status, **kwargs):
+        kwargs['ResponseMetadata'] = {'HTTPStatusCode': status, 'RetryAttempts': self.retry_attempts}
+        return kwargs
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append('put_object')
+        if isinstance(Body, str):
+            self.objects[(Bucket, Key)] = Body
+        else:
+            self.objects[(Bucket, Key)] = Body.read()
+        return self.resp(200)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append('create_multipart_upload')
+        upload_id = 'upload-%d' % len(self.uploads)
+        self.uploads[upload_id] = {}
+        return self.resp(200, UploadId = upload_id)
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = Body
+        return self.resp(200, ETag = '"etag-%d"' % PartNumber)
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        self.objects[(Bucket, Key)] = ''.join([parts[number] for number in numbers])
+        return self.resp(200)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        self.uploads.pop(UploadId, None)
+        return self.resp(204)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls.append('head_object')
+        return self.resp(200, ContentLength = len(self.objects[(Bucket, Key)]), Metadata = {})
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        self.calls.append('get_object')
+        data = self.objects[(Bucket, Key)]
+        etag = '"%d"' % len(data)
+        if IfNoneMatch == etag:
+            raise FakeClientError('304')
+        if Range is None:
+            return self.resp(200, Body = FakeBody(data), ETag = etag)
+        (start, end) = Range[len('bytes='):].split('-')
+        return self.resp(206, Body = FakeBody(data[int(start):int(end) + 1]))
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append('delete_objects')
+        errors = []
+        for item in Delete['Objects']:
+            if self.objects.pop((Bucket, item['Key']), None) is None:
+                errors.append({'Key': item['Key'], 'Code': 'NoSuchKey'})
+        return self.resp(200, Errors = errors)
+
+    def list_objects(self, Bucket, Prefix = '', Marker = '', MaxKeys = 1000, **kwargs):
+        # like S3 without a Delimiter, a truncated page has no NextMarker
+        self.calls.append('list_objects')
+        keys = sorted([key for (bucket, key) in self.objects if bucket == Bucket and key.startswith(Prefix) and key > Marker])
+        if not keys:
+            return self.resp(200, IsTruncated = False)
+        return self.resp(200, IsTruncated = len(keys) > MaxKeys, Contents = [{'Key': key} for key in keys[:MaxKeys]])
+
+def new_handler(conn, **kwargs):
+    handler = aws_s3_util.S3Handler.__new__(aws_s3_util.S3Handler)
+    handler.multipart_threshold = kwargs.get('multipart_threshold', aws_s3_util.DEFAULT_MULTIPART_THRESHOLD)
+    handler.multipart_chunksize = kwargs.get('multipart_chunksize', aws_s3_util.DEFAULT_MULTIPART_CHUNKSIZE)
+    handler.max_concurrency = kwargs.get('max_concurrency', aws_s3_util.DEFAULT_MAX_CONCURRENCY)
+    handler.stats = aws_s3_util.S3RequestStats()
+    handler.conn = conn
+    return handler
+
+class UnitTestS3Handler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_path = os.path.join(self.tmp_dir, 'src')
+        self.dst_path = os.path.join(self.tmp_dir, 'dst')
+        self.conn = FakeS3Conn()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_src(self, size):
+        data = os.urandom(size)
+        f = open(self.src_path, 'wb')
+        f.write(data)
+        f.close()
+        return data
+
+    def read_dst(self):
+        f = open(self.dst_path, 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+    def test_split_parts(self):
+        self.assertEqual(aws_s3_util.split_parts(10, 4), [(1, 0, 4), (2, 4, 4), (3, 8, 2)])
+        self.assertEqual(aws_s3_util.split_parts(0, 4), [])
+
+    def test_run_in_threads(self):
+        self.assertEqual(aws_s3_util.run_in_threads(lambda a, b: a * b, [(i, 2) for i in range(20)], 3), [i * 2 for i in range(20)])
+
+    def test_single_put_and_get(self):
+        data = self.write_src(1000)
+        s3 = new_handler(self.conn)
+        s3.cp_local_file_to_s3('bucket', self.src_path, 'key')
+        s3.cp_s3_file_to_local('bucket', self.dst_path, 'key')
+        self.assertEqual(self.read_dst(), data)
+        self.assertEqual(self.conn.calls, ['put_object', 'head_object', 'get_object'])
+
+    def test_multipart_put_and_ranged_get(self):
+        chunksize = aws_s3_util.MULTIPART_MIN_CHUNKSIZE
+        data = self.write_src(chunksize * 2 + 123)
+        s3 = new_handler(self.conn, multipart_threshold = chunksize, multipart_chunksize = chunksize, max_concurrency = 2)
+        s3.cp_local_file_to_s3('bucket', self.src_path, 'key')
+        self.assertEqual(self.conn.calls.count('upload_part'), 3)
+        self.assertEqual(self.conn.objects[('bucket', 'key')], data)
+        s3.cp_s3_file_to_local('bucket', self.dst_path, 'key')
+        self.assertEqual(self.conn.calls.count('get_object'), 3)
+        self.assertEqual(self.read_dst(), data)
+        self.assertFalse(os.path.exists('%s.tmp' % self.dst_path))
+
+    def test_multipart_abort(self):
+        chunksize = aws_s3_util.MULTIPART_MIN_CHUNKSIZE
+        self.write_src(chunksize + 1)
+        def fail_upload_part(**kwargs):
+            raise Exception('upload part fail')
+        self.conn.upload_part = fail_upload_part
+        s3 = new_handler(self.conn, multipart_threshold = chunksize, multipart_chunksize = chunksize)
+        self.assertRaises(aws_s3_util.AWS_S3COPYError, s3.cp_local_file_to_s3, 'bucket', self.src_path, 'key')
+        self.assertTrue('abort_multipart_upload' in self.conn.calls)
+        self.assertEqual(self.conn.uploads, {})
+
+    def test_del_s3_files(self):
+        keys = ['key%d' % i for i in range(2500)]
+        for key in keys:
+            self.conn.objects[('bucket', key)] = ''
+        s3 = new_handler(self.conn)
+        self.assertEqual(s3.del_s3_files('bucket', keys), 2500)
+        self.assertEqual(self.conn.calls, ['delete_objects'] * 3)
+        self.assertEqual(self.conn.objects, {})
+        self.assertRaises(aws_s3_util.AWS_S3DELETEError, s3.del_s3_files, 'bucket', ['missing'])
+
+    def test_list_bucket_content(self):
+        keys = ['prefix/key%04d' % i for i in range(2500)]
+        for key in keys + ['other']:
+            self.conn.objects[('bucket', key)] = ''
+        s3 = new_handler(self.conn)
+        self.assertEqual(s3.list_bucket_content('bucket', 'prefix/'), keys)
+        self.assertEqual(self.conn.calls, ['list_objects'] * 3)
+        self.assertEqual(s3.list_bucket_content('bucket', 'missing/'), [])
+
+    def test_get_s3_file_content_if_modified(self):
+        self.conn.objects[('bucket', 'key')] = 'content'
+        s3 = new_handler(self.conn)
+        (content, etag) = s3.get_s3_file_content_if_modified('bucket', 'key')
+        self.assertEqual(content, 'content')
+        self.assertRaises(aws_s3_util.AWS_S3NotModifiedError, s3.get_s3_file_content_if_modified, 'bucket', 'key', etag)
+        self.conn.objects[('bucket', 'key')] = 'new content'
+        self.assertEqual(s3.get_s3_file_content_if_modified('bucket', 'key', etag)[0], 'new content')
+
+    def test_request_stats(self):
+        self.conn.objects[('bucket', 'key')] = 'content'
+        s3 = new_handler(self.conn)
+        self.conn.retry_attempts = 2
+        s3.put_s3_file_content('bucket', 'key', 'new content')
+        self.conn.retry_attempts = 0
+        (content, etag) = s3.get_s3_file_content_if_modified('bucket', 'key')
+        # not modified and not found are answers, a failed request is an error
+        self.assertRaises(aws_s3_util.AWS_S3NotModifiedError, s3.get_s3_file_content_if_modified, 'bucket', 'key', etag)
+        self.assertRaises(aws_s3_util.AWS_S3COPYError, s3.get_s3_file_content, 'bucket', 'missing')
+        stats = s3.stats.get()
+        self.assertEqual(sorted(stats.keys()), ['get_object', 'put_object'])
+        self.assertEqual((stats['put_object']['requests'], stats['put_object']['errors'], stats['put_object']['retries']), (1, 0, 2))
+        self.assertEqual((stats['get_object']['requests'], stats['get_object']['errors'], stats['get_object']['retries']), (3, 1, 0))
+        self.assertTrue(stats['get_object']['max_seconds'] <= stats['get_object']['seconds'])
+        total = aws_s3_util.merge_request_stats({}, stats)
+        aws_s3_util.merge_request_stats(total, stats)
+        self.assertEqual(total['get_object']['requests'], 6)
+        self.assertEqual(total['put_object']['retries'], 4)
+        s3.stats.reset()
+        self.assertEqual(s3.stats.get(), {})
+
+if __name__ == '__main__':
+    unittest.main()
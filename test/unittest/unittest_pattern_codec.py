@@ -0,0 +1,67 @@
+#!/bin/env python2.6
+import unittest
+import os
+import tempfile
+import shutil
+import pattern_codec
+
+CONTENT = '// public suffix\ncom\t0\t-1\n*.kawasaki.jp\t0\t-1\n!city.kawasaki.jp\t0\t-1\n' * 100
+
+def available_codecs():
+    return [codec for codec in pattern_codec.CODECS if pattern_codec.is_available(codec)]
+
+class UnitTestPatternCodec(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compress_decompress(self):
+        for codec in available_codecs():
+            data = pattern_codec.compress(CONTENT, codec)
+            self.assertEqual(pattern_codec.detect(data), codec)
+            self.assertEqual(pattern_codec.decompress(data), CONTENT)
+            if codec != 'none':
+                self.assertTrue(len(data) < len(CONTENT))
+
+    def test_write_read(self):
+        for codec in available_codecs():
+            path = os.path.join(self.tmp_dir, 'public_suffix.txt' + pattern_codec.get_extension(codec))
+            f = pattern_codec.open_write(path, codec, pattern_codec.LEVELS[codec][0])
+            f.write(CONTENT)
+            f.close()
+            self.assertEqual(pattern_codec.detect_file(path), codec)
+            # a pattern is read by its content whatever it is named
+            os.rename(path, os.path.join(self.tmp_dir, 'public_suffix.txt.gz'))
+            f = pattern_codec.open_read(os.path.join(self.tmp_dir, 'public_suffix.txt.gz'))
+            try:
+                self.assertEqual(f.readlines(), CONTENT.splitlines(True))
+            finally:
+                f.close()
+
+    def test_levels(self):
+        self.assertEqual(pattern_codec.get_level('gzip'), 9)
+        self.assertEqual(pattern_codec.get_level('lzma'), 6)
+        self.assertEqual(pattern_codec.get_level('bz2', 1), 1)
+        self.assertEqual(pattern_codec.get_level('none'), 0)
+        for (codec, level) in [('gzip', 0), ('gzip', 10), ('bz2', '9'), ('lzma', -1), ('none', 1), ('zip', None)]:
+            self.assertRaises(pattern_codec.PatternCodecError, pattern_codec.get_level, codec, level)
+        self.assertRaises(pattern_codec.PatternCodecError, pattern_codec.get_extension, 'zip')
+        # a higher level is not larger on repetitive content
+        self.assertTrue(len(pattern_codec.compress(CONTENT, 'gzip', 9)) <= len(pattern_codec.compress(CONTENT, 'gzip', 1)))
+
+    def test_detect(self):
+        self.assertEqual(pattern_codec.detect(''), 'none')
+        self.assertEqual(pattern_codec.detect('com\t0\t-1\n'), 'none')
+        self.assertEqual(pattern_codec.detect('\xfd7zXZ\x00\x00'), 'lzma')
+        self.assertEqual(pattern_codec.get_extension('lzma'), '.xz')
+
+    def test_lzma_unavailable(self):
+        if pattern_codec.is_available('lzma'):
+            return
+        self.assertRaises(pattern_codec.PatternCodecError, pattern_codec.compress, CONTENT, 'lzma')
+        self.assertFalse(pattern_codec.is_available('zip'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/bin/env python2.6
+import unittest
+import os
+import shutil
+import tempfile
+import pattern_codec
+import pattern_delta
+import pattern_manifest
+import public_suffix_lookup
+
+OLD_RULES = [('com', 0, -1), ('uk', 0, -1), ('co.uk', 0, -1), ('ck', 0, -1), ('*.ck', 0, -1), ('!www.ck', 0, -1), ('old.com', 0, -1)]
+NEW_RULES = [('com', 0, -1), ('uk', 0, -1), ('co.uk', 1, 5), ('ck', 0, -1), ('*.ck', 0, -1), ('new.com', 0, -1), ('a.b.new.com', 2, -1)]
+
+class UnitTestPatternDelta(unittest.TestCase):
+    def setUp(self):
+        self.delta = pattern_delta.compute_delta(OLD_RULES, NEW_RULES, '201512090100', '201512090200')
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def new_patch_manifest(self):
+        # versions 1, 2 and 3 of OLD_RULES, OLD_RULES without the last rule and NEW_RULES, with the deltas of 2 and 3
+        middle_rules = OLD_RULES[:-1]
+        self.contents = {'p/public_suffix.delta.1.2.json': pattern_delta.dumps(pattern_delta.compute_delta(OLD_RULES, middle_rules, '1', '2')),
+                         'p/public_suffix.delta.2.3.json': pattern_delta.dumps(pattern_delta.compute_delta(middle_rules, NEW_RULES, '2', '3'))}
+        manifest = pattern_manifest.new_manifest()
+        pattern_manifest.add_version(manifest, '1', 'p/public_suffix.txt.1.gz')
+        for (version, rules) in [('2', middle_rules), ('3', NEW_RULES)]:
+            key = 'p/public_suffix.delta.%s.%s.json' %(int(version) - 1, version)
+            delta = {'from': str(int(version) - 1), 'key': key, 'size': len(self.contents[key]),
+                     'md5': pattern_delta.get_rules_md5(pattern_delta.get_rule_records(rules))}
+            pattern_manifest.add_version(manifest, version, 'p/public_suffix.txt.%s.gz' % version, size = 10000, delta = delta)
+        base_path = os.path.join(self.tmp_dir, 'base.gz')
+        f = pattern_codec.open_write(base_path, 'gzip', 9)
+        f.write('// comments are not rules\n' + ''.join(['%s\t%d\t%d\n' % record for record in OLD_RULES]))
+        f.close()
+        return (manifest, base_path)
+
+    def new_table(self, rules):
+        table = public_suffix_lookup.PublicSuffixTable()
+        for (rule, flag, threshold) in rules:
+            table.add_rule(rule, flag, threshold)
+        return table
+
+    def test_compute_delta(self):
+        self.assertEqual(self.delta['added'], [['a.b.new.com', 2, -1], ['new.com', 0, -1]])
+        self.assertEqual(self.delta['removed'], ['!www.ck', 'old.com'])
+        self.assertEqual(self.delta['changed'], [['co.uk', 1, 5]])
+        self.assertEqual(pattern_delta.is_empty(pattern_delta.compute_delta(OLD_RULES, OLD_RULES, '1', '2')), True)
+
+    def test_dumps_loads(self):
+        self.assertEqual(pattern_delta.loads(pattern_delta.dumps(self.delta)), self.delta)
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.loads, '{"format": 1}')
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.loads, 'not json')
+
+    def test_apply_delta(self):
+        table = self.new_table(OLD_RULES)
+        expected = self.new_table(NEW_RULES)
+        self.assertEqual(pattern_delta.apply_delta(table, self.delta, '201512090100'), '201512090200')
+        self.assertEqual(table.root, expected.root)
+        self.assertEqual(table.rule_count, expected.rule_count)
+        for hostname in ['www.ck', 'x.old.com', 'a.co.uk', 'x.a.b.new.com']:
+            self.assertEqual(table.lookup(hostname), expected.lookup(hostname))
+
+    def test_apply_delta_version_mismatch(self):
+        table = self.new_table(OLD_RULES)
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.apply_delta, table, self.delta, '201512080100')
+        table = self.new_table(NEW_RULES)
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.apply_delta, table, self.delta)
+
+    def test_delta_chain(self):
+        manifest = pattern_manifest.new_manifest()
+        pattern_manifest.add_version(manifest, '1', 'p/public_suffix.txt.1.gz')
+        pattern_manifest.add_version(manifest, '2', 'p/public_suffix.txt.2.gz', delta = {'from': '1', 'key': 'p/public_suffix.delta.1.2.json', 'size': 10})
+        pattern_manifest.add_version(manifest, '3', 'p/public_suffix.txt.3.gz', delta = {'from': '2', 'key': 'p/public_suffix.delta.2.3.json', 'size': 10})
+        self.assertEqual([entry['version'] for entry in pattern_delta.get_delta_chain(manifest, '1')], ['2', '3'])
+        self.assertEqual([entry['version'] for entry in pattern_delta.get_delta_chain(manifest, '2', '3')], ['3'])
+        self.assertEqual(pattern_delta.get_delta_chain(manifest, '3'), [])
+        self.assertEqual(pattern_delta.get_delta_chain(manifest, '0'), None)
+
+    def test_apply_delta_chain(self):
+        middle_rules = OLD_RULES[:-1]
+        deltas = [pattern_delta.compute_delta(OLD_RULES, middle_rules, '1', '2'), pattern_delta.compute_delta(middle_rules, NEW_RULES, '2', '3')]
+        table = self.new_table(OLD_RULES)
+        self.assertEqual(pattern_delta.apply_delta_chain(table, deltas, '1'), '3')
+        self.assertEqual(table.root, self.new_table(NEW_RULES).root)
+
+    def test_patch_pattern(self):
+        (manifest, base_path) = self.new_patch_manifest()
+        path = os.path.join(self.tmp_dir, 'patched')
+        entry = pattern_delta.patch_pattern(base_path, path, manifest, '1', self.contents.get, codec = 'none')
+        self.assertEqual(entry['version'], '3')
+        self.assertEqual(pattern_delta.read_pattern_rules(path), pattern_delta.get_rule_records(NEW_RULES))
+        self.assertEqual(pattern_codec.detect_file(path), 'none')
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['base.gz', 'patched'])
+
+    def test_patch_pattern_failure(self):
+        (manifest, base_path) = self.new_patch_manifest()
+        path = os.path.join(self.tmp_dir, 'patched')
+        # no chain from an unknown version
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.patch_pattern, base_path, path, manifest, '0', self.contents.get)
+        # the base is not the rules of version 2, so the removed rule is not in it
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.patch_pattern, base_path, path, manifest, '2', self.contents.get)
+        # the patched rules are not the rules of the manifest
+        pattern_manifest.get_version(manifest, '3')['delta']['md5'] = '0' * 32
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.patch_pattern, base_path, path, manifest, '1', self.contents.get)
+        # the deltas are larger than the pattern
+        pattern_manifest.get_version(manifest, '3')['size'] = 10
+        self.assertRaises(pattern_delta.PatternDeltaError, pattern_delta.patch_pattern, base_path, path, manifest, '1', self.contents.get)
+        self.assertEqual(os.listdir(self.tmp_dir), ['base.gz'])
+
+if __name__ == '__main__':
+    unittest.main()
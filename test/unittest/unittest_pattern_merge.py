@@ -0,0 +1,92 @@
+#!/bin/env python2.6
+import unittest
+import public_suffix_lookup
+import pattern_merge
+
+RULES = [
+    ('com', 0, -1),
+    ('uk', 0, -1),
+    ('co.uk', 1, 5),
+    ('ck', 0, -1),
+    ('*.ck', 0, -1),
+    ('!www.ck', 0, -1),
+    ('a.www.ck', 0, -1),
+    ('*.www.ck', 0, -1),
+    ('foo.ck', 0, -1),
+    ('bar.ck', 3, -1),
+    ('!city.kobe.jp', 0, -1),
+    ('jp', 0, -1),
+    ('kobe.jp', 0, -1),
+    ('com', 0, -1),
+    ('uk', 2, 1),
+]
+
+HOSTNAMES = ['www.example.com', 'a.b.co.uk', 'x.uk', 'www.ck', 'a.www.ck', 'b.a.www.ck', 'foo.ck', 'x.foo.ck', 'x.bar.ck',
+             'x.city.kobe.jp', 'a.kobe.jp', 'example.test']
+
+def reasons(removed):
+    return sorted([(record[0], reason) for (record, reason, cause) in removed])
+
+class UnitTestPatternMerge(unittest.TestCase):
+    def test_merge_rules(self):
+        (rules, removed) = pattern_merge.merge_rules(RULES)
+        self.assertEqual(reasons(removed), [('!city.kobe.jp', 'orphan_exception'), ('*.www.ck', 'shadowed'), ('a.www.ck', 'shadowed'),
+                                            ('com', 'duplicate'), ('foo.ck', 'redundant'), ('uk', 'duplicate')])
+        # the last record of a duplicated rule is kept
+        self.assertTrue(('uk', 2, 1) in rules)
+        # a normal rule with another record than its wildcard changes the lookup
+        self.assertTrue(('bar.ck', 3, -1) in rules)
+        self.assertEqual([cause for (record, reason, cause) in removed if record[0] == 'a.www.ck'], ['!www.ck'])
+
+    def test_same_lookup(self):
+        # the removed rules never change a lookup
+        self.assertSameLookup(RULES, HOSTNAMES)
+
+    def assertSameLookup(self, records, hostnames):
+        (rules, removed) = pattern_merge.merge_rules(records)
+        original = public_suffix_lookup.PublicSuffixTable().load(['%s\t%d\t%d' % record for record in records])
+        merged = public_suffix_lookup.PublicSuffixTable().load(['%s\t%d\t%d' % record for record in rules])
+        for hostname in hostnames:
+            self.assertEqual(merged.lookup(hostname), original.lookup(hostname))
+        return (rules, removed)
+
+    def test_exceptions(self):
+        # an exception stops the walk, it is only removed if the rules above it give the same result
+        hostnames = ['b', 'a.b', 'x.a.b', 'foo.x.a.b', 'y.b', 'kobe.jp', 'city.kobe.jp', 'x.city.kobe.jp', 'www.example.test', 'x.www.example.test']
+        for (records, orphans) in [([('!a.b', 0, -1), ('x.a.b', 0, -1)], []),
+                                   ([('!a.b', 0, -1), ('*.a.b', 0, -1)], []),
+                                   ([('!a.b', 0, -1), ('!x.a.b', 0, -1)], []),
+                                   ([('!a.b', 0, -1)], ['!a.b']),
+                                   ([('!a.b', 1, -1)], []),
+                                   ([('!city.kobe.jp', 0, -1), ('jp', 0, -1)], []),
+                                   ([('!city.kobe.jp', 0, -1), ('*.jp', 0, -1)], ['!city.kobe.jp']),
+                                   ([('!www.example.test', 0, -1), ('example.test', 0, -1)], ['!www.example.test']),
+                                   ([('!www.example.test', 0, 5), ('example.test', 0, -1)], [])]:
+            (rules, removed) = self.assertSameLookup(records, hostnames)
+            self.assertEqual([record[0] for (record, reason, cause) in removed if reason == 'orphan_exception'], orphans)
+        (rules, removed) = pattern_merge.merge_rules([('!a.b', 0, -1), ('x.a.b', 0, -1)])
+        self.assertEqual((rules, reasons(removed)), ([('!a.b', 0, -1)], [('x.a.b', 'shadowed')]))
+
+    def test_canonical_order(self):
+        (rules, removed) = pattern_merge.merge_rules(RULES)
+        (reversed_rules, removed) = pattern_merge.merge_rules(list(reversed(rules)))
+        self.assertEqual(reversed_rules, rules)
+        self.assertEqual([record[0] for record in rules], ['ck', '*.ck', 'bar.ck', '!www.ck', 'com', 'jp', 'kobe.jp', 'uk', 'co.uk'])
+        self.assertEqual(pattern_merge.sort_rules([('!www.ck', 0, -1), ('co.uk', 0, -1), ('*.ck', 0, -1), ('ck', 0, -1)]),
+                         [('ck', 0, -1), ('*.ck', 0, -1), ('!www.ck', 0, -1), ('co.uk', 0, -1)])
+
+    def test_base_index(self):
+        base = pattern_merge.RuleIndex()
+        for record in pattern_merge.merge_rules(RULES)[0]:
+            base.add(record)
+        base.add(('a.x.kobe.jp', 0, -1))
+        (rules, removed) = pattern_merge.merge_rules([('com', 0, -1), ('com', 1, 1), ('x.ck', 0, -1), ('b.www.ck', 0, -1), ('!y.ck', 0, -1), ('tenant.test', 0, -1),
+                                                      ('!x.kobe.jp', 0, -1), ('!y.kobe.jp', 0, -1)], base)
+        # a rule of the base with another record overwrites it, the others are left out
+        self.assertEqual(rules, [('!y.ck', 0, -1), ('com', 1, 1), ('!x.kobe.jp', 0, -1), ('tenant.test', 0, -1)])
+        # a rule of the base below an exception keeps it
+        self.assertEqual(reasons(removed), [('!y.kobe.jp', 'orphan_exception'), ('b.www.ck', 'shadowed'), ('com', 'duplicate'), ('x.ck', 'redundant')])
+        self.assertEqual(pattern_merge.count_removed(removed), {'duplicate': 1, 'orphan_exception': 1, 'shadowed': 1, 'redundant': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/bin/env python2.6
+import unittest
+import os
+import tempfile
+import shutil
+import aws_s3_util
+import pattern_storage
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, amt=None):
+        (data, self.data) = (self.data, '')
+        return data
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.response = {'Error': {'Code': code}}
+
+class FakeS3Conn(object):
+    # in-memory stand-in of the boto3 S3 client calls used by S3Storage
+    def __init__(self):
+        self.objects = {}
+
+    def resp(self, status, **kwargs):
+        kwargs['ResponseMetadata'] = {'HTTPStatusCode': status}
+        return kwargs
+
+    def put_object(self, Bucket, Key, Body, Metadata = None, ContentType = None, **kwargs):
+        if not isinstance(Body, str):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = (Body, Metadata or {}, ContentType)
+        return self.resp(200)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('NoSuchKey')
+        return self.resp(200, Body = FakeBody(self.objects[(Bucket, Key)][0]))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('404')
+        (data, metadata, content_type) = self.objects[(Bucket, Key)]
+        return self.resp(200, ContentLength = len(data), Metadata = metadata, ContentType = content_type, ETag = '"etag"')
+
+    def list_objects(self, Bucket, Prefix = '', **kwargs):
+        keys = [key for (bucket, key) in self.objects if bucket == Bucket and key.startswith(Prefix)]
+        return self.resp(200, Contents = [{'Key': key} for key in keys])
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            self.objects.pop((Bucket, item['Key']), None)
+        return self.resp(200, Errors = [])
+
+class StorageTestMixin(object):
+    # the same semantics are tested on every backend
+    def test_put_get_head(self):
+        self.storage.put('bucket', 'p/manifest.json', '{}', content_type = 'application/json')
+        self.storage.put('bucket', 'p/ptn.gz', 'pattern', metadata = {'ptn-md5': 'abc'})
+        self.assertEqual(self.storage.get('bucket', 'p/manifest.json'), '{}')
+        head = self.storage.head('bucket', 'p/ptn.gz')
+        self.assertEqual(head['size'], 7)
+        self.assertEqual(head['metadata'], {'ptn-md5': 'abc'})
+        self.assertTrue(head['etag'])
+        self.assertEqual(self.storage.head('bucket', 'p/manifest.json')['content_type'], 'application/json')
+        # put replaces the object
+        self.storage.put('bucket', 'p/ptn.gz', 'new pattern')
+        self.assertEqual(self.storage.get('bucket', 'p/ptn.gz'), 'new pattern')
+        self.assertEqual(self.storage.head('bucket', 'p/ptn.gz')['metadata'], {})
+
+    def test_not_found(self):
+        self.assertRaises(pattern_storage.StorageNotFoundError, self.storage.get, 'bucket', 'p/missing')
+        self.assertRaises(pattern_storage.StorageNotFoundError, self.storage.head, 'bucket', 'p/missing')
+        self.assertRaises(pattern_storage.StorageNotFoundError, self.storage.get_file, 'bucket', 'p/missing', os.path.join(self.tmp_dir, 'dst'))
+
+    def test_list_and_delete(self):
+        for key in ['p/b', 'p/a', 'p/sub/c', 'q/d']:
+            self.storage.put('bucket', key, key)
+        self.storage.put('other', 'p/e', 'e')
+        self.assertEqual(self.storage.list('bucket', prefix = 'p/'), ['p/a', 'p/b', 'p/sub/c'])
+        self.assertEqual(self.storage.list('bucket'), ['p/a', 'p/b', 'p/sub/c', 'q/d'])
+        # a missing key is not an error, like S3
+        self.assertEqual(self.storage.delete('bucket', ['p/a', 'p/sub/c', 'p/missing']), 3)
+        self.assertEqual(self.storage.list('bucket', prefix = 'p/'), ['p/b'])
+        self.assertEqual(self.storage.list('other'), ['p/e'])
+
+    def test_put_file_and_get_file(self):
+        src_path = os.path.join(self.tmp_dir, 'src')
+        dst_path = os.path.join(self.tmp_dir, 'dst')
+        data = os.urandom(200000)
+        f = open(src_path, 'wb')
+        f.write(data)
+        f.close()
+        self.storage.put_file('bucket', 'p/ptn.gz', src_path, metadata = {'ptn-md5': 'abc'})
+        self.storage.get_file('bucket', 'p/ptn.gz', dst_path)
+        self.assertEqual(open(dst_path, 'rb').read(), data)
+        self.assertEqual(self.storage.head('bucket', 'p/ptn.gz')['size'], len(data))
+
+    def test_stats(self):
+        self.storage.put('bucket', 'p/a', 'a')
+        self.storage.get('bucket', 'p/a')
+        stats = self.storage.stats.get()
+        self.assertEqual(sum([operation['requests'] for operation in stats.values()]), 2)
+        self.assertEqual(sum([operation['errors'] for operation in stats.values()]), 0)
+
+class UnitTestLocalStorage(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'storage')
+        os.mkdir(self.root)
+        self.storage = pattern_storage.LocalStorage(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_invalid_key(self):
+        for key in ['', '/etc/passwd', 'p/../../x', 'p//a', 'p/./a']:
+            self.assertRaises(pattern_storage.StorageError, self.storage.put, 'bucket', key, 'x')
+        self.assertRaises(pattern_storage.StorageError, self.storage.get, '.meta', 'x')
+        self.assertRaises(pattern_storage.StorageError, pattern_storage.LocalStorage, os.path.join(self.tmp_dir, 'missing'))
+
+    def test_no_internal_files(self):
+        # metadata and temporary files are kept out of the buckets
+        self.storage.put('bucket', 'p/a', 'a', metadata = {'k': 'v'})
+        self.assertEqual(sorted(os.listdir(self.root)), ['.meta', '.tmp', 'bucket'])
+        self.assertEqual(os.listdir(os.path.join(self.root, '.tmp')), [])
+        self.assertEqual(self.storage.list('bucket'), ['p/a'])
+
+class UnitTestS3Storage(StorageTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage = pattern_storage.S3Storage(aws_s3_util.S3Handler(conn = FakeS3Conn()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lazy_client(self):
+        # the boto3 client is only created by the first request
+        storage = pattern_storage.new_storage('s3', region_name = 'us-west-2')
+        self.assertTrue(storage.handler._conn is None)
+        self.assertRaises(pattern_storage.StorageError, pattern_storage.new_storage, 'ftp')
+
+if __name__ == '__main__':
+    unittest.main()
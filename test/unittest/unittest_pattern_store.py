@@ -0,0 +1,120 @@
+#!/bin/env python2.6
+import unittest
+import os
+import time
+import tempfile
+import shutil
+import pattern_store
+
+def write_file(path, content):
+    f = open(path, 'w')
+    f.write(content)
+    f.close()
+
+def read_file(path):
+    f = open(path, 'r')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+class UnitTestPatternStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = pattern_store.PatternStore(self.root, keep = 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def install(self, files):
+        stage_dir = self.store.new_stage_dir()
+        for (name, content) in files.items():
+            path = os.path.join(stage_dir, *name.split('/'))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            write_file(path, content)
+        return self.store.install_dir(stage_dir)
+
+    def count_objects(self):
+        return sum([len(file_names) for (dir_path, dir_names, file_names) in os.walk(self.store.objects_dir)])
+
+    def test_install(self):
+        (set_id, changed, added) = self.install({'a.txt': 'a', 'b.txt': 'a', 'overlay/c.txt': 'c'})
+        self.assertEqual((changed, added), (True, 2))
+        self.assertEqual(self.store.get_current(), set_id)
+        self.assertEqual(read_file(os.path.join(self.root, 'a.txt')), 'a')
+        self.assertEqual(read_file(os.path.join(self.root, 'overlay', 'c.txt')), 'c')
+        self.assertEqual(os.readlink(os.path.join(self.root, 'a.txt')), 'current/a.txt')
+        self.assertEqual(os.readlink(os.path.join(self.root, 'overlay')), 'current/overlay')
+        # the stage directory is moved into the store
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
+        self.assertEqual(sorted(os.listdir(self.root)), ['.store', 'a.txt', 'b.txt', 'current', 'overlay'])
+
+    def test_same_content(self):
+        (set_id, changed, added) = self.install({'a.txt': 'a', 'b.txt': 'b'})
+        object_path = os.path.realpath(os.path.join(self.root, 'a.txt'))
+        mtime = int(os.path.getmtime(object_path)) - 100
+        os.utime(object_path, (mtime, mtime))
+        # the same files are the same set, nothing is written
+        self.assertEqual(self.install({'a.txt': 'a', 'b.txt': 'b'}), (set_id, False, 0))
+        self.assertEqual(os.path.getmtime(os.path.join(self.root, 'a.txt')), mtime)
+        # a changed file only adds its own object
+        (new_set_id, changed, added) = self.install({'a.txt': 'a', 'b.txt': 'B'})
+        self.assertEqual((changed, added), (True, 1))
+        self.assertEqual(os.path.realpath(os.path.join(self.root, 'a.txt')), object_path)
+
+    def test_switch_names(self):
+        self.install({'ptn.gz': 'gz', 'overlay/c.gz': 'c'})
+        self.install({'ptn.bz2': 'bz2'})
+        # names of the previous set are removed, other files are left
+        write_file(os.path.join(self.root, 'other.txt'), 'other')
+        self.install({'ptn.xz': 'xz'})
+        self.assertEqual(sorted(os.listdir(self.root)), ['.store', 'current', 'other.txt', 'ptn.xz'])
+
+    def test_replace_files_of_old_layout(self):
+        write_file(os.path.join(self.root, 'a.txt'), 'old')
+        os.mkdir(os.path.join(self.root, 'overlay'))
+        write_file(os.path.join(self.root, 'overlay', 'c.txt'), 'old')
+        self.install({'a.txt': 'a', 'overlay/c.txt': 'c'})
+        self.assertEqual(read_file(os.path.join(self.root, 'a.txt')), 'a')
+        self.assertEqual(os.listdir(os.path.join(self.root, 'overlay')), ['c.txt'])
+        self.assertTrue(os.path.islink(os.path.join(self.root, 'overlay')))
+
+    def test_rollback(self):
+        self.assertRaises(pattern_store.PatternStoreError, self.store.rollback)
+        (first, changed, added) = self.install({'a.txt': '1', 'b.txt': '1'})
+        self.assertRaises(pattern_store.PatternStoreError, self.store.rollback)
+        (second, changed, added) = self.install({'a.txt': '2'})
+        self.assertEqual(self.store.get_history(), [first, second])
+        self.assertEqual(self.store.rollback(), first)
+        self.assertEqual(self.store.get_current(), first)
+        self.assertEqual(read_file(os.path.join(self.root, 'b.txt')), '1')
+        self.assertEqual(self.store.get_history(), [first])
+        # installing a set again moves it to the end of the history
+        self.install({'a.txt': '2'})
+        self.install({'a.txt': '1', 'b.txt': '1'})
+        self.assertEqual(self.store.get_history(), [second, first])
+
+    def test_prune(self):
+        for content in ('1', '2', '3'):
+            self.install({'a.txt': content, 'b.txt': 'shared'})
+        # keep is 2, the first set and its own object are deleted
+        self.assertEqual(len(self.store.get_history()), 2)
+        self.assertEqual(len(os.listdir(self.store.sets_dir)), 2)
+        self.assertEqual(self.count_objects(), 3)
+        stale_dir = self.store.new_stage_dir()
+        fresh_dir = self.store.new_stage_dir()
+        expired_time = time.time() - pattern_store.TMP_EXPIRE_SECONDS - 1
+        os.utime(stale_dir, (expired_time, expired_time))
+        self.store.prune()
+        self.assertEqual(os.listdir(self.store.tmp_dir), [os.path.basename(fresh_dir)])
+
+    def test_invalid(self):
+        self.assertRaises(pattern_store.PatternStoreError, self.store.install, {})
+        for name in ['current', '.store/x', '../x', '/x', 'a/../../x']:
+            self.assertRaises(pattern_store.PatternStoreError, self.store.install, {name: 'a' * 64})
+        self.assertRaises(pattern_store.PatternStoreError, self.store.install, {'a.txt': 'a' * 64})
+        self.assertRaises(pattern_store.PatternStoreError, pattern_store.PatternStore, os.path.join(self.root, 'missing'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/bin/env python2.6
+import unittest
+import os
+import tempfile
+import shutil
+import public_suffix_lookup
+import public_suffix_binary
+
+PATTERN_LINES = [
+    'com\t0\t-1',
+    'uk\t0\t-1',
+    'co.uk\t1\t5',
+    'ck\t0\t-1',
+    '*.ck\t2\t-1',
+    '!www.ck\t3\t-1',
+    'ck-foo\t0\t-1',
+    'jp\t0\t-1',
+    '*.kobe.jp\t0\t-1',
+    'a.kobe.jp\t6\t-1',
+    '*.winshipway.com\t4\t10',
+]
+
+HOSTNAMES = [
+    'www.example.com', 'a.b.co.uk', 'co.uk', 'uk', 'foo.ck', 'www.ck', 'a.www.ck', 'x.ck-foo',
+    'a.b.c.kobe.jp', 'a.kobe.jp', 'b.a.kobe.jp', 'kobe.jp', 'bar.foo.winshipway.com', 'example.test',
+    'WWW.Example.COM.', 'a..com', '',
+]
+
+class UnitTestPublicSuffixBinary(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'public_suffix.bin')
+        rules = public_suffix_lookup.iter_pattern_rules(PATTERN_LINES)
+        public_suffix_binary.write_binary_pattern(self.path, rules)
+        self.table = public_suffix_binary.BinaryPublicSuffixTable(self.path)
+        self.trie = public_suffix_lookup.PublicSuffixTable().load(PATTERN_LINES)
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_rule_count(self):
+        self.assertEqual(self.table.rule_count, len(PATTERN_LINES))
+
+    def test_keys_sorted(self):
+        keys = [self.table.key_at(i) for i in range(self.table.rule_count)]
+        self.assertEqual(keys, sorted(keys))
+        self.assertTrue('ck\x01www\x00' in keys)
+        self.assertTrue('ck\x01*' in keys)
+
+    def test_same_as_trie(self):
+        for hostname in HOSTNAMES:
+            self.assertEqual(self.table.lookup(hostname), self.trie.lookup(hostname), hostname)
+
+    def test_bad_magic(self):
+        bad_path = os.path.join(self.tmp_dir, 'bad.bin')
+        f = open(bad_path, 'wb')
+        f.write('X' * 64)
+        f.close()
+        self.assertRaises(public_suffix_binary.PublicSuffixBinaryError, public_suffix_binary.BinaryPublicSuffixTable, bad_path)
+
+if __name__ == '__main__':
+    unittest.main()
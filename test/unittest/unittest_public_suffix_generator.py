@@ -0,0 +1,408 @@
+#!/bin/env python2.6
+import unittest
+import os
+import sys
+import json
+import gzip
+import time
+import tempfile
+import shutil
+import subprocess
+import public_suffix_generator
+import public_suffix_lookup
+import pattern_manifest
+import pattern_codec
+import pattern_delta
+import conf_util
+
+MODULE_DIR = os.path.dirname(os.path.abspath(public_suffix_generator.__file__))
+# modules which are only imported by the commands which need them
+LAZY_MODULES = ['boto3', 'botocore', 'urllib2', 'multiprocessing']
+# generous bound, a regression which imports boto3 or urllib2 at startup is caught by the module check
+MAX_STARTUP_SECONDS = 2.0
+# peak memory of generate per rule of the input, about 400 bytes with Python 2.7 on 64-bit
+MAX_RULE_BYTES = 600
+MEMORY_TEST_RULES = 50000
+
+CONFIG = '''config['proxy'] = None
+config['proxy_port'] = None
+config['public_suffix_provider'] = 'file://%(root)s/upstream.dat'
+config['aws_s3_bucket'] = 'bucket'
+config['aws_s3_prefix'] = 'public_suffix'
+config['aws_s3_region'] = 'us-west-2'
+config['aws_s3_publish_targets'] = []
+config['aws_s3_connect_timeout'] = 30
+config['aws_s3_read_timeout'] = 60
+config['aws_s3_multipart_threshold'] = 16 * 1024 * 1024
+config['aws_s3_multipart_chunksize'] = 8 * 1024 * 1024
+config['aws_s3_max_concurrency'] = 4
+config['storage_backend'] = 'local'
+config['storage_local_root'] = 'storage'
+config['pattern_codec'] = '%(codec)s'
+config['pattern_codec_level'] = None
+config['pattern_canonical'] = True
+config['local_store_keep'] = 3
+config['retention_keep_last'] = 168
+config['retention_keep_days'] = 30
+config['watch_interval'] = 300
+config['metrics_report_path'] = 'metrics.json'
+config['metrics_prometheus_path'] = None
+config['log_level'] = 'ERROR'
+config['logger_name'] = 'unittest_public_suffix_generator'
+'''
+
+UPSTREAM = '''// ===BEGIN ICANN DOMAINS===
+com
+co.uk
+*.kawasaki.jp
+!city.kawasaki.jp
+\xe5\x8f\xb0\xe7\x81\xa3
+'''
+
+def write_file(path, content):
+    f = open(path, 'w')
+    f.write(content)
+    f.close()
+
+def gzip_lines(path):
+    f = gzip.open(path, 'rb')
+    try:
+        return f.readlines()
+    finally:
+        f.close()
+
+class UnitTestStartup(unittest.TestCase):
+    def test_import_startup(self):
+        # import in a new interpreter, so the modules loaded by other tests do not count
+        code = 'import time; start = time.time(); import public_suffix_generator, sys; print time.time() - start; print " ".join(sys.modules.keys())'
+        env = dict(os.environ)
+        env['PYTHONPATH'] = MODULE_DIR
+        start_time = time.time()
+        proc = subprocess.Popen([sys.executable, '-c', code], stdout = subprocess.PIPE, env = env)
+        (out, err) = proc.communicate()
+        startup_seconds = time.time() - start_time
+        self.assertEqual(proc.returncode, 0)
+        (import_seconds, modules) = out.splitlines()
+        sys.stderr.write('startup %.3fs, import public_suffix_generator %.3fs ... ' %(startup_seconds, float(import_seconds)))
+        for module in LAZY_MODULES:
+            self.assertFalse(module in modules.split(), '%s is imported at startup' % module)
+        self.assertTrue(startup_seconds < MAX_STARTUP_SECONDS)
+
+class UnitTestCommands(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        for dir_name in ('ptn', 'raw', 'custom', 'storage'):
+            os.mkdir(os.path.join(self.root, dir_name))
+        write_file(os.path.join(self.root, 'upstream.dat'), UPSTREAM)
+        write_file(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), 'example.test\n')
+        self.config_path = os.path.join(self.root, 'public_suffix_generator.conf')
+        self.write_config('gzip')
+        os.chdir(self.root)
+
+    def write_config(self, codec):
+        write_file(self.config_path, CONFIG % {'root': self.root, 'codec': codec})
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def new_generator(self):
+        psg = public_suffix_generator.public_suffix_generator(self.config_path)
+        # a file:// provider has no validators, answer like a provider which is not modified since the last download
+        download = psg.http_get_public_suffix_data
+        def http_get_public_suffix_data(public_suffix_provider, validators = None):
+            if validators:
+                psg.download_validators = {'etag': None, 'last_modified': None}
+                return None
+            return download(public_suffix_provider, validators)
+        psg.http_get_public_suffix_data = http_get_public_suffix_data
+        return psg
+
+    def read_report(self):
+        return json.load(open(os.path.join(self.root, 'metrics.json')))
+
+    def test_generate_publish_check(self):
+        psg = self.new_generator()
+        self.assertEqual(psg.run('generate'), 0)
+        self.assertEqual(self.read_report()['result'], 'generated')
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz')))
+        # generate does not access the publish targets
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'storage', 'bucket')))
+        self.assertEqual(self.new_generator().run('check'), 1)
+        self.assertEqual(self.new_generator().run('publish'), 0)
+        self.assertEqual(self.read_report()['result'], 'published')
+        keys = os.listdir(os.path.join(self.root, 'storage', 'bucket', 'public_suffix'))
+        self.assertTrue('public_suffix.manifest.json' in keys)
+        self.assertEqual(self.new_generator().run('check'), 0)
+        self.assertEqual(self.read_report()['result'], 'up_to_date')
+        # the pattern is published, so run has nothing to do
+        self.assertEqual(self.new_generator().run(), 0)
+        self.assertEqual(self.read_report()['result'], 'not_modified')
+
+    def test_publish_twice_in_a_minute(self):
+        self.assertEqual(self.new_generator().run(), 0)
+        write_file(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), 'example.test\nexample.new\n')
+        self.assertEqual(self.new_generator().run(), 0)
+        self.assertEqual(self.read_report()['result'], 'published')
+        manifest_path = os.path.join(self.root, 'storage', 'bucket', 'public_suffix', 'public_suffix.manifest.json')
+        manifest = pattern_manifest.loads(open(manifest_path).read())
+        self.assertEqual(len(manifest['versions']), 2)
+        self.assertEqual(self.read_report()['version'], manifest['latest'])
+        self.assertEqual(self.new_generator().run('check'), 0)
+
+    def test_publish_version(self):
+        now = 1792300000
+        version = public_suffix_generator.timestamp2str(now, public_suffix_generator.VERSION_TIME_FORMAT_MIN)
+        self.assertEqual(public_suffix_generator.get_publish_version(now, []), version)
+        self.assertEqual(public_suffix_generator.get_publish_version(now, [None, '201512090100']), version)
+        self.assertEqual(public_suffix_generator.get_publish_version(now, ['201512090100', version]), public_suffix_generator.timestamp2str(now + 60, public_suffix_generator.VERSION_TIME_FORMAT_MIN))
+        self.assertEqual(public_suffix_generator.get_publish_version(now, ['209912312359']), '210001010000')
+
+    def publish_gc_versions(self, psg):
+        # versions of 50, 40, 35, 20, 10 and 1 days ago, the last 4 are in the manifest with a delta and an overlay,
+        # the version of 40 days ago is only in the bucket with its delta and overlay, the version of 50 days ago only has an overlay
+        target = psg.publish_targets[0]
+        storage = psg.get_storage(target)
+        now = int(time.time())
+        versions = [public_suffix_generator.timestamp2str(now - days * 86400, public_suffix_generator.VERSION_TIME_FORMAT_MIN) for days in (50, 40, 35, 20, 10, 1)]
+        manifest = pattern_manifest.new_manifest()
+        version_keys = {}
+        for (index, version) in enumerate(versions):
+            keys = [pattern_manifest.get_overlay_key('public_suffix', 'tenant', version)]
+            if index > 0:
+                keys.append(pattern_manifest.get_pattern_key('public_suffix', version))
+                keys.append(pattern_delta.get_delta_key('public_suffix', versions[index - 1], version))
+            for key in keys:
+                storage.put('bucket', key, version)
+            version_keys[version] = sorted(keys)
+            if index > 1:
+                pattern_manifest.add_version(manifest, version, keys[1], delta = {'from': versions[index - 1], 'key': keys[2], 'size': 1},
+                                             overlays = {'tenant': {'key': keys[0], 'md5': None, 'size': 1}})
+        psg.put_publish_manifest(target, manifest)
+        return (versions, version_keys)
+
+    def list_gc_keys(self, psg):
+        keys = psg.get_storage(psg.publish_targets[0]).list('bucket', 'public_suffix')
+        keys.remove('public_suffix/public_suffix.manifest.json')
+        return keys
+
+    def read_gc_manifest(self, psg):
+        return [entry['version'] for entry in psg.get_publish_manifest(psg.publish_targets[0])['versions']]
+
+    def test_gc_keep_last(self):
+        psg = self.new_generator()
+        (versions, version_keys) = self.publish_gc_versions(psg)
+        self.assertEqual(psg.run_gc(keep_last = 2, keep_days = 0), 0)
+        # every key of an expired version is deleted, whether it is in the manifest or not
+        self.assertEqual(self.list_gc_keys(psg), sorted(version_keys[versions[-2]] + version_keys[versions[-1]]))
+        self.assertEqual(self.read_gc_manifest(psg), versions[-2:])
+        self.assertEqual(psg.run_gc(keep_last = 0, keep_days = 0), -1)
+
+    def test_gc_keep_days(self):
+        psg = self.new_generator()
+        (versions, version_keys) = self.publish_gc_versions(psg)
+        # the overlay of the first version and the 3 keys of the next 2 versions are deleted
+        self.assertEqual(psg.gc_target(psg.publish_targets[0], 0, 25, False), 7)
+        self.assertEqual(self.list_gc_keys(psg), sorted(version_keys[versions[-3]] + version_keys[versions[-2]] + version_keys[versions[-1]]))
+        self.assertEqual(self.read_gc_manifest(psg), versions[-3:])
+        # the latest version is always kept
+        self.assertEqual(psg.gc_target(psg.publish_targets[0], 0, 0, False), 6)
+        self.assertEqual(self.read_gc_manifest(psg), versions[-1:])
+        self.assertEqual(self.list_gc_keys(psg), version_keys[versions[-1]])
+
+    def test_gc_dry_run(self):
+        psg = self.new_generator()
+        (versions, version_keys) = self.publish_gc_versions(psg)
+        keys = self.list_gc_keys(psg)
+        # a dry run counts the expired versions
+        self.assertEqual(psg.gc_target(psg.publish_targets[0], 1, 0, True), 5)
+        self.assertEqual(psg.run_gc(keep_last = 1, keep_days = 0, dry_run = True), 0)
+        self.assertEqual(self.list_gc_keys(psg), keys)
+        self.assertEqual(self.read_gc_manifest(psg), versions[2:])
+
+    def test_run_after_generate(self):
+        # the pattern of generate is not published yet, so run generates and publishes it
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        self.assertEqual(self.new_generator().run(), 0)
+        self.assertEqual(self.read_report()['result'], 'published')
+
+    def test_dedupe(self):
+        write_file(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), 'example.test\nco.uk\na.kawasaki.jp\n!www.example.test\n')
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        lines = gzip_lines(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz'))
+        # the rules of each section in canonical order, a duplicated rule is in the section where it is listed last
+        rules = [line.split('\t')[0] for line in lines if '\t' in line]
+        self.assertEqual(rules, ['com', '*.kawasaki.jp', '!city.kawasaki.jp', 'xn--kpry57d', 'example.test', 'co.uk'])
+        stages = dict([(stage['name'], stage) for stage in self.read_report()['stages']])
+        self.assertEqual((stages['dedupe']['duplicate'], stages['dedupe']['redundant'], stages['dedupe']['orphan_exception']), (1, 1, 1))
+        self.assertEqual(stages['dedupe']['rules'], 6)
+
+    def test_memory_per_rule(self):
+        # in a new interpreter, so the peak RSS is only of this generate, the comments of the input are not held
+        code = """import sys, resource, public_suffix_generator
+psg = public_suffix_generator.public_suffix_generator(sys.argv[1])
+count = int(sys.argv[2])
+lines = ('// comment %d' % i if i % 2 else 'r%d.t%d' % (i, i % 100) for i in xrange(count * 2))
+start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+psg.generate_public_suffix_ptn(lines, sys.argv[3])
+print (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start) * 1024 / count"""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = MODULE_DIR
+        os.mkdir(os.path.join(self.root, 'out'))
+        proc = subprocess.Popen([sys.executable, '-c', code, self.config_path, str(MEMORY_TEST_RULES), os.path.join(self.root, 'out')], stdout = subprocess.PIPE, env = env)
+        (out, err) = proc.communicate()
+        self.assertEqual(proc.returncode, 0)
+        sys.stderr.write('%s bytes per rule ... ' % out.strip())
+        self.assertTrue(int(out) < MAX_RULE_BYTES)
+
+    def test_normalize_windows(self):
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        expected = gzip_lines(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz'))
+        # windows of 2 lines, and the non-ASCII labels of each window converted by the worker pool
+        (window_lines, pool_threshold) = (public_suffix_generator.NORMALIZE_WINDOW_LINES, public_suffix_generator.PUNY_CODE_POOL_THRESHOLD)
+        public_suffix_generator.NORMALIZE_WINDOW_LINES = 2
+        public_suffix_generator.PUNY_CODE_POOL_THRESHOLD = 1
+        try:
+            psg = self.new_generator()
+            os.mkdir(os.path.join(self.root, 'out'))
+            lines = iter(UPSTREAM.split('\n'))
+            psg.generate_public_suffix_ptn(lines, os.path.join(self.root, 'out'))
+        finally:
+            public_suffix_generator.NORMALIZE_WINDOW_LINES = window_lines
+            public_suffix_generator.PUNY_CODE_POOL_THRESHOLD = pool_threshold
+        self.assertTrue(psg.puny_code_pool is None)
+        self.assertEqual(psg.puny_code_stats['pool_labels'], 1)
+        rules = [line for line in gzip_lines(os.path.join(self.root, 'out', 'public_suffix.txt.gz')) if '\t' in line]
+        self.assertEqual(rules, [line for line in expected if '\t' in line and not line.startswith('example.test')])
+
+    def test_comments(self):
+        write_file(os.path.join(self.root, 'upstream.dat'), '// upstream \xc2\xa9\n' + UPSTREAM)
+        write_file(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), '// customer\nexample.test\nco.uk\n')
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        lines = [line.split('\t')[0].rstrip('\n') for line in gzip_lines(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz'))]
+        # a canonical pattern only keeps the section markers, the rules of each section are sorted
+        self.assertEqual(lines, public_suffix_generator.PUBLIC_SUFFIX_PTN_HEADER.splitlines() + ['// ===BEGIN ICANN DOMAINS===',
+                                 'com', '*.kawasaki.jp', '!city.kawasaki.jp', 'xn--kpry57d',
+                                 '// ===BEGIN WCS TESTKIT DOMAINS', 'example.test', 'co.uk', '// ===END WCS TESTKIT DOMAINS'])
+        write_file(self.config_path, (CONFIG % {'root': self.root, 'codec': 'gzip'}).replace("config['pattern_canonical'] = True", "config['pattern_canonical'] = False"))
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        lines = gzip_lines(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz'))
+        # a comment with a non-ASCII character is percent-encoded as a whole
+        self.assertEqual(lines[0], '//%20upstream%20%C2%A9\n')
+        # the comments stay before the rule they precede in the input, a duplicated rule is written where it is listed last
+        self.assertEqual([line.split('\t')[0].rstrip('\n') for line in lines[1:] if line.strip()],
+                         ['// ===BEGIN ICANN DOMAINS===', 'com', '*.kawasaki.jp', '!city.kawasaki.jp', 'xn--kpry57d',
+                          '// ===BEGIN WCS TESTKIT DOMAINS', '// customer', 'example.test', 'co.uk', '// ===END WCS TESTKIT DOMAINS'])
+
+    def test_tenant_overlays(self):
+        tenant_dir = os.path.join(self.root, 'custom', 'tenants')
+        os.mkdir(tenant_dir)
+        write_file(os.path.join(tenant_dir, 'acme.txt'), '// acme\n*.winshipway.com\ncom\n\xe5\x8f\xb0\xe5\x8c\x97.example\n')
+        write_file(os.path.join(tenant_dir, 'globex.txt'), 'globex.test\n')
+        write_file(os.path.join(tenant_dir, 'bad name.txt'), 'bad.test\n')
+        self.assertEqual(self.new_generator().run(), 0)
+        overlay_dir = os.path.join(self.root, 'ptn', 'overlay')
+        self.assertEqual(sorted(os.listdir(overlay_dir)), ['public_suffix.acme.txt.gz', 'public_suffix.globex.txt.gz'])
+        # the rules of the shared pattern are left out of an overlay
+        overlay_lines = gzip_lines(os.path.join(overlay_dir, 'public_suffix.acme.txt.gz'))
+        self.assertEqual(overlay_lines, ['*.winshipway.com\t0\t-1\n', 'xn--djrpt.example\t0\t-1\n'])
+        base = public_suffix_lookup.load_public_suffix_table(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz'))
+        acme = public_suffix_lookup.load_public_suffix_overlay(base, os.path.join(overlay_dir, 'public_suffix.acme.txt.gz'))
+        self.assertEqual(acme.lookup('a.b.winshipway.com'), ('b.winshipway.com', 'a.b.winshipway.com', 0, -1))
+        self.assertEqual(base.lookup('a.b.winshipway.com'), ('com', 'winshipway.com', 0, -1))
+        manifest_path = os.path.join(self.root, 'storage', 'bucket', 'public_suffix', 'public_suffix.manifest.json')
+        latest = pattern_manifest.get_latest(pattern_manifest.loads(open(manifest_path).read()))
+        self.assertEqual(sorted(latest['overlays'].keys()), ['acme', 'globex'])
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'storage', 'bucket', latest['overlays']['globex']['key'])))
+        self.assertEqual(self.new_generator().run('check'), 0)
+        # a changed overlay is a new version, a removed tenant has no overlay any more
+        os.remove(os.path.join(tenant_dir, 'globex.txt'))
+        self.assertEqual(self.new_generator().run('check'), 1)
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        self.assertEqual(os.listdir(overlay_dir), ['public_suffix.acme.txt.gz'])
+
+    def test_codecs(self):
+        tenant_dir = os.path.join(self.root, 'custom', 'tenants')
+        os.mkdir(tenant_dir)
+        write_file(os.path.join(tenant_dir, 'acme.txt'), '*.winshipway.com\n')
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        for (codec, extension) in [('bz2', '.bz2'), ('none', '')]:
+            self.write_config(codec)
+            # the rules are not changed, but a new codec is a new pattern
+            self.assertEqual(self.new_generator().run('check'), 1)
+            self.assertEqual(self.new_generator().run('generate'), 0)
+            ptn_path = os.path.join(self.root, 'ptn', 'public_suffix.txt' + extension)
+            overlay_path = os.path.join(self.root, 'ptn', 'overlay', 'public_suffix.acme.txt' + extension)
+            # a pattern of the previous codec is removed
+            self.assertEqual(os.listdir(os.path.join(self.root, 'ptn', 'overlay')), ['public_suffix.acme.txt' + extension])
+            self.assertFalse(os.path.exists(os.path.join(self.root, 'ptn', 'public_suffix.txt.gz')))
+            self.assertEqual(pattern_codec.detect_file(ptn_path), codec)
+            base = public_suffix_lookup.load_public_suffix_table(ptn_path)
+            acme = public_suffix_lookup.load_public_suffix_overlay(base, overlay_path)
+            self.assertEqual(base.lookup('a.city.kawasaki.jp'), ('kawasaki.jp', 'city.kawasaki.jp', 0, -1))
+            self.assertEqual(acme.lookup('a.b.winshipway.com')[0], 'b.winshipway.com')
+        self.assertEqual(self.new_generator().run('publish'), 0)
+        manifest_path = os.path.join(self.root, 'storage', 'bucket', 'public_suffix', 'public_suffix.manifest.json')
+        latest = pattern_manifest.get_latest(pattern_manifest.loads(open(manifest_path).read()))
+        self.assertEqual(latest['codec'], 'none')
+        self.assertEqual(pattern_manifest.parse_pattern_version(latest['key']), latest['version'])
+        self.assertTrue(latest['key'].endswith('.txt.%s' % latest['version']))
+        self.assertEqual(self.new_generator().run('check'), 0)
+        self.write_config('lzma')
+        if pattern_codec.is_available('lzma'):
+            self.assertEqual(self.new_generator().run('generate'), 0)
+            self.assertEqual(pattern_codec.detect_file(os.path.join(self.root, 'ptn', 'public_suffix.txt.xz')), 'lzma')
+        else:
+            self.assertRaises(conf_util.ConfigKeyError, public_suffix_generator.public_suffix_generator, self.config_path)
+
+    def test_local_store(self):
+        ptn_path = os.path.join(self.root, 'ptn', 'public_suffix.txt.gz')
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        first = self.read_report()['pattern_set']
+        self.assertEqual(os.readlink(ptn_path), 'current/public_suffix.txt.gz')
+        self.assertEqual(os.readlink(os.path.join(self.root, 'raw', 'download_public_suffix.txt')), 'current/download_public_suffix.txt')
+        object_path = os.path.realpath(ptn_path)
+        # the same rules are not installed again, e.g. a touched customer's public suffix
+        os.utime(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), (1, 1))
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        self.assertEqual(self.read_report()['pattern_set'], first)
+        self.assertEqual(os.path.realpath(ptn_path), object_path)
+        write_file(os.path.join(self.root, 'custom', 'customer_public_suffix.txt'), 'example.test\nexample.new\n')
+        self.assertEqual(self.new_generator().run('generate'), 0)
+        self.assertNotEqual(self.read_report()['pattern_set'], first)
+        self.assertTrue('example.new\t0\t-1\n' in gzip_lines(ptn_path))
+        # rollback installs the first pattern set again, and publish publishes it
+        self.assertEqual(self.new_generator().run('rollback'), 0)
+        self.assertEqual(self.read_report()['result'], 'rolled_back')
+        self.assertEqual(self.read_report()['pattern_set'], first)
+        self.assertEqual(os.path.realpath(ptn_path), object_path)
+        self.assertFalse('example.new\t0\t-1\n' in gzip_lines(ptn_path))
+        self.assertEqual(self.new_generator().run('publish'), 0)
+        self.assertEqual(self.new_generator().run('rollback'), -1)
+
+    def test_invalid_codec(self):
+        for (codec, level) in [('zip', 'None'), ('gzip', '0'), ('bz2', '10'), ('none', '1')]:
+            write_file(self.config_path, (CONFIG % {'root': self.root, 'codec': codec}).replace("config['pattern_codec_level'] = None", "config['pattern_codec_level'] = %s" % level))
+            self.assertRaises(conf_util.ConfigKeyError, public_suffix_generator.public_suffix_generator, self.config_path)
+
+    def test_check_closes_response(self):
+        psg = self.new_generator()
+        responses = []
+        download = psg.http_get_public_suffix_data
+        def http_get_public_suffix_data(public_suffix_provider, validators = None):
+            public_suffix_chunks = download(public_suffix_provider, validators)
+            responses.append(public_suffix_chunks.f)
+            return public_suffix_chunks
+        psg.http_get_public_suffix_data = http_get_public_suffix_data
+        self.assertEqual(psg.run('check'), 1)
+        # check only reads the response headers, the response is closed without reading it
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].fp, None)
+
+    def test_publish_without_pattern(self):
+        self.assertEqual(self.new_generator().run('publish'), -1)
+        self.assertEqual(self.read_report()['result'], 'failed')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/bin/env python2.6
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import public_suffix_lookup
+import public_suffix_log_enrich
+
+PATTERN_LINES = [
+    'com\t0\t-1',
+    'uk\t0\t-1',
+    'co.uk\t1\t5',
+    'ck\t0\t-1',
+    '*.ck\t2\t-1',
+]
+
+LOG_LINES = [
+    '1.2.3.4 - - [09/Dec/2015:01:00:00 +0000] "GET http://www.example.com/index.html HTTP/1.1" 200 512',
+    '1.2.3.4 - - [09/Dec/2015:01:00:01 +0000] "GET http://user@a.b.co.uk:8080/?q=1 HTTP/1.1" 200 128',
+    '1.2.3.4 - - [09/Dec/2015:01:00:02 +0000] "GET http://img.example.com/logo.png HTTP/1.1" 304 0',
+    '1.2.3.4 - - [09/Dec/2015:01:00:03 +0000] "GET http://10.0.0.1/ HTTP/1.1" 200 64',
+    '1.2.3.4 - - [09/Dec/2015:01:00:04 +0000] "GET http://foo.ck/ HTTP/1.1" 200 64',
+    'truncated line',
+]
+
+class UnitTestPublicSuffixLogEnrich(unittest.TestCase):
+    def setUp(self):
+        self.table = public_suffix_lookup.PublicSuffixTable().load(PATTERN_LINES)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_extract_host(self):
+        self.assertEqual(public_suffix_log_enrich.extract_host('http://user@www.example.com:8080/path?q=1'), 'www.example.com')
+        self.assertEqual(public_suffix_log_enrich.extract_host('www.example.com:8080'), 'www.example.com')
+        self.assertEqual(public_suffix_log_enrich.extract_host('"www.example.com"'), 'www.example.com')
+        self.assertEqual(public_suffix_log_enrich.extract_host('http://10.0.0.1/'), None)
+        self.assertEqual(public_suffix_log_enrich.extract_host('http://[::1]:80/'), None)
+        self.assertEqual(public_suffix_log_enrich.extract_host('/index.html'), None)
+
+    def test_enrich_lines(self):
+        (text, counts) = public_suffix_log_enrich.enrich_lines(self.table, LOG_LINES, 6)
+        lines = text.splitlines()
+        self.assertEqual(len(lines), len(LOG_LINES))
+        self.assertEqual(lines[0], LOG_LINES[0] + '\texample.com\t0\t-1')
+        self.assertEqual(lines[1], LOG_LINES[1] + '\tb.co.uk\t1\t5')
+        self.assertEqual(lines[3], LOG_LINES[3] + '\t-\t0\t-1')
+        self.assertEqual(lines[4], LOG_LINES[4] + '\t-\t2\t-1')
+        self.assertEqual(counts, {'example.com': 2, 'b.co.uk': 1, '-': 3})
+
+    def test_delimiter(self):
+        (text, counts) = public_suffix_log_enrich.enrich_lines(self.table, ['x\twww.example.com'], 1, '\t')
+        self.assertEqual(text, 'x\twww.example.com\texample.com\t0\t-1\n')
+
+    def test_format_counts(self):
+        self.assertEqual(public_suffix_log_enrich.format_counts({'b.com': 2, 'a.com': 2, 'c.com': 3}), 'c.com\t3\na.com\t2\nb.com\t2\n')
+
+    def test_enrich_logs_pool(self):
+        log_path = os.path.join(self.tmp_dir, 'access.log.gz')
+        f = gzip.open(log_path, 'wb')
+        for i in range(50):
+            f.write('\n'.join(LOG_LINES) + '\n')
+        f.close()
+        lines = list(public_suffix_log_enrich.iter_log_lines([log_path]))
+        (expected_text, expected_counts) = public_suffix_log_enrich.enrich_lines(self.table, lines, 6)
+        output_path = os.path.join(self.tmp_dir, 'enriched.gz')
+        output = public_suffix_log_enrich.open_log(output_path, 'wb')
+        counts = public_suffix_log_enrich.enrich_logs(self.table, public_suffix_log_enrich.iter_log_lines([log_path]), output, 6, processes = 2, chunk_size = 40)
+        output.close()
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual(counts['example.com'], 100)
+        self.assertEqual(gzip.open(output_path, 'rb').read(), expected_text)
+        # the settings are passed to the workers, not kept by the module of the parent
+        self.assertEqual(public_suffix_log_enrich._worker_args, None)
+
+    def test_enrich_logs_read_ahead(self):
+        read = []
+        written = []
+        class Output(object):
+            def write(self, text):
+                written.append(len(read))
+        def iter_lines():
+            for i in range(400):
+                read.append(i)
+                yield LOG_LINES[i % len(LOG_LINES)]
+        public_suffix_log_enrich.enrich_logs(self.table, iter_lines(), Output(), 6, processes = 2, chunk_size = 10)
+        self.assertEqual(len(written), 40)
+        # when chunk i is written, the chunks in flight and the chunk waiting for a free slot have been read
+        window = 2 * public_suffix_lookup.POOL_CHUNKS_PER_PROCESS
+        for (i, count) in enumerate(written):
+            self.assertTrue(count <= (i + window + 1) * 10)
+
+if __name__ == '__main__':
+    unittest.main()
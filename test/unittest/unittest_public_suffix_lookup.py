@@ -0,0 +1,197 @@
+#!/bin/env python2.6
+import unittest
+import public_suffix_lookup
+
+PATTERN_LINES = [
+    '// ===BEGIN ICANN DOMAINS===',
+    '',
+    'com\t0\t-1',
+    'uk\t0\t-1',
+    'co.uk\t1\t5',
+    'ck\t0\t-1',
+    '*.ck\t2\t-1',
+    '!www.ck\t3\t-1',
+    'jp\t0\t-1',
+    '*.kobe.jp\t0\t-1',
+    'xn--55qx5d.cn\t0\t-1',
+    '// ===BEGIN WCS TESTKIT DOMAINS',
+    '*.winshipway.com\t4\t10',
+]
+
+OVERLAY_LINES = [
+    '*.winshipway.com\t5\t20',
+    'example.com\t0\t-1',
+    '!city.kobe.jp\t0\t-1',
+    '*.www.ck\t0\t-1',
+    'tenant.test\t6\t-1',
+]
+
+OVERLAY_HOSTNAMES = ['www.example.com', 'a.b.example.com', 'a.winshipway.com', 'b.a.winshipway.com', 'a.b.c.kobe.jp', 'x.city.kobe.jp',
+                     'www.ck', 'a.www.ck', 'foo.ck', 'a.tenant.test', 'tenant.test', 'a.b.co.uk', 'example.org', 'com', '']
+
+class UnitTestPublicSuffixLookup(unittest.TestCase):
+    def setUp(self):
+        self.table = public_suffix_lookup.PublicSuffixTable().load(PATTERN_LINES)
+
+    def tearDown(self):
+        pass
+
+    def test_rule_count(self):
+        self.assertEqual(self.table.rule_count, 10)
+
+    def test_normal_rule(self):
+        self.assertEqual(self.table.lookup('www.example.com'), ('com', 'example.com', 0, -1))
+
+    def test_longest_match(self):
+        self.assertEqual(self.table.lookup('a.b.co.uk'), ('co.uk', 'b.co.uk', 1, 5))
+
+    def test_wildcard_rule(self):
+        self.assertEqual(self.table.lookup('a.b.c.kobe.jp'), ('c.kobe.jp', 'b.c.kobe.jp', 0, -1))
+        self.assertEqual(self.table.lookup('foo.ck'), ('foo.ck', None, 2, -1))
+        self.assertEqual(self.table.lookup('bar.foo.winshipway.com'), ('foo.winshipway.com', 'bar.foo.winshipway.com', 4, 10))
+
+    def test_exception_rule(self):
+        self.assertEqual(self.table.lookup('www.ck'), ('ck', 'www.ck', 3, -1))
+        self.assertEqual(self.table.lookup('a.www.ck'), ('ck', 'www.ck', 3, -1))
+
+    def test_default_rule(self):
+        self.assertEqual(self.table.lookup('example.test'), ('test', 'example.test', 0, -1))
+
+    def test_public_suffix_host(self):
+        self.assertEqual(self.table.lookup('co.uk'), ('co.uk', None, 1, 5))
+
+    def test_normalize_hostname(self):
+        self.assertEqual(self.table.lookup('WWW.Example.COM.'), ('com', 'example.com', 0, -1))
+        self.assertEqual(self.table.lookup(u'\u98df\u72ee.\u516c\u53f8.cn'), ('xn--55qx5d.cn', 'xn--85x722f.xn--55qx5d.cn', 0, -1))
+        self.assertEqual(self.table.lookup(''), None)
+
+    def test_empty_label(self):
+        self.assertEqual(self.table.lookup('a..com'), ('com', '.com', 0, -1))
+
+    def test_invalid_line(self):
+        self.assertRaises(public_suffix_lookup.PublicSuffixRuleError, public_suffix_lookup.parse_rule_line, 'com\tx\t-1')
+
+    def test_resolve_many(self):
+        hostnames = ['www.example.com', 'a.b.co.uk', 'www.ck', 'foo.ck', 'a.b.c.kobe.jp', 'example.test', 'co.uk', 'com', '', 'WWW.EXAMPLE.COM', 'www.example.com']
+        self.assertEqual(self.table.resolve_many(hostnames), [self.table.lookup(hostname) for hostname in hostnames])
+
+    def test_resolve_many_pool(self):
+        hostnames = ['h%d.example%d.co.uk' % (i, i % 7) for i in range(100)] + ['x%d.ck' % i for i in range(100)]
+        pool = public_suffix_lookup.new_resolve_pool(self.table, 2)
+        try:
+            results = self.table.resolve_many(hostnames, pool, chunk_size = 30)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, [self.table.lookup(hostname) for hostname in hostnames])
+        # the table is passed to the workers, not kept by the module of the parent
+        self.assertEqual(public_suffix_lookup._worker_table, None)
+
+    def test_imap_window(self):
+        consumed = []
+        def iter_chunks():
+            for i in range(20):
+                consumed.append(i)
+                yield ['h%d.example.co.uk' % i]
+        window = 2 * public_suffix_lookup.POOL_CHUNKS_PER_PROCESS
+        pool = public_suffix_lookup.new_resolve_pool(self.table, 2)
+        try:
+            for (i, results) in enumerate(public_suffix_lookup.imap_window(pool, public_suffix_lookup._resolve_chunk, iter_chunks())):
+                self.assertEqual(results, [self.table.lookup('h%d.example.co.uk' % i)])
+                # the chunk of the result, the chunks in flight and the chunk waiting for a free slot
+                self.assertTrue(len(consumed) <= i + window + 1)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(len(consumed), 20)
+
+    def test_resolve_pools_of_tables(self):
+        hostnames = ['h%d.example.test' % i for i in range(100)]
+        other_table = public_suffix_lookup.PublicSuffixTable().load(['example.test\t3\t4'])
+        pools = [public_suffix_lookup.new_resolve_pool(self.table, 1), public_suffix_lookup.new_resolve_pool(other_table, 1)]
+        try:
+            for (table, pool) in zip([self.table, other_table], pools):
+                self.assertEqual(table.resolve_many(hostnames, pool, chunk_size = 30), table.resolve_many(hostnames))
+        finally:
+            for pool in pools:
+                pool.close()
+                pool.join()
+
+    def test_remove_rule(self):
+        self.assertEqual(self.table.remove_rule('*.kobe.jp'), True)
+        self.assertEqual(self.table.rule_count, 9)
+        self.assertEqual('kobe' in self.table.root['jp'], False)
+        self.assertEqual(self.table.lookup('a.b.c.kobe.jp'), ('jp', 'kobe.jp', 0, -1))
+        self.assertEqual(self.table.remove_rule('!www.ck'), True)
+        self.assertEqual(self.table.lookup('www.ck'), ('www.ck', None, 2, -1))
+        self.assertEqual(self.table.remove_rule('www.ck'), False)
+        self.assertEqual(self.table.remove_rule('example.org'), False)
+
+    def test_lru_cache(self):
+        cache = public_suffix_lookup.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'size': 2, 'entries': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+        self.assertRaises(public_suffix_lookup.PublicSuffixLookupError, public_suffix_lookup.LRUCache, 0)
+
+    def test_lookup_cache(self):
+        table = public_suffix_lookup.PublicSuffixTable(cache_size = 2).load(PATTERN_LINES)
+        self.assertEqual(self.table.cache_stats(), None)
+        for hostname in ['www.example.com', 'www.example.com', 'a.b.co.uk', 'foo.ck', 'www.example.com']:
+            self.assertEqual(table.lookup(hostname), self.table.lookup(hostname))
+        self.assertEqual(table.cache_stats(), {'size': 2, 'entries': 2, 'hits': 1, 'misses': 4, 'evictions': 2})
+
+    def test_lookup_cache_invalidation(self):
+        table = public_suffix_lookup.PublicSuffixTable(cache_size = 10).load(PATTERN_LINES)
+        self.assertEqual(table.lookup('www.example.test'), ('test', 'example.test', 0, -1))
+        table.load(['test\t7\t1'])
+        self.assertEqual(table.cache_stats()['entries'], 0)
+        self.assertEqual(table.lookup('www.example.test'), ('test', 'example.test', 7, 1))
+        # a load clears the cache once, not once per rule
+        clears = []
+        clear = table.cache.clear
+        def count_clear():
+            clears.append(1)
+            clear()
+        table.cache.clear = count_clear
+        table.load(PATTERN_LINES)
+        self.assertEqual(len(clears), 1)
+        table.add_rule('example.test')
+        self.assertEqual(len(clears), 2)
+
+class UnitTestPublicSuffixOverlay(unittest.TestCase):
+    def setUp(self):
+        self.base = public_suffix_lookup.PublicSuffixTable().load(PATTERN_LINES)
+        self.overlay = public_suffix_lookup.PublicSuffixOverlayTable(self.base).load(OVERLAY_LINES)
+        # a table of both patterns is the reference of the overlay
+        self.merged = public_suffix_lookup.PublicSuffixTable().load(PATTERN_LINES + OVERLAY_LINES)
+
+    def test_lookup(self):
+        for hostname in OVERLAY_HOSTNAMES:
+            self.assertEqual(self.overlay.lookup(hostname), self.merged.lookup(hostname))
+        self.assertEqual(self.overlay.lookup('a.winshipway.com'), ('a.winshipway.com', None, 5, 20))
+        self.assertEqual(self.overlay.lookup('x.city.kobe.jp'), ('kobe.jp', 'city.kobe.jp', 0, -1))
+
+    def test_resolve_many(self):
+        self.assertEqual(self.overlay.resolve_many(OVERLAY_HOSTNAMES), [self.merged.lookup(hostname) for hostname in OVERLAY_HOSTNAMES])
+
+    def test_shared_base(self):
+        other = public_suffix_lookup.PublicSuffixOverlayTable(self.base).load(['other.test\t1\t1'])
+        self.assertEqual(self.overlay.rule_count, 5)
+        self.assertTrue(other.base is self.overlay.base)
+        # the base is not changed by its overlays
+        self.assertEqual(self.base.rule_count, 10)
+        self.assertEqual(self.base.lookup('a.tenant.test'), ('test', 'tenant.test', 0, -1))
+        self.assertEqual(other.lookup('a.tenant.test'), ('test', 'tenant.test', 0, -1))
+        self.assertEqual(other.lookup('a.other.test'), ('other.test', 'a.other.test', 1, 1))
+        self.assertEqual(self.overlay.remove_rule('com'), False)
+        self.assertEqual(self.overlay.lookup('www.example.com'), self.merged.lookup('www.example.com'))
+        self.assertRaises(public_suffix_lookup.PublicSuffixLookupError, public_suffix_lookup.PublicSuffixOverlayTable, other)
+
+if __name__ == '__main__':
+    unittest.main()
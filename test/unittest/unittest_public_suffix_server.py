@@ -0,0 +1,215 @@
+#!/bin/env python2.6
+import gzip
+import hashlib
+import httplib
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import aws_s3_util
+import pattern_delta
+import public_suffix_lookup
+import public_suffix_server
+
+PATTERN = 'com\t0\t-1\nuk\t0\t-1\nco.uk\t1\t5\n'
+NEW_PATTERN = PATTERN + 'example.com\t2\t3\n'
+# a pattern which is larger than its deltas
+LARGE_PATTERN = ''.join(['d%d.com\t0\t-1\n' % i for i in range(2000)])
+
+def write_pattern(path, content):
+    f = gzip.open(path, 'wb')
+    f.write(content)
+    f.close()
+
+class FakeS3Client(object):
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = 0
+        self.not_modified = 0
+
+    def get_s3_file_content(self, bucket_name, dst_key, kwargs = {}):
+        return self.objects[dst_key]
+
+    def get_s3_file_content_if_modified(self, bucket_name, dst_key, etag = None, kwargs = {}):
+        content = self.objects[dst_key]
+        new_etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if etag == new_etag:
+            self.not_modified += 1
+            raise aws_s3_util.AWS_S3NotModifiedError('304')
+        return (content, new_etag)
+
+    def cp_s3_file_to_local(self, bucket_name, src_path, dst_key, kwargs = {}):
+        self.downloads += 1
+        f = open(src_path, 'wb')
+        f.write(self.objects[dst_key])
+        f.close()
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+class UnitTestPublicSuffixServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ptn_path = os.path.join(self.tmp_dir, 'public_suffix.txt.gz')
+        write_pattern(self.ptn_path, PATTERN)
+        self.logger = logging.getLogger('unittest_public_suffix_server')
+        self.service = public_suffix_server.PublicSuffixService(public_suffix_server.LocalPatternSource(self.ptn_path), self.logger)
+        self.service.reload()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def request(self, conn, method, path, body = None):
+        conn.request(method, path, body)
+        resp = conn.getresponse()
+        content = json.loads(resp.read())
+        conn.close()
+        return (resp.status, content)
+
+    def serve(self, server):
+        thread = threading.Thread(target = server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def test_lookup(self):
+        self.assertEqual(self.service.lookup(['www.example.co.uk', '']), [
+            {'host': 'www.example.co.uk', 'public_suffix': 'co.uk', 'registrable_domain': 'example.co.uk', 'flag': 1, 'threshold': 5},
+            {'host': '', 'public_suffix': None, 'registrable_domain': None, 'flag': None, 'threshold': None}])
+
+    def test_reload(self):
+        (table, version, load_time) = self.service.state
+        self.assertEqual(self.service.reload(), False)
+        write_pattern(self.ptn_path, NEW_PATTERN)
+        os.utime(self.ptn_path, (load_time + 10, load_time + 10))
+        self.assertEqual(self.service.reload(), True)
+        self.assertNotEqual(self.service.state[0], table)
+        self.assertEqual(self.service.lookup(['a.example.com'])[0]['flag'], 2)
+        self.assertEqual(table.lookup('a.example.com')[2], 0)
+
+    def test_reload_failure_keeps_table(self):
+        state = self.service.state
+        os.remove(self.ptn_path)
+        self.assertEqual(self.service.try_reload(), False)
+        self.assertEqual(self.service.state, state)
+
+    def test_s3_source(self):
+        key = 'prefix/public_suffix.txt.201512090100.gz'
+        write_pattern(self.ptn_path, NEW_PATTERN)
+        manifest = {'latest': '201512090100', 'versions': [{'version': '201512090100', 'key': key, 'md5': hashlib.md5(NEW_PATTERN).hexdigest(), 'size': None, 'timestamp': None}]}
+        s3_client = FakeS3Client({'prefix/public_suffix.manifest.json': json.dumps(manifest), key: open(self.ptn_path, 'rb').read()})
+        source = public_suffix_server.S3PatternSource(s3_client, 'bucket', 'prefix', self.tmp_dir)
+        service = public_suffix_server.PublicSuffixService(source, self.logger)
+        self.assertEqual(service.reload(), True)
+        self.assertEqual(service.status()['version'], '201512090100')
+        # the manifest is not modified
+        self.assertEqual(service.reload(), False)
+        self.assertEqual(s3_client.not_modified, 1)
+        self.assertEqual(s3_client.downloads, 1)
+
+    def test_s3_source_md5_mismatch(self):
+        key = 'prefix/public_suffix.txt.201512090100.gz'
+        manifest = {'latest': '201512090100', 'versions': [{'version': '201512090100', 'key': key, 'md5': '0' * 32, 'size': None, 'timestamp': None}]}
+        s3_client = FakeS3Client({'prefix/public_suffix.manifest.json': json.dumps(manifest), key: open(self.ptn_path, 'rb').read()})
+        source = public_suffix_server.S3PatternSource(s3_client, 'bucket', 'prefix', self.tmp_dir)
+        source.get_latest_version()
+        self.assertRaises(public_suffix_server.PublicSuffixSourceError, source.fetch, '201512090100')
+        self.assertEqual(os.path.exists(os.path.join(self.tmp_dir, os.path.basename(key))), False)
+
+    def test_s3_source_delta(self):
+        objects = {}
+        versions = []
+        previous = None
+        for (version, content) in [('201512090100', LARGE_PATTERN), ('201512090200', LARGE_PATTERN + NEW_PATTERN), ('201512090300', LARGE_PATTERN + PATTERN)]:
+            key = 'prefix/public_suffix.txt.%s.gz' % version
+            write_pattern(self.ptn_path, content)
+            objects[key] = open(self.ptn_path, 'rb').read()
+            rules = list(public_suffix_lookup.iter_pattern_rules(content.splitlines(True)))
+            entry = {'version': version, 'key': key, 'md5': hashlib.md5(content).hexdigest(), 'size': len(objects[key]), 'timestamp': None, 'delta': None}
+            if previous is not None:
+                delta_key = pattern_delta.get_delta_key('prefix', previous[0], version)
+                objects[delta_key] = pattern_delta.dumps(pattern_delta.compute_delta(previous[1], rules, previous[0], version))
+                entry['delta'] = {'from': previous[0], 'key': delta_key, 'size': len(objects[delta_key]),
+                                  'md5': pattern_delta.get_rules_md5(pattern_delta.get_rule_records(rules))}
+            versions.append(entry)
+            previous = (version, rules)
+        objects['prefix/public_suffix.manifest.json'] = json.dumps({'latest': '201512090100', 'versions': versions[:1]})
+        s3_client = FakeS3Client(objects)
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(cache_dir)
+        service = public_suffix_server.PublicSuffixService(public_suffix_server.S3PatternSource(s3_client, 'bucket', 'prefix', cache_dir), self.logger)
+        self.assertEqual(service.reload(), True)
+        # the deltas of the next versions are applied to the fetched pattern
+        objects['prefix/public_suffix.manifest.json'] = json.dumps({'latest': '201512090300', 'versions': versions})
+        self.assertEqual(service.reload(), True)
+        self.assertEqual(s3_client.downloads, 1)
+        self.assertEqual(service.status()['version'], '201512090300')
+        self.assertEqual(service.lookup(['www.example.com'])[0]['flag'], 0)
+        self.assertEqual(service.lookup(['a.co.uk'])[0]['threshold'], 5)
+        # a delta which is not verified falls back to the full download
+        versions.append(dict(versions[-1], version = '201512090400', delta = dict(versions[-1]['delta'], **{'from': '201512090300', 'md5': '0' * 32})))
+        objects['prefix/public_suffix.manifest.json'] = json.dumps({'latest': '201512090400', 'versions': versions})
+        self.assertEqual(service.reload(), True)
+        self.assertEqual(s3_client.downloads, 2)
+        self.assertEqual(service.status()['version'], '201512090400')
+        self.assertEqual(os.listdir(cache_dir), ['public_suffix.txt.201512090300.gz'])
+
+    def test_s3_source_prune(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(cache_dir)
+        for name in ('other.txt', 'public_suffix.txt.201512080100.gz', 'public_suffix.txt.201512080200.gz.patch', 'public_suffix.txt.201512080300.gz.patch.tmp'):
+            open(os.path.join(cache_dir, name), 'w').close()
+        objects = {}
+        versions = []
+        for (version, content) in [('201512090100', PATTERN), ('201512090200', NEW_PATTERN)]:
+            key = 'prefix/public_suffix.txt.%s.gz' % version
+            write_pattern(self.ptn_path, content)
+            objects[key] = open(self.ptn_path, 'rb').read()
+            versions.append({'version': version, 'key': key, 'md5': hashlib.md5(content).hexdigest(), 'size': len(objects[key]), 'timestamp': None})
+            objects['prefix/public_suffix.manifest.json'] = json.dumps({'latest': version, 'versions': versions})
+            service = public_suffix_server.PublicSuffixService(public_suffix_server.S3PatternSource(FakeS3Client(objects), 'bucket', 'prefix', cache_dir), self.logger)
+            self.assertEqual(service.reload(), True)
+            # only the pattern of the loaded version is kept in the cache
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['other.txt', 'public_suffix.txt.%s.gz' % version])
+
+    def test_http_server(self):
+        server = public_suffix_server.new_server(self.service, '127.0.0.1:0')
+        self.serve(server)
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+            (status, content) = self.request(conn, 'GET', '/lookup?host=www.example.com&host=co.uk')
+            self.assertEqual(status, 200)
+            self.assertEqual([item['registrable_domain'] for item in content], ['example.com', None])
+            (status, content) = self.request(conn, 'POST', '/lookup', 'www.example.com\n\nb.a.co.uk\n')
+            self.assertEqual([item['registrable_domain'] for item in content], ['example.com', 'a.co.uk'])
+            (status, content) = self.request(conn, 'GET', '/status')
+            self.assertEqual(content['rule_count'], 3)
+            (status, content) = self.request(conn, 'GET', '/lookup')
+            self.assertEqual(status, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_unix_server(self):
+        socket_path = os.path.join(self.tmp_dir, 'public_suffix.sock')
+        server = public_suffix_server.new_server(self.service, socket_path = socket_path)
+        self.serve(server)
+        try:
+            (status, content) = self.request(UnixHTTPConnection(socket_path), 'GET', '/lookup?host=www.example.com')
+            self.assertEqual(status, 200)
+            self.assertEqual(content[0]['public_suffix'], 'com')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/bin/env python2.6
+import unittest
+import os
+import json
+import tempfile
+import shutil
+import time
+import run_metrics
+
+class UnitTestRunMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stage(self):
+        metrics = run_metrics.RunMetrics()
+        with metrics.stage('generate') as stage:
+            time.sleep(0.02)
+            stage['rules'] = 10
+        metrics.add('generate', 'rules', 5)
+        report = metrics.report(result = 'published')
+        self.assertEqual(report['result'], 'published')
+        self.assertEqual([stage['name'] for stage in report['stages']], ['generate'])
+        stage = report['stages'][0]
+        self.assertEqual(stage['rules'], 15)
+        self.assertTrue(stage['seconds'] >= 0.02)
+        self.assertTrue(stage['peak_rss'] > 0)
+        self.assertTrue(report['seconds'] >= stage['seconds'])
+
+    def test_nested_stages(self):
+        # an inner stage pauses the outer stage, so a streamed pipeline is measured stage by stage
+        def slow_chunks():
+            for i in range(3):
+                time.sleep(0.02)
+                yield 'x' * 10
+        metrics = run_metrics.RunMetrics()
+        with metrics.stage('merge'):
+            chunks = list(metrics.iter_stage('download', slow_chunks(), 'bytes_in'))
+        self.assertEqual(len(chunks), 3)
+        report = metrics.report()
+        stages = dict([(stage['name'], stage) for stage in report['stages']])
+        self.assertEqual(stages['download']['bytes_in'], 30)
+        self.assertTrue(stages['download']['seconds'] >= 0.06)
+        self.assertTrue(stages['merge']['seconds'] < 0.02)
+
+    def test_iter_stage(self):
+        # the time is added per item, peak_rss only once the items are read or left
+        metrics = run_metrics.RunMetrics()
+        items = metrics.iter_stage('read', iter(['ab', 'c']), 'bytes_in')
+        self.assertEqual(items.next(), 'ab')
+        self.assertEqual(metrics.running, [])
+        self.assertFalse('peak_rss' in metrics.stages['read'])
+        self.assertEqual(list(items), ['c'])
+        self.assertEqual(metrics.stages['read']['bytes_in'], 3)
+        self.assertTrue(metrics.stages['read']['peak_rss'] > 0)
+        items = metrics.iter_stage('download', iter(['x', 'y']))
+        items.next()
+        items.close()
+        self.assertTrue(metrics.stages['download']['peak_rss'] > 0)
+        self.assertEqual(metrics.running, [])
+
+    def test_stage_exception(self):
+        metrics = run_metrics.RunMetrics()
+        try:
+            with metrics.stage('publish'):
+                raise ValueError('fail')
+        except ValueError:
+            pass
+        self.assertEqual(metrics.running, [])
+        self.assertEqual(metrics.report()['stages'][0]['name'], 'publish')
+
+    def test_format_prometheus(self):
+        metrics = run_metrics.RunMetrics()
+        with metrics.stage('gzip'):
+            pass
+        metrics.add('gzip', 'bytes_out', 100)
+        storage = {'put_object': {'requests': 2, 'errors': 0, 'retries': 1, 'seconds': 0.5, 'max_seconds': 0.3}}
+        content = run_metrics.format_prometheus(metrics.report(returncode = -1, storage = storage), 'psg')
+        lines = content.splitlines()
+        self.assertTrue('psg_last_run_success 0' in lines)
+        self.assertTrue('psg_stage_bytes_out{stage="gzip"} 100' in lines)
+        self.assertTrue('psg_storage_retries{operation="put_object"} 1' in lines)
+        self.assertTrue('psg_storage_request_seconds_max{operation="put_object"} 0.300000' in lines)
+        self.assertTrue('# TYPE psg_stage_seconds gauge' in lines)
+
+    def test_write_file(self):
+        path = os.path.join(self.tmp_dir, 'report.json')
+        report = run_metrics.RunMetrics().report(result = 'unchanged')
+        run_metrics.write_file(path, run_metrics.dumps(report))
+        self.assertEqual(json.load(open(path))['result'], 'unchanged')
+        self.assertFalse(os.path.exists('%s.tmp' % path))
+
+if __name__ == '__main__':
+    unittest.main()